@@ -0,0 +1,268 @@
+"""Autenticação centralizada: extração/validação do JWT e dependências do FastAPI.
+
+O token vem do cookie `access_token` ou do header `Authorization: Bearer`.
+
+- As claims validadas ficam num LRU (`AUTH_CACHE_TOKENS` entradas) indexado pelo
+  SHA-256 do token até o `exp`; requisições repetidas do mesmo tablet não
+  refazem a verificação da assinatura.
+- O usuário (campos básicos, não o objeto ORM) fica em cache por
+  `AUTH_CACHE_USUARIO_SEGUNDOS`; updates/deletes de `User` pela sessão invalidam a
+  entrada. Em vários workers o TTL limita quanto tempo um worker vê dados antigos.
+- Dentro de um request o token é decodificado uma única vez (`request.state`).
+"""
+import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import jwt
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import Session as SessionLocal, get_db
+
+JWT_SECRET = os.environ.get('JWT_SECRET', 'devsecret')
+JWT_ALGORITMO = 'HS256'
+JWT_EXP_MINUTES = int(os.environ.get('JWT_EXP_MINUTES', '1440'))
+AUTH_CACHE_TOKENS = int(os.environ.get('AUTH_CACHE_TOKENS', '1024'))
+AUTH_CACHE_USUARIO_SEGUNDOS = float(os.environ.get('AUTH_CACHE_USUARIO_SEGUNDOS', '30'))
+
+
+@dataclass(frozen=True)
+class UsuarioAutenticado:
+    id: int
+    username: str
+    email: str
+    nome: str
+    tipo: str
+    is_active: bool
+    is_superuser: bool
+
+    @classmethod
+    def de_modelo(cls, u: models.User) -> 'UsuarioAutenticado':
+        return cls(
+            id=u.id,
+            username=u.username,
+            email=u.email,
+            nome=u.nome,
+            tipo=u.tipo.value if hasattr(u.tipo, 'value') else str(u.tipo),
+            is_active=bool(u.is_active) if u.is_active is not None else True,
+            is_superuser=bool(u.is_superuser),
+        )
+
+    def publico(self) -> Dict[str, Any]:
+        """Campos retornados por /auth/me e /auth."""
+        return {'id': self.id, 'username': self.username, 'email': self.email, 'nome': self.nome, 'tipo': self.tipo}
+
+
+# ----- Caches -----
+class CacheClaims:
+    """LRU de claims já validadas, indexado pelo hash do token e válido até o `exp`."""
+
+    def __init__(self, max_entradas: int = AUTH_CACHE_TOKENS):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._entradas: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, chave: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] <= time.time():
+                if entrada is not None:
+                    del self._entradas[chave]
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, chave: str, claims: Dict[str, Any]) -> None:
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entradas[chave] = (float(exp), claims)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entradas': len(self._entradas), 'max_entradas': self.max_entradas, 'hits': self.hits, 'misses': self.misses}
+
+
+class CacheUsuarios:
+    """Usuários autenticados por id, com TTL curto e invalidação explícita."""
+
+    def __init__(self, ttl: float = AUTH_CACHE_USUARIO_SEGUNDOS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas: Dict[int, Tuple[float, UsuarioAutenticado]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, user_id: int) -> Optional[UsuarioAutenticado]:
+        with self._lock:
+            entrada = self._entradas.get(user_id)
+            if entrada is None or entrada[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, usuario: UsuarioAutenticado) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entradas[usuario.id] = (time.monotonic() + self.ttl, usuario)
+
+    def invalidar(self, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(user_id, None)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'entradas': len(self._entradas), 'ttl_segundos': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+cache_claims = CacheClaims()
+cache_usuarios = CacheUsuarios()
+
+
+def _usuario_alterado(mapper, connection, target) -> None:
+    cache_usuarios.invalidar(target.id)
+
+
+def _apos_commit(session) -> None:
+    # Invalida de novo após o commit: um request concorrente pode ter recarregado
+    # o usuário entre o flush e o commit
+    for user_id in session.info.pop('usuarios_alterados', ()):
+        cache_usuarios.invalidar(user_id)
+
+
+def _apos_flush(session, flush_context) -> None:
+    alterados = [o.id for o in list(session.dirty) + list(session.deleted) if isinstance(o, models.User)]
+    if alterados:
+        session.info.setdefault('usuarios_alterados', set()).update(alterados)
+
+
+event.listen(models.User, 'after_update', _usuario_alterado)
+event.listen(models.User, 'after_delete', _usuario_alterado)
+event.listen(SessionLocal, 'after_flush', _apos_flush)
+event.listen(SessionLocal, 'after_commit', _apos_commit)
+
+
+# ----- Tokens -----
+def emitir_token(user) -> str:
+    """JWT para `user` (modelo ou `UsuarioAutenticado`: só usa `id` e `email`)."""
+    payload_jwt = {
+        'sub': str(user.id),
+        'email': user.email,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=JWT_EXP_MINUTES),
+    }
+    return jwt.encode(payload_jwt, JWT_SECRET, algorithm=JWT_ALGORITMO)
+
+
+def extrair_token(request: Request) -> Optional[str]:
+    # tentar cookie primeiro; depois header Authorization: Bearer <token>
+    token = request.cookies.get('access_token')
+    if not token:
+        auth = request.headers.get('Authorization') or ''
+        if auth.lower().startswith('bearer '):
+            token = auth.split(' ', 1)[1]
+    return token or None
+
+
+def decodificar(token: str) -> Dict[str, Any]:
+    """Valida o token e retorna as claims (levanta as exceções do PyJWT se inválido)."""
+    chave = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    claims = cache_claims.obter(chave)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITMO])
+        cache_claims.guardar(chave, claims)
+    return claims
+
+
+_SEM_TOKEN = object()
+
+
+def _claims_do_request(request: Request):
+    """Claims do request (decodificadas uma vez por request); `_SEM_TOKEN` ou exceção do PyJWT."""
+    memo = getattr(request.state, 'auth_claims', None)
+    if memo is None:
+        token = extrair_token(request)
+        if not token:
+            memo = _SEM_TOKEN
+        else:
+            try:
+                memo = decodificar(token)
+            except jwt.PyJWTError as e:
+                memo = e
+        request.state.auth_claims = memo
+    return memo
+
+
+def _user_id(claims: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(claims.get('sub'))
+    except (TypeError, ValueError):
+        return None
+
+
+def carregar_usuario(db: Session, user_id: int) -> Optional[UsuarioAutenticado]:
+    usuario = cache_usuarios.obter(user_id)
+    if usuario is None:
+        u = db.get(models.User, user_id)
+        if u is None:
+            return None
+        usuario = UsuarioAutenticado.de_modelo(u)
+        cache_usuarios.guardar(usuario)
+    return usuario
+
+
+# ----- Dependências -----
+def usuario_id_opcional(request: Request) -> Optional[int]:
+    """Id do usuário do token, sem consultar o banco (None sem token válido)."""
+    claims = _claims_do_request(request)
+    if claims is _SEM_TOKEN or isinstance(claims, Exception):
+        return None
+    return _user_id(claims)
+
+
+def usuario_atual(request: Request, db: Session = Depends(get_db)) -> UsuarioAutenticado:
+    """Usuário autenticado; 401 sem token/token inválido, 404 se o usuário não existe mais."""
+    claims = _claims_do_request(request)
+    if claims is _SEM_TOKEN:
+        raise HTTPException(status_code=401, detail='Token ausente')
+    if isinstance(claims, jwt.ExpiredSignatureError):
+        raise HTTPException(status_code=401, detail='Token expirado')
+    if isinstance(claims, Exception):
+        raise HTTPException(status_code=401, detail='Token inválido')
+    user_id = _user_id(claims)
+    if not user_id:
+        raise HTTPException(status_code=401, detail='Payload inválido')
+    usuario = carregar_usuario(db, user_id)
+    if not usuario:
+        raise HTTPException(status_code=404, detail='Usuário não encontrado')
+    return usuario
+
+
+def usuario_opcional(request: Request, db: Session = Depends(get_db)) -> Optional[UsuarioAutenticado]:
+    """Usuário autenticado ou None (sem token, token inválido ou usuário inexistente)."""
+    user_id = usuario_id_opcional(request)
+    return carregar_usuario(db, user_id) if user_id else None
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {'claims': cache_claims.estatisticas(), 'usuarios': cache_usuarios.estatisticas()}
@@ -0,0 +1 @@
+"""Benchmarks executáveis (`python -m backend.benchmarks.<nome>`) contra bancos semeados."""
@@ -0,0 +1,47 @@
+"""App da API instrumentada para o teste de carga (`backend.benchmarks.carga`).
+
+Liga a instrumentação SQL da própria API (`backend/instrumentacao.py`) sem os alertas
+de requisição/consulta lenta (os logs atrapalhariam a medição) e repete o total de
+consultas do `Server-Timing` no cabeçalho `X-Bench-Consultas`. Importar só com
+`DATABASE_URL` já definido.
+
+    python -m uvicorn backend.benchmarks._app:app
+"""
+import re
+
+from backend.instrumentacao import instrumentacao
+from backend.main import app as app_api
+
+CABECALHO_CONSULTAS = 'x-bench-consultas'
+
+_RE_CONSULTAS = re.compile(rb'desc="(\d+) consultas"')
+
+instrumentacao.configurar(ativo=True, limite_consultas=10 ** 9, limite_ms=float('inf'), lenta_ms=float('inf'))
+
+
+class ContarConsultas:
+    """Middleware ASGI: copia a contagem do `Server-Timing` para `X-Bench-Consultas`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                headers = list(mensagem.get('headers') or [])
+                for nome, valor in headers:
+                    m = _RE_CONSULTAS.search(valor) if nome.lower() == b'server-timing' else None
+                    if m:
+                        headers.append((CABECALHO_CONSULTAS.encode(), m.group(1)))
+                        break
+                mensagem['headers'] = headers
+            await send(mensagem)
+
+        await self.app(scope, receive, enviar)
+
+
+app = ContarConsultas(app_api)
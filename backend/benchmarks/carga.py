@@ -0,0 +1,430 @@
+"""Teste de carga HTTP ponta a ponta: salão, loja e rajada de login.
+
+Semeia um banco com o gerador de `populate_db_sqlalchemy` (semente fixa), sobe a API
+em processo (TestClient) ou com uvicorn e dispara usuários virtuais por cenário:
+
+- salao: abre a mesa, lança itens e fecha a conta (`/mesas/{id}/itens`, `/pagamento`);
+- loja: catálogo, busca, facetas, carrinho e favoritos de um cliente logado;
+- login: rajada de `POST /auth/login` com os usuários gerados.
+
+Mede por endpoint p50/p95/p99, vazão e consultas SQL por requisição (ver
+`backend/benchmarks/_app.py`). O resultado sai em JSON para comparar entre commits.
+
+    python -m backend.benchmarks.carga --saida antes.json
+    python -m backend.benchmarks.carga --modo uvicorn --workers 2 --clientes 16 --segundos 30
+    python -m backend.benchmarks.carga --url postgresql://...   # banco VAZIO de teste
+    python -m backend.benchmarks.carga --comparar antes.json depois.json
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.benchmarks.login import RAIZ, _esperar_servidor, _porta_livre
+
+CABECALHO_CONSULTAS = 'x-bench-consultas'
+CENARIOS = ('salao', 'loja', 'login')
+SENHA_GERADA = 'gerado123'  # = populate_db_sqlalchemy.SENHA_GERADA
+# p95 acima disto (em %) aparece como regressão no --comparar
+LIMITE_REGRESSAO_PCT = 10.0
+
+
+# ----- Clientes HTTP (um por usuário virtual, com cookies próprios) -----
+class ClienteProcesso:
+    """API no mesmo processo, via TestClient (sem rede; o startup roda uma vez fora daqui)."""
+
+    def __init__(self, app):
+        from fastapi.testclient import TestClient
+        self.cliente = TestClient(app)
+
+    def requisitar(self, metodo: str, caminho: str, corpo: Any = None) -> Tuple[int, bytes, Dict[str, str]]:
+        r = self.cliente.request(metodo, caminho, json=corpo)
+        return r.status_code, r.content, {k.lower(): v for k, v in r.headers.items()}
+
+
+class ClienteHttp:
+    """API num servidor uvicorn, via urllib."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def requisitar(self, metodo: str, caminho: str, corpo: Any = None) -> Tuple[int, bytes, Dict[str, str]]:
+        dados = json.dumps(corpo).encode() if corpo is not None else None
+        req = urllib.request.Request(self.base + caminho, data=dados, method=metodo,
+                                     headers={'Content-Type': 'application/json'} if dados else {})
+        try:
+            with self.abridor.open(req, timeout=60) as resp:
+                return resp.status, resp.read(), {k.lower(): v for k, v in resp.headers.items()}
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), {k.lower(): v for k, v in e.headers.items()}
+
+
+# ----- Medição -----
+class Coletor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.amostras: Dict[str, List[Tuple[float, int, Optional[int]]]] = {}
+        self.gravando = False
+
+    def registrar(self, endpoint: str, ms: float, status: int, consultas: Optional[int]) -> None:
+        if not self.gravando:
+            return
+        with self._lock:
+            self.amostras.setdefault(endpoint, []).append((ms, status, consultas))
+
+
+class Sessao:
+    """Um usuário virtual: cliente próprio + registro das medições."""
+
+    def __init__(self, cliente, coletor: Coletor, rnd: random.Random, indice: int):
+        self.cliente = cliente
+        self.coletor = coletor
+        self.rnd = rnd
+        self.indice = indice
+        self.mesas: List[int] = []
+
+    def chamar(self, endpoint: str, metodo: str, caminho: str, corpo: Any = None) -> Tuple[int, bytes]:
+        inicio = time.perf_counter()
+        status, conteudo, headers = self.cliente.requisitar(metodo, caminho, corpo)
+        ms = (time.perf_counter() - inicio) * 1000
+        consultas = headers.get(CABECALHO_CONSULTAS)
+        self.coletor.registrar(endpoint, ms, status, int(consultas) if consultas is not None else None)
+        return status, conteudo
+
+
+def _percentil(ordenados: List[float], p: float) -> Optional[float]:
+    if not ordenados:
+        return None
+    return round(ordenados[min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))], 2)
+
+
+def resumir(amostras: Dict[str, List[Tuple[float, int, Optional[int]]]], duracao: float) -> Dict[str, dict]:
+    resumo = {}
+    for endpoint, linhas in sorted(amostras.items()):
+        tempos = sorted(ms for ms, _, _ in linhas)
+        consultas = [c for _, _, c in linhas if c is not None]
+        status: Dict[str, int] = {}
+        for _, s, _ in linhas:
+            status[str(s)] = status.get(str(s), 0) + 1
+        resumo[endpoint] = {
+            'requisicoes': len(linhas),
+            'rps': round(len(linhas) / duracao, 2),
+            'erros': sum(1 for _, s, _ in linhas if s >= 400),
+            'status': status,
+            'p50_ms': _percentil(tempos, 50),
+            'p95_ms': _percentil(tempos, 95),
+            'p99_ms': _percentil(tempos, 99),
+            'max_ms': round(tempos[-1], 2),
+            'consultas_media': round(sum(consultas) / len(consultas), 2) if consultas else None,
+            'consultas_max': max(consultas) if consultas else None,
+        }
+    return resumo
+
+
+# ----- Cenários -----
+def _contexto(cliente) -> Dict[str, Any]:
+    """Ids dos dados gerados, lidos pela própria API."""
+    _, corpo, _ = cliente.requisitar('GET', '/mesas/')
+    mesas = [m['id'] for m in json.loads(corpo) if str(m.get('slug', '')).startswith('gen-mesa-')]
+    _, corpo, _ = cliente.requisitar('GET', '/produtos/?limit=1000&disponivel=true&fields=id,venda,style')
+    produtos = json.loads(corpo)
+    estilos = sorted({p['style'] for p in produtos if p.get('style')}) or ['chopp']
+    return {'mesas': mesas, 'produtos': produtos, 'estilos': estilos}
+
+
+def _preparar_salao(s: Sessao, ctx: Dict[str, Any], clientes: int) -> None:
+    # cada usuário virtual atende as suas mesas: sem disputa pelo mesmo pedido pendente
+    s.mesas = ctx['mesas'][s.indice::clientes] or ctx['mesas']
+
+
+def _iteracao_salao(s: Sessao, ctx: Dict[str, Any]) -> None:
+    mesa = s.rnd.choice(s.mesas)
+    s.chamar('GET /mesas/{id}', 'GET', f'/mesas/{mesa}')
+    for _ in range(s.rnd.randint(2, 5)):
+        produto = s.rnd.choice(ctx['produtos'])
+        s.chamar('POST /mesas/{id}/itens', 'POST', f'/mesas/{mesa}/itens',
+                 {'produto_id': produto['id'], 'quantidade': s.rnd.randint(1, 3), 'usuario_id': 1})
+    s.chamar('GET /mesas/', 'GET', '/mesas/')
+    s.chamar('POST /mesas/{id}/pagamento', 'POST', f'/mesas/{mesa}/pagamento',
+             {'metodo': s.rnd.choice(['pix', 'dinheiro', 'cartao_credito'])})
+
+
+def _email_gerado(i: int) -> str:
+    return f'gen{i:07d}@exemplo.gen'
+
+
+def _preparar_loja(s: Sessao, ctx: Dict[str, Any], clientes: int) -> None:
+    # cliente logado: carrinho e favoritos próprios (o login em si é medido no cenário 'login')
+    s.cliente.requisitar('POST', '/auth/login', {'email': _email_gerado(s.indice + 1), 'password': SENHA_GERADA})
+
+
+def _iteracao_loja(s: Sessao, ctx: Dict[str, Any]) -> None:
+    s.chamar('GET /produtos/', 'GET', f'/produtos/?limit=24&skip={s.rnd.randrange(0, 200, 24)}')
+    estilo = s.rnd.choice(ctx['estilos'])
+    s.chamar('GET /produtos/search', 'GET', f'/produtos/search?q={urllib.request.quote(estilo)}')
+    s.chamar('GET /produtos/facetas', 'GET', f'/produtos/facetas?style={urllib.request.quote(estilo)}')
+    produto = s.rnd.choice(ctx['produtos'])
+    s.chamar('POST /carrinho/items', 'POST', '/carrinho/items',
+             {'produto_id': produto['id'], 'quantidade': 1, 'venda': float(produto['venda'])})
+    s.chamar('GET /carrinho/', 'GET', '/carrinho/')
+    s.chamar('POST /favoritos/', 'POST', '/favoritos/', {'produto_id': produto['id']})
+    s.chamar('GET /favoritos/', 'GET', '/favoritos/')
+    s.chamar('DELETE /favoritos/{id}', 'DELETE', f"/favoritos/{produto['id']}")
+    if s.rnd.random() < 0.2:
+        s.chamar('POST /carrinho/clear', 'POST', '/carrinho/clear', {})
+
+
+def _iteracao_login(s: Sessao, ctx: Dict[str, Any]) -> None:
+    s.chamar('POST /auth/login', 'POST', '/auth/login',
+             {'email': _email_gerado(s.rnd.randint(1, ctx['usuarios'])), 'password': SENHA_GERADA})
+
+
+ROTEIROS: Dict[str, Tuple[Optional[Callable], Callable]] = {
+    'salao': (_preparar_salao, _iteracao_salao),
+    'loja': (_preparar_loja, _iteracao_loja),
+    'login': (None, _iteracao_login),
+}
+
+
+def executar_cenario(
+    nome: str, fabrica: Callable[[], Any], ctx: Dict[str, Any], clientes: int, segundos: float, aquecimento: float, semente: int,
+) -> Dict[str, Any]:
+    preparar, iteracao = ROTEIROS[nome]
+    coletor = Coletor()
+    sessoes = [Sessao(fabrica(), coletor, random.Random(semente * 1000 + i), i) for i in range(clientes)]
+    if preparar:
+        for s in sessoes:
+            preparar(s, ctx, clientes)
+
+    parar = threading.Event()
+    iteracoes = [0] * clientes
+    falhas: List[str] = []
+
+    def usuario(s: Sessao):
+        while not parar.is_set():
+            try:
+                iteracao(s, ctx)
+                if coletor.gravando:
+                    iteracoes[s.indice] += 1
+            except Exception as e:  # conexão recusada, timeout...
+                falhas.append(repr(e))
+                parar.wait(0.1)
+
+    threads = [threading.Thread(target=usuario, args=(s,), daemon=True) for s in sessoes]
+    for t in threads:
+        t.start()
+    time.sleep(aquecimento)
+    coletor.gravando = True
+    inicio = time.perf_counter()
+    time.sleep(segundos)
+    coletor.gravando = False
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    for t in threads:
+        t.join()
+
+    endpoints = resumir(coletor.amostras, duracao)
+    requisicoes = sum(e['requisicoes'] for e in endpoints.values())
+    return {
+        'clientes': clientes,
+        'duracao_s': round(duracao, 2),
+        'iteracoes': sum(iteracoes),
+        'iteracoes_por_segundo': round(sum(iteracoes) / duracao, 2),
+        'requisicoes': requisicoes,
+        'rps': round(requisicoes / duracao, 2),
+        'erros': sum(e['erros'] for e in endpoints.values()),
+        'falhas_cliente': len(falhas),
+        'endpoints': endpoints,
+    }
+
+
+# ----- Banco e servidor -----
+def semear(url: str, args, env: Dict[str, str]) -> float:
+    inicio = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(RAIZ / 'backend' / 'populate_db_sqlalchemy.py'), '--gerar',
+         '--produtos', str(args.produtos), '--mesas', str(max(args.mesas, args.clientes)),
+         '--usuarios', str(max(args.usuarios, args.clientes)), '--meses', str(args.meses),
+         '--pedidos-dia', str(args.pedidos_dia), '--semente', str(args.semente)],
+        cwd=str(RAIZ), env=dict(env, DATABASE_URL=url), check=True,
+        stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    return time.perf_counter() - inicio
+
+
+def _commit_atual() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(RAIZ), capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def executar(args) -> Dict[str, Any]:
+    caminho = None
+    if args.url:
+        url = args.url
+    else:
+        fd, caminho = tempfile.mkstemp(suffix='.db', prefix='bench_carga_')
+        os.close(fd)
+        url = f'sqlite:///{caminho}'
+    env = dict(os.environ, BCRYPT_ROUNDS=str(args.rounds))
+    processo = None
+    app_processo = None
+    try:
+        tempo_semeadura = semear(url, args, env)
+        if args.modo == 'uvicorn':
+            porta = _porta_livre()
+            base = f'http://127.0.0.1:{porta}'
+            processo = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'backend.benchmarks._app:app', '--port', str(porta),
+                 '--workers', str(args.workers), '--log-level', 'warning'],
+                cwd=str(RAIZ), env=dict(env, DATABASE_URL=url), stdout=subprocess.DEVNULL,
+                stderr=None if args.verbose else subprocess.DEVNULL,
+            )
+            _esperar_servidor(base, processo)
+            fabrica = lambda: ClienteHttp(base)  # noqa: E731
+        else:
+            # o engine lê DATABASE_URL no import: definir antes de importar a API
+            os.environ.update(DATABASE_URL=url, BCRYPT_ROUNDS=str(args.rounds))
+            from fastapi.testclient import TestClient
+            from backend.benchmarks._app import app
+            from backend.logging_config import logger
+            if not args.verbose:
+                # o log INFO de cada requisição sairia no stdout junto com o resultado
+                logger.setLevel(logging.WARNING)
+                logging.getLogger('httpx').setLevel(logging.WARNING)
+            app_processo = TestClient(app)
+            app_processo.__enter__()  # startup uma vez; os clientes das threads não repetem
+            fabrica = lambda: ClienteProcesso(app)  # noqa: E731
+
+        ctx = _contexto(fabrica())
+        ctx['usuarios'] = max(args.usuarios, args.clientes)
+        cenarios = {}
+        for nome in args.cenarios:
+            cenarios[nome] = executar_cenario(
+                nome, fabrica, ctx, args.clientes, args.segundos, args.aquecimento, args.semente
+            )
+            if not args.json:
+                _imprimir_cenario(nome, cenarios[nome])
+        return {
+            'meta': {
+                'commit': _commit_atual(),
+                'data': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'modo': args.modo,
+                'workers': args.workers if args.modo == 'uvicorn' else None,
+                'banco': url.split('://', 1)[0] if args.url else 'sqlite (temporário)',
+                'clientes': args.clientes,
+                'segundos': args.segundos,
+                'bcrypt_rounds': args.rounds,
+                'semeadura': {
+                    'produtos': args.produtos, 'mesas': max(args.mesas, args.clientes),
+                    'usuarios': ctx['usuarios'], 'meses': args.meses, 'pedidos_dia': args.pedidos_dia,
+                    'semente': args.semente, 'segundos': round(tempo_semeadura, 1),
+                },
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'cenarios': cenarios,
+        }
+    finally:
+        if app_processo is not None:
+            app_processo.__exit__(None, None, None)
+        if processo is not None:
+            processo.terminate()
+            try:
+                processo.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+        if caminho:
+            for sufixo in ('', '-wal', '-shm'):
+                if os.path.exists(caminho + sufixo):
+                    os.remove(caminho + sufixo)
+
+
+# ----- Saída -----
+def _imprimir_cenario(nome: str, r: Dict[str, Any]) -> None:
+    print(f"\n[{nome}] {r['clientes']} clientes, {r['duracao_s']} s: {r['rps']} req/s, "
+          f"{r['iteracoes_por_segundo']} iterações/s, {r['erros']} erros")
+    print(f"  {'endpoint':32} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'consultas':>10}")
+    for endpoint, e in r['endpoints'].items():
+        print(f"  {endpoint:32} {e['rps']:8.1f} {e['p50_ms']:8.1f} {e['p95_ms']:8.1f} {e['p99_ms']:8.1f} "
+              f"{e['consultas_media'] if e['consultas_media'] is not None else '-':>10}")
+
+
+def comparar(antes: Dict[str, Any], depois: Dict[str, Any], limite_pct: float = LIMITE_REGRESSAO_PCT) -> int:
+    """Imprime a diferença por endpoint entre dois resultados. Retorna o nº de regressões de p95."""
+    regressoes = 0
+    print(f"antes: {antes['meta'].get('commit')}  depois: {depois['meta'].get('commit')}")
+    for nome, cenario in depois['cenarios'].items():
+        base = antes['cenarios'].get(nome)
+        if not base:
+            continue
+        print(f"\n[{nome}] req/s {base['rps']} -> {cenario['rps']}")
+        for endpoint, e in cenario['endpoints'].items():
+            b = base['endpoints'].get(endpoint)
+            if not b or not b['p95_ms']:
+                continue
+            delta = (e['p95_ms'] - b['p95_ms']) / b['p95_ms'] * 100
+            marca = '  REGRESSÃO' if delta > limite_pct else ''
+            regressoes += bool(marca)
+            print(f"  {endpoint:32} p95 {b['p95_ms']:8.1f} -> {e['p95_ms']:8.1f} ms ({delta:+6.1f}%)  "
+                  f"consultas {b['consultas_media']} -> {e['consultas_media']}{marca}")
+    return regressoes
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modo', choices=('processo', 'uvicorn'), default='processo')
+    parser.add_argument('--workers', type=int, default=1, help='workers do uvicorn (--modo uvicorn)')
+    parser.add_argument('--url', help='URL de um banco VAZIO de teste (padrão: SQLite temporário)')
+    parser.add_argument('--cenarios', default=','.join(CENARIOS), help=f"lista separada por vírgula: {','.join(CENARIOS)}")
+    parser.add_argument('--clientes', type=int, default=8, help='usuários virtuais por cenário')
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--aquecimento', type=float, default=2, help='segundos iniciais descartados')
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_ROUNDS')
+    parser.add_argument('--produtos', type=int, default=2000)
+    parser.add_argument('--mesas', type=int, default=40)
+    parser.add_argument('--usuarios', type=int, default=5000)
+    parser.add_argument('--meses', type=int, default=3)
+    parser.add_argument('--pedidos-dia', type=int, default=300)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help='grava o resultado JSON neste arquivo')
+    parser.add_argument('--json', action='store_true', help='imprime o resultado em JSON')
+    parser.add_argument('--verbose', action='store_true', help='mostra o log da semeadura e do servidor')
+    parser.add_argument('--comparar', nargs=2, metavar=('ANTES', 'DEPOIS'), help='compara dois resultados JSON')
+    args = parser.parse_args(argv)
+
+    if args.comparar:
+        with open(args.comparar[0], encoding='utf-8') as a, open(args.comparar[1], encoding='utf-8') as d:
+            sys.exit(1 if comparar(json.load(a), json.load(d)) else 0)
+
+    args.cenarios = [c.strip() for c in args.cenarios.split(',') if c.strip()]
+    desconhecidos = set(args.cenarios) - set(CENARIOS)
+    if desconhecidos:
+        parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    resultado = executar(args)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
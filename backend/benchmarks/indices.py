@@ -0,0 +1,192 @@
+"""Benchmark dos índices da migração 0001 (planos de consulta antes/depois).
+
+Cria um banco descartável, semeia um volume grande de pedidos, itens, carrinhos,
+avaliações e movimentações, remove os índices da migração (estado de um banco
+antigo), mede as consultas quentes, aplica `backend.migracoes` e mede de novo.
+
+    python -m backend.benchmarks.indices                    # SQLite temporário
+    python -m backend.benchmarks.indices --pedidos 200000
+    python -m backend.benchmarks.indices --url postgresql://...  # banco VAZIO de teste
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import DropIndex
+
+from backend import migracoes, models
+
+CONSULTAS: List[Tuple[str, str]] = [
+    ('pedido pendente da mesa',
+     "SELECT id FROM pedidos WHERE mesa_id = :mesa AND status = 'Pendente' LIMIT 1"),
+    ('itens do pedido',
+     'SELECT id, quantidade FROM pedido_itens WHERE pedido_id = :pedido'),
+    ('item do carrinho por produto',
+     'SELECT id FROM carrinho_items WHERE carrinho_id = :carrinho AND produto_id = :produto'),
+    ('carrinho do usuário',
+     'SELECT id FROM carrinhos WHERE user_id = :usuario'),
+    ('carrinho da sessão',
+     'SELECT id FROM carrinhos WHERE session_id = :sessao'),
+    ('avaliações do produto',
+     'SELECT rating FROM avaliacoes WHERE produto_id = :produto'),
+    ('movimentações do produto (recentes)',
+     'SELECT id FROM movimentacoes_estoque WHERE produto_id = :produto ORDER BY created_at DESC LIMIT 50'),
+    ('pedidos por data (cursor)',
+     'SELECT id FROM pedidos WHERE created_at > :desde ORDER BY created_at, id LIMIT 50'),
+]
+
+
+def _lotes(linhas, tamanho=5000):
+    for i in range(0, len(linhas), tamanho):
+        yield linhas[i:i + tamanho]
+
+
+def semear(engine: Engine, n_pedidos: int, n_produtos: int = 500, n_mesas: int = 60, n_usuarios: int = 2000) -> Dict[str, int]:
+    rnd = random.Random(42)
+    agora = datetime.now(timezone.utc).replace(tzinfo=None)
+    t = models.Base.metadata.tables
+    linhas: Dict[str, list] = {}
+
+    linhas['empresas'] = [dict(id=1, nome='Bench', endereco='-', telefone='-', email='b@b', cnpj='0', slug='bench')]
+    linhas['categorias'] = [dict(id=1, nome='Bench')]
+    linhas['usuarios'] = [
+        dict(id=i, username=f'u{i}', email=f'u{i}@bench', nome=f'U{i}', password='x', tipo='online')
+        for i in range(1, n_usuarios + 1)
+    ]
+    linhas['produtos'] = [
+        dict(id=i, nome=f'P{i}', categoria_id=1, empresa_id=1, descricao='-', custo=1, venda=10,
+             codigo=f'B{i}', slug=f'p-{i}', estoque=100)
+        for i in range(1, n_produtos + 1)
+    ]
+    linhas['mesas'] = [dict(id=i, nome=str(i), slug=f'Mesa-{i:02d}') for i in range(1, n_mesas + 1)]
+
+    pedidos, itens = [], []
+    for i in range(1, n_pedidos + 1):
+        # Quase todos os pedidos estão fechados; só os mais recentes de cada mesa ficam pendentes
+        status = 'Pendente' if i > n_pedidos - n_mesas else 'Pago'
+        pedidos.append(dict(id=i, tipo='fisica', numero=str(i), status=status, mesa_id=(i % n_mesas) + 1,
+                            subtotal=30, total=30, created_at=agora - timedelta(minutes=n_pedidos - i)))
+        for _ in range(3):
+            itens.append(dict(pedido_id=i, produto_id=rnd.randint(1, n_produtos), nome='x',
+                              quantidade=1, preco_unitario=10, subtotal=10))
+    linhas['pedidos'], linhas['pedido_itens'] = pedidos, itens
+
+    n_carrinhos = max(n_pedidos // 4, 1)
+    linhas['carrinhos'] = [
+        dict(id=i, user_id=rnd.randint(1, n_usuarios) if i % 2 else None, session_id=None if i % 2 else f's{i}', total=0)
+        for i in range(1, n_carrinhos + 1)
+    ]
+    linhas['carrinho_items'] = [
+        dict(carrinho_id=(i % n_carrinhos) + 1, produto_id=rnd.randint(1, n_produtos), nome='x', quantidade=1,
+             preco_unitario=10, subtotal=10)
+        for i in range(n_carrinhos * 3)
+    ]
+    linhas['avaliacoes'] = list({
+        (u, p): dict(user_id=u, produto_id=p, rating=rnd.randint(1, 5))
+        for u, p in ((rnd.randint(1, n_usuarios), rnd.randint(1, n_produtos)) for _ in range(n_pedidos // 2))
+    }.values())
+    linhas['movimentacoes_estoque'] = [
+        dict(produto_id=rnd.randint(1, n_produtos), tipo='saida', origem='venda', quantidade=1,
+             quantidade_anterior=10, quantidade_nova=9, usuario_id=1, created_at=agora - timedelta(seconds=i))
+        for i in range(n_pedidos * 2)
+    ]
+
+    with engine.begin() as conn:
+        for nome, dados in linhas.items():
+            for lote in _lotes(dados):
+                conn.execute(insert(t[nome]), lote)
+    return {nome: len(dados) for nome, dados in linhas.items()}
+
+
+def _parametros(rnd: random.Random, tamanhos: Dict[str, int]) -> dict:
+    return {
+        'mesa': rnd.randint(1, tamanhos['mesas']),
+        'pedido': rnd.randint(1, tamanhos['pedidos']),
+        'carrinho': rnd.randint(1, tamanhos['carrinhos']),
+        'produto': rnd.randint(1, tamanhos['produtos']),
+        'usuario': rnd.randint(1, tamanhos['usuarios']),
+        'sessao': f"s{rnd.randrange(2, tamanhos['carrinhos'] + 1, 2)}",
+        'desde': datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=rnd.randint(1, tamanhos['pedidos'])),
+    }
+
+
+def _plano(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == 'sqlite':
+        return '; '.join(r[-1] for r in conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params))
+    return ' | '.join(r[0].strip() for r in conn.execute(text('EXPLAIN ' + sql), params))
+
+
+def medir(engine: Engine, tamanhos: Dict[str, int], repeticoes: int) -> Dict[str, dict]:
+    resultado = {}
+    with engine.connect() as conn:
+        for nome, sql in CONSULTAS:
+            rnd = random.Random(7)
+            amostras = []
+            for _ in range(repeticoes):
+                params = _parametros(rnd, tamanhos)
+                inicio = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                amostras.append((time.perf_counter() - inicio) * 1000)
+            resultado[nome] = {
+                'mediana_ms': statistics.median(amostras),
+                'p95_ms': sorted(amostras)[int(len(amostras) * 0.95) - 1],
+                'plano': _plano(conn, sql, _parametros(rnd, tamanhos)),
+            }
+    return resultado
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='URL de um banco vazio de teste (padrão: SQLite temporário)')
+    parser.add_argument('--pedidos', type=int, default=100000)
+    parser.add_argument('--repeticoes', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    caminho = None
+    if args.url:
+        url = args.url
+    else:
+        fd, caminho = tempfile.mkstemp(suffix='.db', prefix='bench_indices_')
+        os.close(fd)
+        url = f'sqlite:///{caminho}'
+    engine = create_engine(url)
+    try:
+        models.Base.metadata.create_all(bind=engine)
+        # Estado "antes": banco antigo sem os índices da migração
+        with engine.begin() as conn:
+            for tabela, nome in migracoes.INDICES_CAMINHOS_QUENTES:
+                conn.execute(DropIndex(migracoes.indice(tabela, nome), if_exists=True))
+
+        inicio = time.perf_counter()
+        tamanhos = semear(engine, args.pedidos)
+        print(f'Banco semeado em {time.perf_counter() - inicio:.1f}s: '
+              + ', '.join(f'{k}={v}' for k, v in tamanhos.items()))
+
+        antes = medir(engine, tamanhos, args.repeticoes)
+        inicio = time.perf_counter()
+        migracoes.aplicar(engine)
+        print(f'Migração aplicada em {time.perf_counter() - inicio:.1f}s\n')
+        depois = medir(engine, tamanhos, args.repeticoes)
+
+        for nome, _ in CONSULTAS:
+            a, d = antes[nome], depois[nome]
+            ganho = a['mediana_ms'] / d['mediana_ms'] if d['mediana_ms'] else float('inf')
+            print(f'{nome}')
+            print(f"  antes : {a['mediana_ms']:8.3f} ms (p95 {a['p95_ms']:.3f})  {a['plano']}")
+            print(f"  depois: {d['mediana_ms']:8.3f} ms (p95 {d['p95_ms']:.3f})  {d['plano']}")
+            print(f'  ganho : {ganho:.1f}x')
+    finally:
+        engine.dispose()
+        if caminho:
+            os.remove(caminho)
+
+
+if __name__ == '__main__':
+    main()
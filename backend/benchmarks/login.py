@@ -0,0 +1,158 @@
+"""Benchmark de login: bcrypt nas threads de request vs pool de processos.
+
+Sobe a API (uvicorn) num banco temporário duas vezes — `SENHAS_PROCESSOS=0`
+(bcrypt na thread do request, comportamento antigo) e com o pool — e dispara
+logins concorrentes enquanto uma thread mede a latência de `GET /ping`, que
+representa o resto da API durante uma rajada de logins.
+
+    python -m backend.benchmarks.login
+    python -m backend.benchmarks.login --clientes 32 --segundos 15 --processos 2
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+RAIZ = Path(__file__).resolve().parents[2]
+EMAIL = 'bench-login@example.com'
+SENHA = 'bench-senha-123'
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _post(url: str, corpo: dict, timeout: float = 30) -> int:
+    req = urllib.request.Request(url, data=json.dumps(corpo).encode(), headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _get(url: str, timeout: float = 30) -> int:
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.status
+
+
+def _esperar_servidor(base: str, processo: subprocess.Popen, limite: float = 120) -> None:
+    fim = time.time() + limite
+    while time.time() < fim:
+        if processo.poll() is not None:
+            raise RuntimeError('servidor encerrou durante o startup')
+        try:
+            _get(base + '/ping', timeout=1)
+            return
+        except Exception:
+            time.sleep(0.3)
+    raise RuntimeError('servidor não respondeu a tempo')
+
+
+def executar_cenario(nome: str, processos: int, clientes: int, segundos: float, rounds: int, fila_max: int) -> Dict[str, object]:
+    fd, caminho = tempfile.mkstemp(suffix='.db', prefix='bench_login_')
+    os.close(fd)
+    porta = _porta_livre()
+    base = f'http://127.0.0.1:{porta}'
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{caminho}',
+        SENHAS_PROCESSOS=str(processos),
+        SENHAS_FILA_MAX=str(fila_max),
+        BCRYPT_ROUNDS=str(rounds),
+    )
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend.main:app', '--port', str(porta), '--log-level', 'warning'],
+        cwd=str(RAIZ), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _esperar_servidor(base, processo)
+        _post(base + '/auth/register', {'nome': 'Bench', 'email': EMAIL, 'password': SENHA})
+
+        parar = threading.Event()
+        status: Dict[int, int] = {}
+        lock = threading.Lock()
+        latencias_ping: List[float] = []
+
+        def logar():
+            while not parar.is_set():
+                codigo = _post(base + '/auth/login', {'email': EMAIL, 'password': SENHA})
+                with lock:
+                    status[codigo] = status.get(codigo, 0) + 1
+                if codigo == 503:
+                    # cliente bem-comportado: respeita o Retry-After antes de tentar de novo
+                    parar.wait(1)
+
+        def pingar():
+            while not parar.is_set():
+                inicio = time.perf_counter()
+                _get(base + '/ping')
+                latencias_ping.append((time.perf_counter() - inicio) * 1000)
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=logar) for _ in range(clientes)] + [threading.Thread(target=pingar)]
+        inicio = time.perf_counter()
+        for t in threads:
+            t.start()
+        time.sleep(segundos)
+        parar.set()
+        for t in threads:
+            t.join()
+        duracao = time.perf_counter() - inicio
+
+        latencias_ping.sort()
+        return {
+            'cenario': nome,
+            'logins_ok_por_segundo': round(status.get(200, 0) / duracao, 2),
+            'status': status,
+            'ping_p50_ms': round(statistics.median(latencias_ping), 2) if latencias_ping else None,
+            'ping_p95_ms': round(latencias_ping[int(len(latencias_ping) * 0.95) - 1], 2) if latencias_ping else None,
+            'ping_max_ms': round(latencias_ping[-1], 2) if latencias_ping else None,
+        }
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(caminho + sufixo):
+                os.remove(caminho + sufixo)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clientes', type=int, default=32, help='logins concorrentes')
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_ROUNDS')
+    parser.add_argument('--processos', type=int, default=max((os.cpu_count() or 2) // 2, 1))
+    parser.add_argument('--fila-max', type=int, default=32)
+    parser.add_argument('--json', action='store_true', help='imprime o resultado em JSON')
+    args = parser.parse_args(argv)
+
+    resultados = [
+        executar_cenario('sem pool (thread do request)', 0, args.clientes, args.segundos, args.rounds, args.fila_max),
+        executar_cenario(f'pool ({args.processos} processo(s))', args.processos, args.clientes, args.segundos, args.rounds, args.fila_max),
+    ]
+    if args.json:
+        print(json.dumps(resultados, indent=2, ensure_ascii=False))
+        return
+    for r in resultados:
+        print(f"{r['cenario']}: {r['logins_ok_por_segundo']} logins/s, status {r['status']}, "
+              f"/ping p50 {r['ping_p50_ms']} ms, p95 {r['ping_p95_ms']} ms, max {r['ping_max_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
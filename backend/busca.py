@@ -0,0 +1,285 @@
+"""Busca textual de produtos (`GET /produtos/search`).
+
+Índice em `produtos_busca` sobre nome, descrição, estilo e nomes de categoria e
+empresa, com o texto normalizado por `models.remover_acentos` (a mesma
+normalização de `gerar_slug`) e em minúsculas: 'pilsen' encontra 'Pílsen'.
+
+- SQLite: tabela virtual FTS5 (com índice de prefixos), ranqueada por `bm25`. O id do
+  produto é o próprio `rowid` da FTS: remover/juntar por ele não varre a tabela virtual.
+- PostgreSQL: tabela com `tsvector` (pesos A-D) e índice GIN, ranqueada por `ts_rank`.
+- Outros bancos / SQLite sem FTS5: `LIKE` no nome, sem ranking.
+
+Cada termo é buscado como prefixo (type-ahead: 'chop ama' encontra 'Chopp Amanteigado')
+e todos os termos precisam aparecer. O índice é atualizado no flush da própria
+transação que altera Produto/Categoria/Empresa (listener abaixo) e criado/preenchido
+pela migração 0004. Para reconstruir:
+
+    python -m backend.busca --reconstruir
+"""
+import argparse
+import pathlib
+import re
+import sys
+from typing import Iterable, List, Optional, Set, Tuple
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy import event, inspect, or_, select, text
+from sqlalchemy.engine import Connection
+
+from backend import models
+from backend.database import Session as SessionLocal
+from backend.logging_config import logger
+
+TABELA = 'produtos_busca'
+MAX_TERMOS = 8
+# bm25/ts_rank: nome pesa mais que estilo, que pesa mais que categoria/empresa e descrição
+PESOS_FTS5 = {'nome': 10.0, 'descricao': 1.0, 'style': 4.0, 'categoria': 2.0, 'empresa': 2.0}
+_CAMPOS_PRODUTO = ('nome', 'descricao', 'style', 'categoria_id', 'empresa_id')
+_RE_NAO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+# chave do produto no índice: rowid da FTS5 / chave primária da tabela tsvector
+COLUNA_ID = {'sqlite': 'rowid', 'postgresql': 'produto_id'}
+
+# bancos (url) cuja tabela do índice já foi vista. Só o resultado positivo fica guardado:
+# o índice pode ser criado por outro processo (migração 0004) depois da primeira consulta.
+_indice_existe: dict = {}
+
+
+def normalizar(texto: Optional[str]) -> str:
+    return _RE_NAO_ALFANUMERICO.sub(' ', models.remover_acentos(texto or '').lower()).strip()
+
+
+def termos(consulta: Optional[str]) -> List[str]:
+    return normalizar(consulta).split()[:MAX_TERMOS]
+
+
+def modo(conn: Connection) -> str:
+    dialeto = conn.dialect.name
+    if dialeto == 'postgresql':
+        return 'tsvector'
+    if dialeto == 'sqlite' and _indice_disponivel(conn):
+        return 'fts5'
+    return 'like'
+
+
+# ----- Estrutura do índice -----
+def criar_indice(conn: Connection) -> bool:
+    """Cria a tabela do índice (idempotente). Retorna False se o banco não suporta."""
+    dialeto = conn.dialect.name
+    if dialeto == 'sqlite':
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5("
+                "nome, descricao, style, categoria, empresa, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            ))
+        except Exception as e:
+            logger.warning('FTS5 indisponível neste SQLite (%s); busca usará LIKE', e)
+            return False
+    elif dialeto == 'postgresql':
+        conn.execute(text(f'CREATE TABLE IF NOT EXISTS {TABELA} (produto_id INTEGER PRIMARY KEY, documento tsvector NOT NULL)'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABELA}_documento ON {TABELA} USING GIN (documento)'))
+    else:
+        return False
+    _indice_existe[str(conn.engine.url)] = True
+    return True
+
+
+def _indice_disponivel(conn: Connection) -> bool:
+    chave = str(conn.engine.url)
+    if _indice_existe.get(chave):
+        return True
+    existe = inspect(conn).has_table(TABELA)
+    if existe:
+        _indice_existe[chave] = True
+    return existe
+
+
+def _documentos(conn: Connection, produto_ids: Optional[Iterable[int]]) -> List[dict]:
+    P, C, E = models.Produto, models.Categoria, models.Empresa
+    q = (
+        select(P.id, P.nome, P.descricao, P.style, C.nome.label('categoria'), E.nome.label('empresa'))
+        .outerjoin(C, C.id == P.categoria_id)
+        .outerjoin(E, E.id == P.empresa_id)
+    )
+    if produto_ids is not None:
+        q = q.where(P.id.in_(list(produto_ids)))
+    return [
+        {
+            'produto_id': r.id,
+            'nome': normalizar(r.nome),
+            'descricao': normalizar(r.descricao),
+            'style': normalizar(r.style),
+            'categoria': normalizar(r.categoria),
+            'empresa': normalizar(r.empresa),
+        }
+        for r in conn.execute(q)
+    ]
+
+
+def remover(conn: Connection, produto_ids: Iterable[int]) -> None:
+    ids = list(produto_ids)
+    coluna = COLUNA_ID.get(conn.dialect.name)
+    if ids and coluna:
+        conn.execute(text(f'DELETE FROM {TABELA} WHERE {coluna} IN ({",".join(str(int(i)) for i in ids)})'))
+
+
+def indexar(conn: Connection, produto_ids: Optional[Iterable[int]] = None) -> int:
+    """(Re)indexa os produtos informados, ou todos com `produto_ids=None`. Não faz commit."""
+    if not _indice_disponivel(conn) or conn.dialect.name not in ('sqlite', 'postgresql'):
+        return 0
+    ids = None if produto_ids is None else list(produto_ids)
+    if ids is None:
+        conn.execute(text(f'DELETE FROM {TABELA}'))
+    else:
+        if not ids:
+            return 0
+        remover(conn, ids)
+    docs = _documentos(conn, ids)
+    if not docs:
+        return 0
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text(
+            f'INSERT INTO {TABELA} (rowid, nome, descricao, style, categoria, empresa) '
+            'VALUES (:produto_id, :nome, :descricao, :style, :categoria, :empresa)'
+        ), docs)
+    else:
+        conn.execute(text(
+            f"INSERT INTO {TABELA} (produto_id, documento) VALUES (:produto_id, "
+            "setweight(to_tsvector('simple', :nome), 'A') || setweight(to_tsvector('simple', :style), 'B') || "
+            "setweight(to_tsvector('simple', :categoria || ' ' || :empresa), 'C') || "
+            "setweight(to_tsvector('simple', :descricao), 'D'))"
+        ), docs)
+    return len(docs)
+
+
+# ----- Sincronização com o ORM -----
+def _campos_alterados(obj, campos) -> bool:
+    estado = inspect(obj)
+    return any(estado.attrs[c].history.has_changes() for c in campos)
+
+
+def _apos_flush(session, flush_context) -> None:
+    produtos: Set[int] = set()
+    removidos: Set[int] = set()
+    categorias: Set[int] = set()
+    empresas: Set[int] = set()
+    for obj in session.new:
+        if isinstance(obj, models.Produto):
+            produtos.add(obj.id)
+    for obj in session.dirty:
+        # estoque/preço mudam a cada venda: só reindexar quando um campo buscável mudou
+        if isinstance(obj, models.Produto) and _campos_alterados(obj, _CAMPOS_PRODUTO):
+            produtos.add(obj.id)
+        elif isinstance(obj, models.Categoria) and _campos_alterados(obj, ('nome',)):
+            categorias.add(obj.id)
+        elif isinstance(obj, models.Empresa) and _campos_alterados(obj, ('nome',)):
+            empresas.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, models.Produto):
+            removidos.add(obj.id)
+    if not (produtos or removidos or categorias or empresas):
+        return
+
+    conn = session.connection()
+    if not _indice_disponivel(conn):
+        return
+    if categorias or empresas:
+        produtos.update(conn.execute(
+            select(models.Produto.id).where(or_(
+                models.Produto.categoria_id.in_(categorias), models.Produto.empresa_id.in_(empresas)
+            ))
+        ).scalars())
+    remover(conn, removidos)
+    indexar(conn, produtos - removidos)
+
+
+event.listen(SessionLocal, 'after_flush', _apos_flush)
+
+
+# ----- Consulta -----
+def buscar(
+    db,
+    consulta: str,
+    limit: int = 20,
+    skip: int = 0,
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    disponivel: Optional[bool] = None,
+) -> List[Tuple[int, float]]:
+    """Retorna [(produto_id, relevancia)] em ordem de relevância (maior primeiro)."""
+    lista = termos(consulta)
+    if not lista:
+        return []
+    conn = db.connection()
+    params = {'limit': int(limit), 'skip': int(skip)}
+    filtros = []
+    if categoria_id is not None:
+        filtros.append('p.categoria_id = :categoria_id')
+        params['categoria_id'] = int(categoria_id)
+    if empresa_id is not None:
+        filtros.append('p.empresa_id = :empresa_id')
+        params['empresa_id'] = int(empresa_id)
+    if disponivel is not None:
+        filtros.append('p.disponivel = :disponivel')
+        params['disponivel'] = bool(disponivel)
+    extra = ''.join(f' AND {f}' for f in filtros)
+
+    tipo = modo(conn)
+    if tipo == 'fts5':
+        # termos já normalizados (só [a-z0-9]): aspas + '*' = busca por prefixo
+        params['q'] = ' '.join(f'"{t}"*' for t in lista)
+        pesos = ', '.join(str(PESOS_FTS5[c]) for c in ('nome', 'descricao', 'style', 'categoria', 'empresa'))
+        sql = (
+            f'SELECT b.rowid, bm25({TABELA}, {pesos}) AS rank FROM {TABELA} b '
+            f'JOIN produtos p ON p.id = b.rowid WHERE {TABELA} MATCH :q{extra} '
+            'ORDER BY rank, b.rowid LIMIT :limit OFFSET :skip'
+        )
+        # bm25: menor é melhor; expor como relevância positiva
+        return [(int(pid), round(-float(rank), 4)) for pid, rank in conn.execute(text(sql), params)]
+    if tipo == 'tsvector':
+        params['q'] = ' & '.join(f'{t}:*' for t in lista)
+        sql = (
+            f"SELECT b.produto_id, ts_rank(b.documento, to_tsquery('simple', :q)) AS rank FROM {TABELA} b "
+            f"JOIN produtos p ON p.id = b.produto_id WHERE b.documento @@ to_tsquery('simple', :q){extra} "
+            'ORDER BY rank DESC, b.produto_id LIMIT :limit OFFSET :skip'
+        )
+        return [(int(pid), round(float(rank), 4)) for pid, rank in conn.execute(text(sql), params)]
+
+    # Fallback sem índice: LIKE no nome (sem acento-insensibilidade garantida)
+    q = db.query(models.Produto.id)
+    for t in lista:
+        q = q.filter(models.Produto.nome.ilike(f'%{t}%'))
+    if categoria_id is not None:
+        q = q.filter(models.Produto.categoria_id == categoria_id)
+    if empresa_id is not None:
+        q = q.filter(models.Produto.empresa_id == empresa_id)
+    if disponivel is not None:
+        q = q.filter(models.Produto.disponivel == disponivel)
+    return [(pid, 0.0) for (pid,) in q.order_by(models.Produto.nome, models.Produto.id).offset(skip).limit(limit)]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reconstruir', action='store_true', help='recria o índice a partir de todos os produtos')
+    parser.add_argument('consulta', nargs='?', help='executa uma busca e imprime os ids encontrados')
+    args = parser.parse_args(argv)
+
+    from backend.database import engine
+
+    if args.reconstruir:
+        with engine.begin() as conn:
+            if criar_indice(conn):
+                logger.info('%s produtos indexados', indexar(conn))
+    if args.consulta:
+        with SessionLocal() as db:
+            for produto_id, relevancia in buscar(db, args.consulta):
+                print(produto_id, relevancia)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Cache em processo do catálogo de produtos (read-through, invalidado por versão).
+
+A versão do catálogo é o contador 'catalogo' da tabela `contadores`
+(`backend.sequencias`). Ela é incrementada na mesma transação de qualquer
+mudança em Produto/Categoria/Empresa (listener `after_flush` abaixo), então
+todos os workers enxergam a invalidação assim que o commit acontece; ler a
+versão custa uma consulta por chave primária.
+
+As respostas ficam guardadas já serializadas (bytes JSON) com TTL
+(`CATALOGO_CACHE_TTL`) e limite de entradas (`CATALOGO_CACHE_MAX`, LRU). O
+ETag deriva da versão, permitindo respostas 304 para `If-None-Match`.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend import models, sequencias
+from backend.database import Session as SessionLocal
+
+ESCOPO_VERSAO = 'catalogo'
+CATALOGO_CACHE_TTL = float(os.environ.get('CATALOGO_CACHE_TTL', '300'))
+CATALOGO_CACHE_MAX = int(os.environ.get('CATALOGO_CACHE_MAX', '256'))
+
+_MODELOS_CATALOGO = (models.Produto, models.Categoria, models.Empresa)
+
+
+class CacheCatalogo:
+    def __init__(self, max_entradas: int = CATALOGO_CACHE_MAX, ttl: float = CATALOGO_CACHE_TTL):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas: 'OrderedDict[Tuple[int, Hashable], Tuple[float, bytes, Dict[str, str]]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.nao_modificados = 0
+
+    def obter_ou_gerar(self, versao: int, chave: Hashable, gerar: Callable[[], Any]) -> Tuple[bytes, Dict[str, str]]:
+        """Retorna (bytes, headers) em cache para (versao, chave) ou gera/serializa e guarda.
+
+        `gerar` retorna os dados ou uma tupla (dados, headers extras da resposta).
+        """
+        k = (versao, chave)
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(k)
+            if entrada is not None and entrada[0] > agora:
+                self._entradas.move_to_end(k)
+                self.hits += 1
+                return entrada[1], entrada[2]
+            self.misses += 1
+
+        dados = gerar()
+        headers: Dict[str, str] = {}
+        if isinstance(dados, tuple):
+            dados, headers = dados
+        corpo = json.dumps(dados, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self._entradas[k] = (agora + self.ttl, corpo, headers)
+            self._entradas.move_to_end(k)
+            # Entradas de versões antigas nunca mais serão lidas: saem primeiro pelo LRU
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return corpo, headers
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'ttl_segundos': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'nao_modificados': self.nao_modificados,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+cache = CacheCatalogo()
+
+
+def versao_atual(db: Session) -> int:
+    return sequencias.valor_atual(db, ESCOPO_VERSAO)
+
+
+def invalidar(db: Session) -> None:
+    """Incrementa a versão do catálogo na transação corrente.
+
+    Chamar após UPDATEs em massa que não passam pelo ORM; mudanças feitas em
+    objetos Produto/Categoria/Empresa já invalidam automaticamente.
+    """
+    sequencias.proximo_valor(db, ESCOPO_VERSAO)
+
+
+def _etag(versao: int, chave: Hashable) -> str:
+    digest = hashlib.sha1(repr(chave).encode('utf-8')).hexdigest()[:12]
+    return f'W/"catalogo-{versao}-{digest}"'
+
+
+def resposta(request: Request, db: Session, chave: Hashable, gerar: Callable[[], Any]) -> Response:
+    """Monta a resposta JSON cacheada (ou 304) para `chave` na versão atual do catálogo."""
+    versao = versao_atual(db)
+    etag = _etag(versao, chave)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if_none_match = request.headers.get('If-None-Match') or ''
+    if etag in [t.strip() for t in if_none_match.split(',')]:
+        with cache._lock:
+            cache.nao_modificados += 1
+        return Response(status_code=304, headers=headers)
+    corpo, extras = cache.obter_ou_gerar(versao, chave, gerar)
+    return Response(content=corpo, media_type='application/json', headers={**extras, **headers})
+
+
+def _apos_flush(session, flush_context) -> None:
+    if session.info.get('catalogo_invalidado'):
+        return
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, _MODELOS_CATALOGO):
+            break
+    else:
+        for obj in session.dirty:
+            if isinstance(obj, _MODELOS_CATALOGO) and session.is_modified(obj, include_collections=False):
+                break
+        else:
+            return
+    # Uma invalidação por transação basta: a versão nova só fica visível no commit
+    session.info['catalogo_invalidado'] = True
+    invalidar(session)
+
+
+def _fim_transacao(session, *args) -> None:
+    session.info.pop('catalogo_invalidado', None)
+
+
+event.listen(SessionLocal, 'after_flush', _apos_flush)
+event.listen(SessionLocal, 'after_commit', _fim_transacao)
+event.listen(SessionLocal, 'after_soft_rollback', _fim_transacao)
@@ -0,0 +1,153 @@
+"""Carrinhos anônimos por sessão (cookie `carrinho_sessao`).
+
+Sem login, `/carrinho/` caía no usuário 1 e todos os visitantes disputavam a mesma
+linha de carrinho. Agora o visitante anônimo recebe um cookie com um id aleatório e
+o carrinho é gravado com `session_id` (índice `ix_carrinhos_session_id`).
+
+- No login/cadastro o carrinho da sessão é mesclado no carrinho do usuário
+  (`mesclar`): upsert dos itens com soma das quantidades, numa transação. Se o
+  usuário ainda não tem carrinho, o da sessão só troca de dono.
+- A tarefa periódica `carrinhos_purgar` apaga, em lotes, carrinhos sem usuário
+  parados há mais de `CARRINHOS_ABANDONADOS_DIAS` (índice `ix_carrinhos_updated_at`).
+"""
+import os
+import re
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import Request, Response
+from sqlalchemy import delete, literal, select, update
+from sqlalchemy.orm import Session
+
+from backend import crud, models
+from backend.database import Session as SessionLocal, insert_dialeto
+from backend.logging_config import logger
+
+CARRINHO_COOKIE = os.environ.get('CARRINHO_COOKIE', 'carrinho_sessao')
+CARRINHOS_ABANDONADOS_DIAS = float(os.environ.get('CARRINHOS_ABANDONADOS_DIAS', '30'))
+CARRINHOS_LIMPEZA_SEGUNDOS = float(os.environ.get('CARRINHOS_LIMPEZA_SEGUNDOS', '3600'))
+CARRINHOS_LIMPEZA_LOTE = int(os.environ.get('CARRINHOS_LIMPEZA_LOTE', '500'))
+
+_RE_SESSAO = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+C = models.Carrinho
+I = models.CarrinhoItem
+
+
+# ----- Cookie -----
+def novo_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def do_request(request: Request) -> Optional[str]:
+    """Id da sessão do cookie (None se ausente ou malformado)."""
+    valor = request.cookies.get(CARRINHO_COOKIE)
+    return valor if valor and _RE_SESSAO.match(valor) else None
+
+
+def gravar_cookie(response: Response, session_id: str) -> None:
+    # renovado a cada alteração: o prazo conta a partir da última atividade
+    response.set_cookie(
+        key=CARRINHO_COOKIE, value=session_id, httponly=True, samesite='lax',
+        max_age=int(CARRINHOS_ABANDONADOS_DIAS * 86400),
+    )
+
+
+def apagar_cookie(response: Response) -> None:
+    response.delete_cookie(CARRINHO_COOKIE, path='/')
+
+
+# ----- Mesclagem no login -----
+def mesclar(db: Session, session_id: str, user_id: int) -> Optional[int]:
+    """Mescla o carrinho da sessão no carrinho do usuário (um commit). Retorna o id do carrinho resultante."""
+    anonimo = db.execute(
+        select(C.id).where(C.session_id == session_id, C.user_id.is_(None)).with_for_update()
+    ).scalar()
+    if anonimo is None:
+        return None
+    try:
+        destino = db.execute(select(C.id).where(C.user_id == user_id).with_for_update()).scalar()
+        if destino is None:
+            db.execute(
+                update(C).where(C.id == anonimo)
+                .values(user_id=user_id, session_id=None, updated_at=datetime.now(timezone.utc))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            return anonimo
+
+        stmt = insert_dialeto(db, I.__table__)
+        if stmt is not None:
+            T = I.__table__
+            colunas = ['carrinho_id', 'produto_id', 'nome', 'quantidade', 'preco_unitario', 'subtotal']
+            origem = select(
+                literal(destino), T.c.produto_id, T.c.nome, T.c.quantidade, T.c.preco_unitario, T.c.subtotal
+            ).where(T.c.carrinho_id == anonimo, T.c.produto_id.isnot(None))
+            quantidade = T.c.quantidade + stmt.excluded.quantidade
+            # preço do item mais recente (o da sessão)
+            db.execute(stmt.from_select(colunas, origem).on_conflict_do_update(
+                index_elements=['carrinho_id', 'produto_id'],
+                set_={
+                    'quantidade': quantidade,
+                    'preco_unitario': stmt.excluded.preco_unitario,
+                    'subtotal': quantidade * stmt.excluded.preco_unitario,
+                },
+            ))
+            db.execute(
+                delete(I).where(I.carrinho_id == anonimo, I.produto_id.isnot(None))
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            existentes = {it.produto_id: it for it in db.query(I).filter(I.carrinho_id == destino, I.produto_id.isnot(None))}
+            for it in db.query(I).filter(I.carrinho_id == anonimo, I.produto_id.isnot(None)):
+                alvo = existentes.get(it.produto_id)
+                if alvo is None:
+                    it.carrinho_id = destino
+                else:
+                    alvo.quantidade = int(alvo.quantidade or 0) + int(it.quantidade or 0)
+                    alvo.preco_unitario = it.preco_unitario
+                    db.delete(it)
+            db.flush()
+        # itens sem produto não conflitam: só mudam de carrinho
+        db.execute(
+            update(I).where(I.carrinho_id == anonimo).values(carrinho_id=destino)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(delete(C).where(C.id == anonimo).execution_options(synchronize_session=False))
+        db.execute(crud.stmt_recalcular_totais_carrinho([destino]))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return destino
+
+
+# ----- Limpeza -----
+def purgar_abandonados(
+    db: Session, dias: float = CARRINHOS_ABANDONADOS_DIAS, lote: int = CARRINHOS_LIMPEZA_LOTE
+) -> int:
+    """Apaga carrinhos sem usuário parados há mais de `dias`, com os itens, `lote` carrinhos por commit."""
+    limite = datetime.now(timezone.utc) - timedelta(days=dias)
+    total = 0
+    while True:
+        ids = db.scalars(
+            select(C.id).where(C.user_id.is_(None), C.updated_at < limite).order_by(C.updated_at).limit(lote)
+        ).all()
+        if not ids:
+            db.rollback()
+            break
+        db.execute(delete(I).where(I.carrinho_id.in_(ids)).execution_options(synchronize_session=False))
+        total += db.execute(delete(C).where(C.id.in_(ids)).execution_options(synchronize_session=False)).rowcount
+        db.commit()
+        if len(ids) < lote:
+            break
+    if total:
+        logger.info('%s carrinhos abandonados removidos', total)
+    return total
+
+
+def tarefa_purgar() -> int:
+    """Entrada usada por `backend.tarefas` (sessão própria)."""
+    with SessionLocal() as db:
+        return purgar_abandonados(db)
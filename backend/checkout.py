@@ -0,0 +1,103 @@
+"""Fechamento de conta (pagamento de mesa) em uma única transação.
+
+Antes cada item do pedido gerava um `create_movimentacao_estoque` com o próprio
+commit, seguido de commits separados para o pagamento, o pedido e a mesa; uma
+falha no meio deixava estoque baixado sem pagamento (ou o contrário). Aqui:
+
+1. o pedido pendente da mesa é lido com lock (evita pagar duas vezes);
+2. o estoque é baixado com `crud.create_movimentacoes_estoque_lote`: os produtos
+   afetados são travados numa única consulta (em ordem de id) e as movimentações
+   são inseridas em lote, e as reservas do pedido viram `convertida`;
+3. pagamento, pedido e mesa são gravados e tudo é confirmado num único commit.
+
+Qualquer erro desfaz a transação inteira.
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session, selectinload
+
+from backend import crud, eventos, models, reservas
+from backend.logging_config import logger
+
+ORIGEM_VENDA_FISICA = 'venda_fisica'
+
+
+class PedidoNaoEncontrado(Exception):
+    pass
+
+
+def _quantidades_por_produto(pedido: models.Pedido) -> Dict[int, int]:
+    quantidades: Dict[int, int] = OrderedDict()
+    for it in pedido.itens:
+        if it.produto_id is None:
+            continue
+        quantidades[it.produto_id] = quantidades.get(it.produto_id, 0) + int(it.quantidade or 0)
+    return quantidades
+
+
+def baixar_estoque_pedido(db: Session, pedido: models.Pedido, usuario_id: int, origem: str = ORIGEM_VENDA_FISICA) -> int:
+    """Aplica as saídas de estoque de todos os itens do pedido (sem commit). Retorna o nº de movimentações."""
+    linhas = [
+        {'produto_id': produto_id, 'quantidade': quantidade, 'tipo': 'saida', 'origem': origem, 'pedido_id': pedido.id}
+        for produto_id, quantidade in _quantidades_por_produto(pedido).items()
+    ]
+    if not linhas:
+        return 0
+    resultados = crud.create_movimentacoes_estoque_lote(db, linhas, usuario_id=usuario_id, commit=False)
+    ausentes = [r['produto_id'] for r in resultados if not r['ok']]
+    if ausentes:
+        logger.warning('Pedido %s: produtos %s não existem mais; estoque não baixado', pedido.id, ausentes)
+    return len(resultados) - len(ausentes)
+
+
+def fechar_mesa(
+    db: Session,
+    mesa_id: int,
+    metodo: Optional[str],
+    total=None,
+    usuario_id: int = 1,
+) -> Tuple[models.Pagamento, Optional[models.Mesa], models.Pedido]:
+    """Paga o pedido pendente da mesa, baixa o estoque e libera a mesa num único commit."""
+    try:
+        pedido = (
+            db.query(models.Pedido)
+            .options(selectinload(models.Pedido.itens))
+            .filter(models.Pedido.mesa_id == mesa_id, models.Pedido.status == 'Pendente')
+            .with_for_update()
+            .first()
+        )
+        if not pedido:
+            raise PedidoNaoEncontrado('Pedido pendente não encontrado para a mesa')
+
+        baixar_estoque_pedido(db, pedido, usuario_id)
+        reservas.converter_pedido(db, pedido.id)
+
+        try:
+            valor = float(total) if total is not None else float(pedido.total or 0)
+        except (TypeError, ValueError):
+            valor = float(pedido.total or 0)
+
+        pagamento = crud.create_pagamento(db, pedido.id, valor, metodo or 'indefinido', status='Confirmado', commit=False)
+
+        pedido.status = 'Entregue'
+        pedido.total = valor
+
+        mesa = crud.get_mesa(db, mesa_id)
+        if mesa:
+            mesa.status = 'Livre'
+            mesa.usuario_responsavel_id = None
+
+        db.flush()
+        eventos.publicar_apos_commit(db, 'mesa.pagamento', {
+            'mesa_id': mesa_id,
+            'pedido_id': pedido.id,
+            'pagamento_id': pagamento.id,
+            'valor': valor,
+        })
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info('Mesa %s fechada: pedido %s, pagamento %s', mesa_id, pedido.id, pagamento.id)
+    return pagamento, mesa, pedido
@@ -1,9 +1,50 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional, Dict, Any
-from . import models, schemas
-from datetime import datetime
-import re
+from sqlalchemy.orm import Session, load_only, selectinload
+from sqlalchemy import and_, case, delete, func, insert, or_, select, update
+from typing import List, Optional, Dict, Any, Tuple
+from . import models, schemas, sequencias, eventos, reservas, cache_catalogo
+from .database import insert_dialeto
+from backend.logging_config import logger
+from datetime import datetime, timezone
+from decimal import Decimal
+import base64
+import json
+import os
+
+# ----- Paginação por cursor (keyset) e projeção -----
+def codificar_cursor(valores: List[Any]) -> str:
+    """Cursor opaco (base64 de JSON) com os valores de ordenação do último registro."""
+    raw = json.dumps(valores, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor: str, tipos: List[Any]) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(raw)
+        if not isinstance(valores, list) or len(valores) != len(tipos):
+            raise ValueError('tamanho inesperado')
+        return [conv(v) for conv, v in zip(tipos, valores)]
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
+def _condicao_keyset(colunas, valores, descendente: bool = False):
+    """(c1, c2, ...) > (v1, v2, ...) (ou <) expandido em OR/AND, portátil entre bancos."""
+    condicao = None
+    for col, val in reversed(list(zip(colunas, valores))):
+        comparacao = col < val if descendente else col > val
+        condicao = comparacao if condicao is None else or_(comparacao, and_(col == val, condicao))
+    return condicao
+
+
+def _colunas(modelo, campos: List[str]):
+    """Converte nomes de campos em colunas do modelo (sempre inclui `id`)."""
+    colunas_validas = modelo.__table__.columns.keys()
+    invalidos = [c for c in campos if c not in colunas_validas]
+    if invalidos:
+        raise ValueError(f"Campos inválidos: {', '.join(invalidos)}")
+    return [getattr(modelo, c) for c in dict.fromkeys(['id', *campos])]
+
 
 # User
 def get_user(db: Session, user_id: int) -> Optional[models.User]:
@@ -52,8 +93,57 @@ def get_produto(db: Session, produto_id: int) -> Optional[models.Produto]:
 def get_produto_by_codigo(db: Session, codigo: str) -> Optional[models.Produto]:
     return db.query(models.Produto).filter(models.Produto.codigo == codigo).first()
 
-def get_produtos(db: Session, skip: int = 0, limit: int = 100) -> List[models.Produto]:
-    return db.query(models.Produto).offset(skip).limit(limit).all()
+def get_produtos(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    disponivel: Optional[bool] = None,
+    campos: Optional[List[str]] = None,
+    ordenar: Optional[str] = None
+) -> List[models.Produto]:
+    """Lista produtos por id, ou por `ordenar='rating'` (maior média primeiro, depois id
+    decrescente). Com `cursor` usa paginação keyset (ignora `skip`).
+
+    `campos` restringe as colunas carregadas (projeção); `id` é sempre incluído.
+    """
+    ordenar = ordenar or 'id'
+    if ordenar not in ('id', 'rating'):
+        raise ValueError("ordenar deve ser 'id' ou 'rating'")
+    query = db.query(models.Produto)
+    if campos:
+        # a ordenação por rating precisa da coluna para montar o cursor
+        extras = ['rating'] if ordenar == 'rating' else []
+        query = query.options(load_only(*_colunas(models.Produto, [*campos, *extras])))
+    if categoria_id is not None:
+        query = query.filter(models.Produto.categoria_id == categoria_id)
+    if empresa_id is not None:
+        query = query.filter(models.Produto.empresa_id == empresa_id)
+    if disponivel is not None:
+        query = query.filter(models.Produto.disponivel == disponivel)
+    if ordenar == 'rating':
+        # coalesce não: a coluna sempre é preenchida (default 0), e assim o índice (rating, id) é usado
+        colunas = [models.Produto.rating, models.Produto.id]
+        query = query.order_by(models.Produto.rating.desc(), models.Produto.id.desc())
+        if cursor:
+            valores = decodificar_cursor(cursor, [Decimal, int])
+            query = query.filter(_condicao_keyset(colunas, valores, descendente=True))
+    else:
+        query = query.order_by(models.Produto.id)
+        if cursor:
+            (ultimo_id,) = decodificar_cursor(cursor, [int])
+            query = query.filter(models.Produto.id > ultimo_id)
+    if not cursor:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+def cursor_produto(produto: models.Produto, ordenar: Optional[str] = None) -> str:
+    if ordenar == 'rating':
+        return codificar_cursor([str(produto.rating if produto.rating is not None else 0), produto.id])
+    return codificar_cursor([produto.id])
 
 def create_produto(db: Session, produto: schemas.ProdutoCreate) -> models.Produto:
     db_produto = models.Produto(**produto.dict())
@@ -103,38 +193,8 @@ def update_mesa_status(db: Session, mesa_id: int, status: str) -> Optional[model
 
 # Pedido
 def create_pedido(db: Session, pedido: schemas.PedidoCreate, usuario_id: int) -> models.Pedido:
-    # Gerar número do pedido (sequencial)
-    def _get_next_sequential_numero() -> str:
-        """Calcula o próximo número sequencial a partir dos pedidos já existentes.
-
-        Estratégia: busca todos os valores de `numero` em pedidos, extrai a primeira
-        sequência de dígitos encontrada e considera o maior. Retorna max+1, com
-        zero-pad mínimo de 2 dígitos.
-        """
-        max_num = 0
-        try:
-            rows = db.query(models.Pedido.numero).all()
-            for row in rows:
-                # row pode ser tuple com um elemento (numero,)
-                raw = row[0] if isinstance(row, (list, tuple)) and len(row) > 0 else row
-                if not raw:
-                    continue
-                s = str(raw)
-                m = re.search(r"(\d+)", s)
-                if m:
-                    try:
-                        v = int(m.group(1))
-                        if v > max_num:
-                            max_num = v
-                    except Exception:
-                        continue
-        except Exception:
-            # Em caso de erro, fallback para 0 e prossegue
-            max_num = 0
-        next_num = max_num + 1
-        return str(next_num).zfill(2)
-
-    numero = _get_next_sequential_numero()
+    # Gerar número do pedido (sequencial, O(1) via tabela de contadores)
+    numero = sequencias.proximo_numero_pedido(db)
     
     # Criar pedido
     db_pedido = models.Pedido(
@@ -150,21 +210,24 @@ def create_pedido(db: Session, pedido: schemas.PedidoCreate, usuario_id: int) ->
     db.flush()  # Obter ID do pedido
 
     # Adicionar itens
-    total = 0
+    subtotal = Decimal('0')
     for item in pedido.itens:
-        produto = db.query(models.Produto).filter(models.Produto.id == item["produto_id"]).first()
+        produto = db.query(models.Produto).filter(models.Produto.id == item.produto_id).first()
         if produto:
+            preco = item.preco_unitario if item.preco_unitario is not None else produto.venda
             pedido_item = models.PedidoItem(
                 pedido_id=db_pedido.id,
                 produto_id=produto.id,
                 nome=produto.nome,
-                quantidade=item["quantidade"],
-                preco_unitario=produto.preco_venda
+                quantidade=item.quantidade,
+                preco_unitario=preco
             )
             db.add(pedido_item)
-            total += pedido_item.subtotal
+            subtotal += _subtotal_item(item.quantidade, preco)
 
-    db_pedido.total = total
+    db_pedido.subtotal = subtotal
+    db_pedido.desconto = 0
+    db_pedido.total = subtotal
     db.commit()
     db.refresh(db_pedido)
     return db_pedido
@@ -176,20 +239,82 @@ def get_pedidos(
     db: Session, 
     skip: int = 0, 
     limit: int = 100, 
-    tipo: Optional[str] = None
+    tipo: Optional[str] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    mesa_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    desde: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    ordem: str = 'asc',
+    campos: Optional[List[str]] = None
 ) -> List[models.Pedido]:
+    """Lista pedidos ordenados por (created_at, id), `ordem` 'asc' ou 'desc'.
+
+    Com `cursor` usa paginação keyset (ignora `skip`), estável mesmo com pedidos
+    novos chegando. `campos` restringe as colunas carregadas; os itens só são
+    carregados (em uma consulta selectin) se `campos` for vazio ou incluir 'itens'.
+    """
     query = db.query(models.Pedido)
+    if campos:
+        query = query.options(load_only(*_colunas(models.Pedido, [c for c in campos if c != 'itens'])))
+    if not campos or 'itens' in campos:
+        query = query.options(selectinload(models.Pedido.itens))
     if tipo:
         query = query.filter(models.Pedido.tipo == tipo)
-    return query.offset(skip).limit(limit).all()
+    if status:
+        query = query.filter(models.Pedido.status == status)
+    if mesa_id is not None:
+        query = query.filter(models.Pedido.mesa_id == mesa_id)
+    if user_id is not None:
+        query = query.filter(models.Pedido.user_id == user_id)
+    if desde is not None:
+        query = query.filter(models.Pedido.created_at >= desde)
+    if ate is not None:
+        query = query.filter(models.Pedido.created_at < ate)
+
+    descendente = (ordem or '').lower() == 'desc'
+    colunas = [models.Pedido.created_at, models.Pedido.id]
+    query = query.order_by(*[c.desc() if descendente else c for c in colunas])
+    if cursor:
+        valores = decodificar_cursor(cursor, [datetime.fromisoformat, int])
+        query = query.filter(_condicao_keyset(colunas, valores, descendente))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+def cursor_pedido(pedido: models.Pedido) -> str:
+    return codificar_cursor([pedido.created_at.isoformat() if pedido.created_at else None, pedido.id])
 
 def get_pedido_pendente_por_mesa(db: Session, mesa_id: int) -> Optional[models.Pedido]:
-    return db.query(models.Pedido).filter(
+    return db.query(models.Pedido).options(selectinload(models.Pedido.itens)).filter(
         models.Pedido.mesa_id == mesa_id,
         models.Pedido.status == "Pendente"
     ).first()
 
 
+def get_mesas_snapshot(db: Session) -> List[Tuple[models.Mesa, Optional[models.Pedido]]]:
+    """Retorna todas as mesas com o pedido Pendente (e itens) de cada uma.
+
+    Um LEFT JOIN mesas/pedidos pendentes mais um selectin dos itens: o número de
+    consultas não cresce com a quantidade de mesas.
+    """
+    rows = (
+        db.query(models.Mesa, models.Pedido)
+        .outerjoin(models.Pedido, and_(models.Pedido.mesa_id == models.Mesa.id, models.Pedido.status == 'Pendente'))
+        .options(selectinload(models.Pedido.itens))
+        .order_by(models.Mesa.id, models.Pedido.id)
+        .all()
+    )
+    # Se houver mais de um pedido pendente por mesa (não deveria), manter o primeiro
+    snapshot: Dict[int, Tuple[models.Mesa, Optional[models.Pedido]]] = {}
+    for mesa, pedido in rows:
+        if mesa.id not in snapshot:
+            snapshot[mesa.id] = (mesa, pedido)
+    return list(snapshot.values())
+
+
 def add_item_to_pedido(
     db: Session,
     mesa_id: int,
@@ -204,29 +329,12 @@ def add_item_to_pedido(
     pedido = get_pedido_pendente_por_mesa(db, mesa_id)
     if pedido is None:
         # Criar pedido simples Pendente
-        # Número sequencial (reusar lógica semelhante a create_pedido)
-        def _get_next_sequential_numero_local() -> str:
-            max_num = 0
-            try:
-                rows = db.query(models.Pedido.numero).all()
-                for row in rows:
-                    raw = row[0] if isinstance(row, (list, tuple)) and len(row) > 0 else row
-                    if not raw:
-                        continue
-                    s = str(raw)
-                    m = re.search(r"(\d+)", s)
-                    if m:
-                        try:
-                            v = int(m.group(1))
-                            if v > max_num:
-                                max_num = v
-                        except Exception:
-                            continue
-            except Exception:
-                max_num = 0
-            return str(max_num + 1).zfill(2)
-
-        numero = numero_sugerido or _get_next_sequential_numero_local()
+        if numero_sugerido:
+            # número gerado offline pelo cliente: avançar o contador para não repeti-lo depois
+            numero = str(numero_sugerido)
+            sequencias.registrar_numero_pedido(db, numero)
+        else:
+            numero = sequencias.proximo_numero_pedido(db)
         pedido = models.Pedido(
             numero=numero,
             tipo='fisica',
@@ -234,6 +342,8 @@ def add_item_to_pedido(
             observacoes=None,
             mesa_id=mesa_id,
             user_id=usuario_id if usuario_id else 1,
+            subtotal=0,
+            desconto=0,
             total=0
         )
         db.add(pedido)
@@ -257,7 +367,7 @@ def add_item_to_pedido(
     if not produto:
         raise Exception(f"Produto {produto_id} não encontrado")
 
-    preco = preco_unitario if preco_unitario is not None else float(produto.preco_venda)
+    preco = preco_unitario if preco_unitario is not None else produto.venda
 
     pedido_item = models.PedidoItem(
         pedido_id=pedido.id,
@@ -269,12 +379,22 @@ def add_item_to_pedido(
     db.add(pedido_item)
     db.flush()
 
-    # Recalcular total
-    total = 0
-    for it in db.query(models.PedidoItem).filter(models.PedidoItem.pedido_id == pedido.id).all():
-        total += float(it.subtotal or 0)
-    pedido.total = total
-    db.add(pedido)
+    # Reservar o estoque do item; itens sincronizados do modo offline (número
+    # sugerido pelo cliente) já foram servidos e não são recusados
+    reservas.reservar(
+        db, produto.id, quantidade, mesa_id, usuario_id or pedido.user_id,
+        pedido_id=pedido.id, pedido_item_id=pedido_item.id, permitir_excedente=bool(numero_sugerido),
+    )
+
+    # Atualizar totais com o subtotal do novo item (mesma transação)
+    _atualizar_totais_pedido(db, pedido.id, _subtotal_item(quantidade, preco))
+    eventos.publicar_apos_commit(db, 'mesa.item_adicionado', {
+        'mesa_id': mesa_id,
+        'pedido_id': pedido.id,
+        'item_id': pedido_item.id,
+        'produto_id': produto.id,
+        'quantidade': quantidade,
+    })
     db.commit()
     db.refresh(pedido)
     return pedido
@@ -285,19 +405,125 @@ def remove_item_from_pedido(db: Session, item_id: int) -> Optional[models.Pedido
     item = db.query(models.PedidoItem).filter(models.PedidoItem.id == item_id).first()
     if not item:
         return None
-    pedido = db.query(models.Pedido).filter(models.Pedido.id == item.pedido_id).first()
+    pedido_id = item.pedido_id
+    delta = -_subtotal_item(item.quantidade, item.preco_unitario)
     db.delete(item)
+    db.flush()
+
+    reservas.liberar_item(db, item_id)
+    _atualizar_totais_pedido(db, pedido_id, delta)
+    pedido = db.query(models.Pedido).filter(models.Pedido.id == pedido_id).first()
+    eventos.publicar_apos_commit(db, 'mesa.item_removido', {
+        'mesa_id': pedido.mesa_id if pedido else None,
+        'pedido_id': pedido_id,
+        'item_id': item_id,
+    })
     db.commit()
+    return pedido
 
-    if pedido:
-        total = 0
-        for it in db.query(models.PedidoItem).filter(models.PedidoItem.pedido_id == pedido.id).all():
-            total += float(it.subtotal or 0)
-        pedido.total = total
-        db.add(pedido)
+
+# ----- Totais do pedido -----
+# 'delta' (padrão): cada inclusão/remoção aplica +/- subtotal do item com um UPDATE,
+# sem reler os itens do pedido. 'recalculo': soma os itens no banco a cada mudança.
+PEDIDO_TOTAIS_MODO = os.environ.get('PEDIDO_TOTAIS_MODO', 'delta').lower()
+
+
+def _subtotal_item(quantidade, preco_unitario) -> Decimal:
+    """Mesmo cálculo do listener de PedidoItem, em Decimal com 2 casas."""
+    try:
+        valor = Decimal(int(quantidade or 0)) * Decimal(str(preco_unitario or 0))
+    except Exception:
+        valor = Decimal('0')
+    return valor.quantize(Decimal('0.01'))
+
+
+def _soma_itens(pedido_id_coluna):
+    return (
+        select(func.coalesce(func.sum(models.PedidoItem.subtotal), 0))
+        .where(models.PedidoItem.pedido_id == pedido_id_coluna)
+        .scalar_subquery()
+    )
+
+
+def _atualizar_totais_pedido(db: Session, pedido_id: int, delta: Decimal) -> None:
+    """Atualiza subtotal e total (subtotal - desconto) do pedido em um único UPDATE.
+
+    O UPDATE usa os valores atuais da linha, então inclusões concorrentes na
+    mesma mesa não se sobrescrevem. Não faz commit.
+    """
+    if PEDIDO_TOTAIS_MODO == 'recalculo':
+        novo_subtotal = _soma_itens(models.Pedido.id)
+    else:
+        novo_subtotal = func.coalesce(models.Pedido.subtotal, 0) + delta
+    db.query(models.Pedido).filter(models.Pedido.id == pedido_id).update(
+        {
+            models.Pedido.subtotal: novo_subtotal,
+            models.Pedido.total: novo_subtotal - func.coalesce(models.Pedido.desconto, 0),
+        },
+        synchronize_session=False,
+    )
+
+
+def reconciliar_totais_pedidos(
+    db: Session,
+    corrigir: bool = False,
+    status: Optional[str] = 'Pendente',
+    pedido_ids: Optional[List[int]] = None
+) -> List[Dict[str, Any]]:
+    """Detecta pedidos cujo subtotal/total divergem da soma dos itens.
+
+    Uma única consulta agrupada compara `Pedido.subtotal` com SUM(itens.subtotal)
+    e `Pedido.total` com subtotal - desconto. Com `corrigir=True` grava os valores
+    recalculados. Por padrão verifica apenas pedidos Pendentes (pedidos pagos têm
+    `total` igual ao valor cobrado, que pode diferir da soma dos itens).
+    """
+    soma = (
+        db.query(
+            models.PedidoItem.pedido_id.label('pedido_id'),
+            func.sum(models.PedidoItem.subtotal).label('soma'),
+        )
+        .group_by(models.PedidoItem.pedido_id)
+        .subquery()
+    )
+    soma_itens = func.coalesce(soma.c.soma, 0)
+    desconto = func.coalesce(models.Pedido.desconto, 0)
+    query = (
+        db.query(models.Pedido.id, models.Pedido.subtotal, models.Pedido.desconto, models.Pedido.total, soma_itens.label('soma_itens'))
+        .outerjoin(soma, soma.c.pedido_id == models.Pedido.id)
+        .filter(or_(
+            func.coalesce(models.Pedido.subtotal, 0) != soma_itens,
+            func.coalesce(models.Pedido.total, 0) != soma_itens - desconto,
+        ))
+    )
+    if status:
+        query = query.filter(models.Pedido.status == status)
+    if pedido_ids:
+        query = query.filter(models.Pedido.id.in_(pedido_ids))
+
+    divergencias = []
+    for pid, subtotal, desc, total, soma_valor in query.all():
+        esperado = Decimal(str(soma_valor or 0)).quantize(Decimal('0.01'))
+        desc = Decimal(str(desc or 0))
+        # Ignorar diferenças de arredondamento (SQLite guarda Numeric como float)
+        if abs(Decimal(str(subtotal or 0)) - esperado) < Decimal('0.005') and abs(Decimal(str(total or 0)) - (esperado - desc)) < Decimal('0.005'):
+            continue
+        divergencias.append({
+            'pedido_id': pid,
+            'subtotal': float(subtotal or 0),
+            'total': float(total or 0),
+            'subtotal_esperado': float(esperado),
+            'total_esperado': float(esperado - desc),
+        })
+        if corrigir:
+            db.query(models.Pedido).filter(models.Pedido.id == pid).update(
+                {models.Pedido.subtotal: esperado, models.Pedido.total: esperado - desc},
+                synchronize_session=False,
+            )
+
+    if corrigir and divergencias:
         db.commit()
-        db.refresh(pedido)
-    return pedido
+        logger.warning('Totais de %s pedidos corrigidos pela reconciliação', len(divergencias))
+    return divergencias
 
 
 def cancel_pedido_por_mesa(db: Session, mesa_id: int, usuario_id: Optional[int] = None) -> bool:
@@ -305,7 +531,7 @@ def cancel_pedido_por_mesa(db: Session, mesa_id: int, usuario_id: Optional[int]
 
     Operações realizadas de forma transacional:
     - Localiza o pedido Pendente da mesa
-    - Para cada item: restaura o estoque do produto e registra uma MovimentacaoEstoque do tipo 'entrada'
+    - Libera as reservas de estoque dos itens (o estoque só é baixado no pagamento)
     - Remove o pedido (itens em cascade)
     - Atualiza o status da mesa para 'Livre' e limpa usuario_responsavel_id
     Retorna True se um pedido foi cancelado, False se não havia pedido.
@@ -314,32 +540,7 @@ def cancel_pedido_por_mesa(db: Session, mesa_id: int, usuario_id: Optional[int]
     if not pedido:
         return False
 
-    # Para cada item, restaurar o estoque e criar movimentação
-    for it in list(pedido.itens):
-        try:
-            # bloquear a linha do produto para evitar races
-            db_produto = db.query(models.Produto).filter(models.Produto.id == it.produto_id).with_for_update().first()
-            if db_produto:
-                quantidade_anterior = int(db_produto.estoque or 0)
-                quantidade_nova = quantidade_anterior + int(it.quantidade or 0)
-                db_produto.estoque = quantidade_nova
-                db.add(db_produto)
-
-                mov = models.MovimentacaoEstoque(
-                    produto_id=it.produto_id,
-                    tipo='entrada',
-                    origem='cancelamento_pedido',
-                    quantidade=int(it.quantidade or 0),
-                    quantidade_anterior=quantidade_anterior,
-                    quantidade_nova=quantidade_nova,
-                    usuario_id=usuario_id or 1,
-                    observacoes=f'Cancelamento do pedido {pedido.id}',
-                    pedido_id=pedido.id
-                )
-                db.add(mov)
-        except Exception:
-            # continuar com outros itens mesmo se houver problema em um
-            continue
+    reservas.liberar_pedido(db, pedido.id)
 
     # Atualizar mesa associada
     try:
@@ -351,6 +552,8 @@ def cancel_pedido_por_mesa(db: Session, mesa_id: int, usuario_id: Optional[int]
     except Exception:
         pass
 
+    eventos.publicar_apos_commit(db, 'mesa.pedido_cancelado', {'mesa_id': mesa_id, 'pedido_id': pedido.id})
+
     # Por fim, remover o pedido (itens são cascade)
     try:
         db.delete(pedido)
@@ -362,6 +565,19 @@ def cancel_pedido_por_mesa(db: Session, mesa_id: int, usuario_id: Optional[int]
     return True
 
 # Movimentação de Estoque
+def calcular_estoque_novo(quantidade_anterior: int, quantidade: int, tipo: str) -> int:
+    """Estoque resultante de uma movimentação `tipo` ('entrada'/'saida') de `quantidade`."""
+    if tipo == 'entrada':
+        return quantidade_anterior + int(quantidade)
+    if tipo == 'saida':
+        # Não permitir estoque negativo
+        return max(0, quantidade_anterior - int(quantidade))
+    # Se tipo desconhecido, apenas aplica incremento positivo
+    try:
+        return quantidade_anterior + int(quantidade)
+    except Exception:
+        return quantidade_anterior
+
 def create_movimentacao_estoque(
     db: Session,
     produto_id: int,
@@ -377,18 +593,7 @@ def create_movimentacao_estoque(
         raise Exception(f"Produto {produto_id} não encontrado")
 
     quantidade_anterior = int(db_produto.estoque or 0)
-
-    if tipo == 'entrada':
-        quantidade_nova = quantidade_anterior + int(quantidade)
-    elif tipo == 'saida':
-        # Não permitir estoque negativo
-        quantidade_nova = max(0, quantidade_anterior - int(quantidade))
-    else:
-        # Se tipo desconhecido, apenas aplica incremento positivo
-        try:
-            quantidade_nova = quantidade_anterior + int(quantidade)
-        except Exception:
-            quantidade_nova = quantidade_anterior
+    quantidade_nova = calcular_estoque_novo(quantidade_anterior, quantidade, tipo)
 
     # Atualizar estoque do produto
     db_produto.estoque = quantidade_nova
@@ -410,7 +615,156 @@ def create_movimentacao_estoque(
     db.refresh(db_mov)
     return db_mov
 
+def create_movimentacoes_estoque_lote(
+    db: Session,
+    movimentacoes: List[Dict[str, Any]],
+    usuario_id: Optional[int] = None,
+    tudo_ou_nada: bool = False,
+    commit: bool = True
+) -> List[Dict[str, Any]]:
+    """Aplica N movimentações de estoque numa única transação.
+
+    Cada linha: {produto_id, quantidade, tipo='saida', origem='venda_fisica',
+    observacoes, usuario_id, pedido_id}. Os produtos afetados são travados numa
+    única consulta, em ordem de id (ordem fixa evita deadlock entre lotes
+    concorrentes); linhas do mesmo produto são aplicadas na ordem recebida. As
+    movimentações são inseridas em lote.
+
+    Retorna um resultado por linha ({indice, ok, id, produto_id,
+    quantidade_anterior, quantidade_nova} ou {indice, ok: False, erro}). Linhas
+    inválidas não impedem as demais, exceto com `tudo_ou_nada=True`, em que nada é
+    aplicado se houver erro. Com `commit=False` o chamador confirma a transação.
+    """
+    resultados: List[Dict[str, Any]] = []
+    validas: List[Tuple[int, Dict[str, Any]]] = []
+    for indice, linha in enumerate(movimentacoes):
+        try:
+            produto_id = int(linha.get('produto_id'))
+            quantidade = int(linha.get('quantidade'))
+        except (TypeError, ValueError):
+            resultados.append({'indice': indice, 'ok': False, 'erro': 'produto_id e quantidade devem ser inteiros'})
+            continue
+        validas.append((indice, dict(linha, produto_id=produto_id, quantidade=quantidade)))
+        resultados.append(None)
+
+    ids = sorted({linha['produto_id'] for _, linha in validas})
+    produtos = {}
+    if ids:
+        produtos = {
+            p.id: p for p in db.query(models.Produto)
+            .filter(models.Produto.id.in_(ids))
+            .order_by(models.Produto.id)
+            .with_for_update()
+            .all()
+        }
+
+    agora = datetime.now(timezone.utc)
+    estoque = {pid: int(p.estoque or 0) for pid, p in produtos.items()}
+    linhas_insert: List[Dict[str, Any]] = []
+    indices_insert: List[int] = []
+    for indice, linha in validas:
+        produto = produtos.get(linha['produto_id'])
+        if produto is None:
+            resultados[indice] = {'indice': indice, 'ok': False, 'produto_id': linha['produto_id'], 'erro': f"Produto {linha['produto_id']} não encontrado"}
+            continue
+        tipo = linha.get('tipo') or 'saida'
+        anterior = estoque[produto.id]
+        nova = calcular_estoque_novo(anterior, linha['quantidade'], tipo)
+        estoque[produto.id] = nova
+        linhas_insert.append({
+            'produto_id': produto.id,
+            'tipo': tipo,
+            'origem': linha.get('origem') or 'venda_fisica',
+            'quantidade': linha['quantidade'],
+            'quantidade_anterior': anterior,
+            'quantidade_nova': nova,
+            'usuario_id': linha.get('usuario_id') or usuario_id or 1,
+            'observacoes': linha.get('observacoes'),
+            'pedido_id': linha.get('pedido_id'),
+            'created_at': agora,
+        })
+        indices_insert.append(indice)
+        resultados[indice] = {'indice': indice, 'ok': True, 'produto_id': produto.id, 'quantidade_anterior': anterior, 'quantidade_nova': nova}
+
+    falhas = any(not r['ok'] for r in resultados)
+    if tudo_ou_nada and falhas:
+        for r in resultados:
+            if r['ok']:
+                r.update(ok=False, erro='não aplicada: lote contém linhas inválidas')
+        if commit:
+            db.rollback()
+        return resultados
+
+    for produto_id in {linha['produto_id'] for linha in linhas_insert}:
+        produtos[produto_id].estoque = estoque[produto_id]
+    if linhas_insert:
+        # UPDATEs dos produtos (executemany no flush) + INSERT em lote das movimentações
+        db.flush()
+        # RETURNING sem ordem garantida (com `sort_by_parameter_order` o SQLite volta a
+        # um INSERT por linha): cada id é associado à sua linha pelo conteúdo; linhas
+        # com o mesmo conteúdo recebem os ids em ordem crescente
+        mov = models.MovimentacaoEstoque
+        def chave(l):
+            return (l['produto_id'], l['tipo'], l['quantidade'], l['quantidade_anterior'], l['quantidade_nova'])
+
+        pendentes: Dict[tuple, List[int]] = {}
+        for indice, linha in zip(indices_insert, linhas_insert):
+            pendentes.setdefault(chave(linha), []).append(indice)
+        inseridas = db.execute(
+            insert(mov).returning(mov.id, mov.produto_id, mov.tipo, mov.quantidade, mov.quantidade_anterior, mov.quantidade_nova),
+            linhas_insert
+        ).all()
+        for row in sorted(inseridas, key=lambda r: r.id):
+            resultados[pendentes[chave(row._mapping)].pop(0)]['id'] = row.id
+    if commit:
+        db.commit()
+    return resultados
+
 # Avaliação
+# Produto.avaliacoes_quantidade/avaliacoes_soma/rating são mantidos por delta na
+# mesma transação de cada escrita em `avaliacoes`; a listagem ordena por rating
+# sem consultar a tabela de avaliações.
+def _media_rating(quantidade, soma):
+    return case((quantidade > 0, func.round(soma * 1.0 / quantidade, 2)), else_=0)
+
+
+def aplicar_delta_rating(db: Session, produto_id: int, delta_quantidade: int, delta_soma: int) -> None:
+    """Atualiza os agregados de avaliação do produto com um UPDATE atômico (sem commit)."""
+    P = models.Produto
+    quantidade = P.avaliacoes_quantidade + delta_quantidade
+    soma = P.avaliacoes_soma + delta_soma
+    db.execute(
+        update(P).where(P.id == produto_id)
+        .values(avaliacoes_quantidade=quantidade, avaliacoes_soma=soma, rating=_media_rating(quantidade, soma))
+        .execution_options(synchronize_session=False)
+    )
+    # UPDATE fora do ORM: invalidar o cache do catálogo explicitamente
+    cache_catalogo.invalidar(db)
+
+
+def stmt_recalcular_ratings(produto_ids: Optional[List[int]] = None):
+    """UPDATE que recalcula os agregados a partir de `avaliacoes` (reparo/backfill)."""
+    P, A = models.Produto, models.Avaliacao
+    quantidade = select(func.count(A.id)).where(A.produto_id == P.id).scalar_subquery()
+    soma = select(func.coalesce(func.sum(A.rating), 0)).where(A.produto_id == P.id).scalar_subquery()
+    stmt = update(P).values(avaliacoes_quantidade=quantidade, avaliacoes_soma=soma, rating=_media_rating(quantidade, soma))
+    if produto_ids is not None:
+        stmt = stmt.where(P.id.in_(produto_ids))
+    return stmt.execution_options(synchronize_session=False)
+
+
+def recalcular_ratings(db: Session, produto_ids: Optional[List[int]] = None) -> int:
+    """Recalcula os agregados de avaliação (todos os produtos ou `produto_ids`). Retorna as linhas atualizadas."""
+    try:
+        atualizados = db.execute(stmt_recalcular_ratings(produto_ids)).rowcount
+        cache_catalogo.invalidar(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return atualizados
+
+
 def create_avaliacao(
     db: Session,
     usuario_id: int,
@@ -425,10 +779,52 @@ def create_avaliacao(
         comentario=comentario
     )
     db.add(db_aval)
+    db.flush()
+    aplicar_delta_rating(db, produto_id, 1, int(rating))
     db.commit()
     db.refresh(db_aval)
     return db_aval
 
+
+def salvar_avaliacao(
+    db: Session,
+    usuario_id: int,
+    produto_id: int,
+    rating: int,
+    comentario: Optional[str] = None
+) -> models.Avaliacao:
+    """Cria a avaliação do usuário para o produto ou atualiza a existente."""
+    existente = db.query(models.Avaliacao).filter(
+        models.Avaliacao.user_id == usuario_id,
+        models.Avaliacao.produto_id == produto_id
+    ).with_for_update().first()
+    if existente is None:
+        return create_avaliacao(db, usuario_id, produto_id, rating, comentario)
+    delta = int(rating) - int(existente.rating or 0)
+    existente.rating = rating
+    existente.comentario = comentario
+    db.flush()
+    if delta:
+        aplicar_delta_rating(db, produto_id, 0, delta)
+    db.commit()
+    db.refresh(existente)
+    return existente
+
+
+def delete_avaliacao(db: Session, usuario_id: int, produto_id: int) -> bool:
+    db_aval = db.query(models.Avaliacao).filter(
+        models.Avaliacao.user_id == usuario_id,
+        models.Avaliacao.produto_id == produto_id
+    ).with_for_update().first()
+    if not db_aval:
+        return False
+    rating = int(db_aval.rating or 0)
+    db.delete(db_aval)
+    db.flush()
+    aplicar_delta_rating(db, produto_id, -1, -rating)
+    db.commit()
+    return True
+
 def get_avaliacoes_produto(db: Session, produto_id: int) -> List[models.Avaliacao]:
     return db.query(models.Avaliacao).filter(models.Avaliacao.produto_id == produto_id).all()
 
@@ -469,8 +865,10 @@ def create_pagamento(
     pedido_id: int,
     valor: float,
     forma_pagamento: str,
-    status: str = "Pendente"
+    status: str = "Pendente",
+    commit: bool = True
 ) -> models.Pagamento:
+    """Cria o pagamento; com `commit=False` apenas faz flush (o chamador confirma a transação)."""
     db_pag = models.Pagamento(
         pedido_id=pedido_id,
         valor_total=valor,
@@ -478,12 +876,20 @@ def create_pagamento(
         status=status
     )
     db.add(db_pag)
+    if not commit:
+        db.flush()
+        return db_pag
     db.commit()
     db.refresh(db_pag)
     return db_pag
 
 
 # ----------------- Carrinho (loja online) -----------------
+# Cada mutação é uma transação com um único commit. `Carrinho.total` é mantido por
+# delta (UPDATE atômico: retira o subtotal anterior do item, soma o novo), sem
+# percorrer os itens; o item é gravado com upsert no índice único
+# (carrinho_id, produto_id). O primeiro UPDATE do total também trava a linha do
+# carrinho até o commit, serializando mutações concorrentes do mesmo carrinho.
 def get_cart_by_user(db: Session, user_id: int):
     return db.query(models.Carrinho).filter(models.Carrinho.user_id == user_id).first()
 
@@ -492,109 +898,218 @@ def get_cart_by_id(db: Session, cart_id: int):
     return db.query(models.Carrinho).filter(models.Carrinho.id == cart_id).first()
 
 
-def create_cart(db: Session, user_id: int = None, session_id: str = None) -> models.Carrinho:
-    cart = models.Carrinho(user_id=user_id, session_id=session_id, total=0)
-    db.add(cart)
-    db.commit()
-    db.refresh(cart)
-    return cart
+def get_cart_by_session(db: Session, session_id: str):
+    return db.query(models.Carrinho).filter(models.Carrinho.session_id == session_id, models.Carrinho.user_id.is_(None)).first()
 
 
-def _recalc_cart_total(db: Session, cart: models.Carrinho):
-    total = 0
-    for it in cart.itens:
-        try:
-            total += float(it.subtotal or 0)
-        except Exception:
-            continue
-    cart.total = total
+def create_cart(db: Session, user_id: int = None, session_id: str = None) -> models.Carrinho:
+    """Cria o carrinho (sem commit; o flush atribui o id)."""
+    cart = models.Carrinho(user_id=user_id, session_id=session_id, total=0)
     db.add(cart)
-    db.commit()
-    db.refresh(cart)
+    db.flush()
     return cart
 
 
-def add_item_to_cart(db: Session, user_id: int = None, produto_id: int = None, quantidade: int = 1, preco_unitario: float = None, session_id: str = None) -> models.Carrinho:
-    # localizar/usar carrinho do usuário ou criar
+def _obter_ou_criar_carrinho(db: Session, user_id: int = None, session_id: str = None) -> models.Carrinho:
     cart = None
     if user_id:
         cart = get_cart_by_user(db, user_id)
     if not cart and session_id:
-        cart = db.query(models.Carrinho).filter(models.Carrinho.session_id == session_id).first()
-    if not cart:
-        cart = create_cart(db, user_id=user_id, session_id=session_id)
+        cart = get_cart_by_session(db, session_id)
+    return cart or create_cart(db, user_id=user_id, session_id=session_id)
 
-    # localizar produto (opcionalmente aceitar nome/preco fornecido)
-    produto = None
-    if produto_id:
-        produto = db.query(models.Produto).filter(models.Produto.id == produto_id).first()
 
-    # se já existir item para mesmo produto no carrinho, incrementar quantidade
-    existing = None
-    if produto_id:
-        existing = db.query(models.CarrinhoItem).filter(models.CarrinhoItem.carrinho_id == cart.id, models.CarrinhoItem.produto_id == produto_id).first()
+def _subtotal_itens(*filtros):
+    I = models.CarrinhoItem
+    return select(func.coalesce(func.sum(I.subtotal), 0)).where(*filtros).scalar_subquery()
 
-    if existing:
-        existing.quantidade = int(existing.quantidade or 0) + int(quantidade or 0)
-        # se foi fornecido preco_unitario, atualizar
-        if preco_unitario is not None:
-            existing.preco_unitario = preco_unitario
-        db.add(existing)
-        db.commit()
-    else:
+
+def _ajustar_total(db: Session, carrinho_id, delta) -> Optional[int]:
+    """`total += delta` do carrinho (sem commit). Retorna o id do carrinho, ou None se não existe."""
+    C = models.Carrinho
+    return db.execute(
+        update(C).where(C.id == carrinho_id)
+        .values(total=func.round(C.total + delta, 2), updated_at=datetime.now(timezone.utc))
+        .returning(C.id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def stmt_recalcular_totais_carrinho(carrinho_ids: Optional[List[int]] = None):
+    """UPDATE que recalcula `Carrinho.total` a partir dos itens (conteúdo substituído, reparo/backfill)."""
+    C, I = models.Carrinho, models.CarrinhoItem
+    stmt = update(C).values(total=func.round(_subtotal_itens(I.carrinho_id == C.id), 2))
+    if carrinho_ids is not None:
+        stmt = stmt.where(C.id.in_(carrinho_ids))
+    return stmt.execution_options(synchronize_session=False)
+
+
+def _preco_produto(produto: Optional[models.Produto]) -> float:
+    return float(produto.venda) if produto is not None and produto.venda is not None else 0
+
+
+def add_item_to_cart(db: Session, user_id: int = None, produto_id: int = None, quantidade: int = 1, preco_unitario: float = None, session_id: str = None) -> models.Carrinho:
+    """Soma `quantidade` ao item do produto no carrinho (criando carrinho/item se preciso), num único commit."""
+    I = models.CarrinhoItem
+    quantidade = int(quantidade or 0)
+    try:
+        cart = _obter_ou_criar_carrinho(db, user_id, session_id)
+        produto = db.get(models.Produto, produto_id) if produto_id else None
         nome = produto.nome if produto else f'Produto {produto_id or ""}'
-        preco = preco_unitario if preco_unitario is not None else (float(produto.venda) if produto and getattr(produto, 'venda', None) is not None else 0)
-        item = models.CarrinhoItem(
-            carrinho_id=cart.id,
-            produto_id=produto.id if produto else produto_id,
-            nome=nome,
-            quantidade=int(quantidade or 0),
-            preco_unitario=preco
+        preco = float(preco_unitario) if preco_unitario is not None else _preco_produto(produto)
+
+        stmt = insert_dialeto(db, I.__table__) if produto_id else None
+        if stmt is not None:
+            # retira o subtotal atual do item (0 se ainda não existe) e trava o carrinho
+            _ajustar_total(db, cart.id, -_subtotal_itens(I.carrinho_id == cart.id, I.produto_id == produto_id))
+            novo_preco = stmt.excluded.preco_unitario if preco_unitario is not None else I.__table__.c.preco_unitario
+            nova_quantidade = I.__table__.c.quantidade + stmt.excluded.quantidade
+            stmt = stmt.values(
+                carrinho_id=cart.id, produto_id=produto_id, nome=nome,
+                quantidade=quantidade, preco_unitario=preco, subtotal=round(quantidade * preco, 2),
+            ).on_conflict_do_update(
+                index_elements=['carrinho_id', 'produto_id'],
+                set_={'quantidade': nova_quantidade, 'preco_unitario': novo_preco, 'subtotal': nova_quantidade * novo_preco},
+            ).returning(I.__table__.c.subtotal)
+            _ajustar_total(db, cart.id, db.execute(stmt).scalar_one())
+        else:
+            # bancos sem upsert (ou item sem produto): caminho pelo ORM
+            existing = None
+            if produto_id:
+                existing = db.query(I).filter(I.carrinho_id == cart.id, I.produto_id == produto_id).with_for_update().first()
+            anterior = float(existing.subtotal or 0) if existing else 0
+            if existing:
+                existing.quantidade = int(existing.quantidade or 0) + quantidade
+                if preco_unitario is not None:
+                    existing.preco_unitario = preco
+            else:
+                existing = I(carrinho_id=cart.id, produto_id=produto_id, nome=nome, quantidade=quantidade, preco_unitario=preco)
+                db.add(existing)
+            db.flush()
+            _ajustar_total(db, cart.id, float(existing.subtotal or 0) - anterior)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return cart
+
+
+def _filtro_item_carrinho(item_id: int, carrinho_id: Optional[int]):
+    I = models.CarrinhoItem
+    return (I.id == item_id,) if carrinho_id is None else (I.id == item_id, I.carrinho_id == carrinho_id)
+
+
+def update_cart_item_quantity(db: Session, item_id: int, quantidade: int, carrinho_id: int = None) -> models.Carrinho:
+    """Altera a quantidade do item; com `carrinho_id`, só se o item for desse carrinho (None se não encontrado)."""
+    I = models.CarrinhoItem
+    filtro = _filtro_item_carrinho(item_id, carrinho_id)
+    try:
+        carrinho_id = _ajustar_total(
+            db, select(I.carrinho_id).where(*filtro).scalar_subquery(), -_subtotal_itens(*filtro)
         )
-        db.add(item)
+        if carrinho_id is None:
+            db.rollback()
+            return None
+        subtotal = db.execute(
+            update(I).where(*filtro)
+            .values(quantidade=int(quantidade), subtotal=int(quantidade) * I.preco_unitario)
+            .returning(I.subtotal)
+            .execution_options(synchronize_session=False)
+        ).scalar_one()
+        _ajustar_total(db, carrinho_id, subtotal)
         db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return get_cart_by_id(db, carrinho_id)
 
-    # recalc total
-    db.refresh(cart)
-    cart = _recalc_cart_total(db, cart)
-    return cart
 
+def remove_item_from_cart(db: Session, item_id: int, carrinho_id: int = None) -> models.Carrinho:
+    """Remove o item; com `carrinho_id`, só se o item for desse carrinho (None se não encontrado)."""
+    I = models.CarrinhoItem
+    filtro = _filtro_item_carrinho(item_id, carrinho_id)
+    try:
+        carrinho_id = _ajustar_total(
+            db, select(I.carrinho_id).where(*filtro).scalar_subquery(), -_subtotal_itens(*filtro)
+        )
+        if carrinho_id is None:
+            db.rollback()
+            return None
+        db.execute(delete(I).where(*filtro).execution_options(synchronize_session=False))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return get_cart_by_id(db, carrinho_id)
 
-def update_cart_item_quantity(db: Session, item_id: int, quantidade: int) -> models.Carrinho:
-    item = db.query(models.CarrinhoItem).filter(models.CarrinhoItem.id == item_id).first()
-    if not item:
-        raise Exception('Item não encontrado')
-    item.quantidade = int(quantidade)
-    db.add(item)
-    db.commit()
-    cart = db.query(models.Carrinho).filter(models.Carrinho.id == item.carrinho_id).first()
-    cart = _recalc_cart_total(db, cart)
-    return cart
 
+def set_cart_contents(db: Session, itens: List[Dict[str, Any]], user_id: int = None, session_id: str = None) -> models.Carrinho:
+    """Substitui o conteúdo do carrinho por `itens` ([{produto_id, quantidade, preco_unitario?}]) num único commit.
 
-def remove_item_from_cart(db: Session, item_id: int) -> models.Carrinho:
-    item = db.query(models.CarrinhoItem).filter(models.CarrinhoItem.id == item_id).first()
-    if not item:
-        return None
-    cart = db.query(models.Carrinho).filter(models.Carrinho.id == item.carrinho_id).first()
-    db.delete(item)
-    db.commit()
-    if cart:
-        cart = _recalc_cart_total(db, cart)
+    Usado pela sincronização do modo offline, que envia o carrinho inteiro.
+    Produtos repetidos são somados; quantidade <= 0 remove o produto.
+    """
+    I = models.CarrinhoItem
+    desejados: Dict[int, Dict[str, Any]] = {}
+    for it in itens:
+        if it.get('produto_id') is None:
+            raise ValueError('produto_id é obrigatório em cada item')
+        produto_id = int(it['produto_id'])
+        atual = desejados.setdefault(produto_id, {'quantidade': 0, 'preco_unitario': None})
+        atual['quantidade'] += int(it.get('quantidade') or 0)
+        if it.get('preco_unitario') is not None:
+            atual['preco_unitario'] = float(it['preco_unitario'])
+    desejados = {pid: d for pid, d in desejados.items() if d['quantidade'] > 0}
+
+    try:
+        cart = _obter_ou_criar_carrinho(db, user_id, session_id)
+        db.execute(select(models.Carrinho.id).where(models.Carrinho.id == cart.id).with_for_update())
+        produtos = {
+            p.id: p for p in db.query(models.Produto).options(load_only(models.Produto.nome, models.Produto.venda))
+            .filter(models.Produto.id.in_(list(desejados)))
+        } if desejados else {}
+        faltando = sorted(set(desejados) - set(produtos))
+        if faltando:
+            raise ValueError(f'Produto(s) não encontrado(s): {faltando}')
+
+        linhas = []
+        for produto_id, d in desejados.items():
+            preco = d['preco_unitario'] if d['preco_unitario'] is not None else _preco_produto(produtos[produto_id])
+            linhas.append({
+                'carrinho_id': cart.id, 'produto_id': produto_id, 'nome': produtos[produto_id].nome,
+                'quantidade': d['quantidade'], 'preco_unitario': preco, 'subtotal': round(d['quantidade'] * preco, 2),
+            })
+
+        remover = delete(I).where(I.carrinho_id == cart.id)
+        stmt = insert_dialeto(db, I.__table__)
+        if stmt is not None and linhas:
+            remover = remover.where(or_(I.produto_id.is_(None), I.produto_id.notin_(list(desejados))))
+        db.execute(remover.execution_options(synchronize_session=False))
+        if linhas:
+            if stmt is not None:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['carrinho_id', 'produto_id'],
+                    set_={c: stmt.excluded[c] for c in ('nome', 'quantidade', 'preco_unitario', 'subtotal')},
+                )
+                db.execute(stmt, linhas)
+            else:
+                db.execute(insert(I.__table__), linhas)
+        db.execute(stmt_recalcular_totais_carrinho([cart.id]))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return cart
 
 
 def clear_cart(db: Session, cart_id: int) -> bool:
-    cart = get_cart_by_id(db, cart_id)
-    if not cart:
-        return False
-    # remover todos os itens
-    for it in list(cart.itens):
-        try:
-            db.delete(it)
-        except Exception:
-            continue
-    cart.total = 0
-    db.add(cart)
-    db.commit()
+    try:
+        if _ajustar_total(db, cart_id, -models.Carrinho.total) is None:
+            db.rollback()
+            return False
+        db.execute(delete(models.CarrinhoItem).where(models.CarrinhoItem.carrinho_id == cart_id).execution_options(synchronize_session=False))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
     return True
\ No newline at end of file
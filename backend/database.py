@@ -1,23 +1,179 @@
 import os
-from sqlalchemy import create_engine
+import threading
+from typing import Any, Dict
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Reaproveita a variável de ambiente se existir, senão usa sqlite local
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///bancodados.db')
 
-# Ajuste para sqlite em multi-thread
-connect_args = {}
-if DATABASE_URL.startswith('sqlite'):
-    connect_args = {"connect_args": {"check_same_thread": False}}
+# ----- SQLite: pragmas aplicados em cada conexão nova -----
+# WAL deixa leitores e um escritor trabalharem ao mesmo tempo (tablets lendo
+# mesas enquanto outro grava um item). busy_timeout faz quem vai pegar o lock de
+# escrita esperar em vez de falhar com "database is locked" -- mas só quando o lock é
+# pedido no BEGIN. Numa transação DEFERRED (o padrão do pysqlite) que lê e depois
+# escreve, a promoção para escrita falha na hora com SQLITE_BUSY(_SNAPSHOT), sem
+# consultar o busy_timeout. Por isso o driver não abre transações sozinho
+# (`isolation_level=None`) e o evento `begin` abaixo emite `BEGIN IMMEDIATE`; só as
+# sessões de leitura (`get_db` em GET/HEAD/OPTIONS, `engine_leitura`) usam DEFERRED.
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', '65536'))
+SQLITE_MMAP_MB = int(os.getenv('SQLITE_MMAP_MB', '256'))
+
+# ----- Pool de conexões (Postgres e demais servidores; SQLite em arquivo também usa) -----
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no')
+
+
+def _sqlite_em_memoria(url) -> bool:
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+
+def _opcoes_engine(database_url: str) -> Dict[str, Any]:
+    url = make_url(database_url)
+    if url.get_backend_name() == 'sqlite':
+        # Ajuste para sqlite em multi-thread
+        # isolation_level=None: o BEGIN é emitido pelo evento `begin` (ver _begin_sqlite)
+        opcoes: Dict[str, Any] = {'connect_args': {'check_same_thread': False, 'isolation_level': None}}
+        if not _sqlite_em_memoria(url):
+            opcoes.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        return opcoes
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+_SQLITE_EM_MEMORIA = _sqlite_em_memoria(make_url(DATABASE_URL))
+
+
+def _configurar_sqlite(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        if not _SQLITE_EM_MEMORIA:
+            cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+            cursor.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}')
+        cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+        # valor negativo = tamanho em KiB (por conexão)
+        cursor.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KB}')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+    finally:
+        cursor.close()
+
+
+# execution option com o modo do BEGIN no SQLite ('IMMEDIATE' quando ausente)
+SQLITE_BEGIN = 'sqlite_begin'
+
+
+def _begin_sqlite(conn) -> None:
+    conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get(SQLITE_BEGIN, 'IMMEDIATE')}")
+
+
+engine = create_engine(DATABASE_URL, **_opcoes_engine(DATABASE_URL))
+if engine.dialect.name == 'sqlite':
+    event.listen(engine, 'connect', _configurar_sqlite)
+    event.listen(engine, 'begin', _begin_sqlite)
+
+# mesmo pool; no SQLite as transações começam com BEGIN DEFERRED (não pegam o lock de escrita)
+engine_leitura = engine.execution_options(**{SQLITE_BEGIN: 'DEFERRED'})
 
-engine = create_engine(DATABASE_URL, **connect_args)
 Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
 
-def get_db():
-    """FastAPI dependency that yields a DB session and garante o close."""
-    db = Session()
+# ----- Estatísticas do pool -----
+_pool_lock = threading.Lock()
+_pool_contadores = {'conexoes_criadas': 0, 'checkouts': 0, 'em_uso': 0, 'pico_em_uso': 0, 'invalidadas': 0}
+
+
+def _ao_conectar(dbapi_connection, connection_record) -> None:
+    with _pool_lock:
+        _pool_contadores['conexoes_criadas'] += 1
+
+
+def _ao_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    with _pool_lock:
+        _pool_contadores['checkouts'] += 1
+        _pool_contadores['em_uso'] += 1
+        _pool_contadores['pico_em_uso'] = max(_pool_contadores['pico_em_uso'], _pool_contadores['em_uso'])
+
+
+def _ao_checkin(dbapi_connection, connection_record) -> None:
+    with _pool_lock:
+        _pool_contadores['em_uso'] = max(_pool_contadores['em_uso'] - 1, 0)
+
+
+def _ao_invalidar(dbapi_connection, connection_record, exception) -> None:
+    with _pool_lock:
+        _pool_contadores['invalidadas'] += 1
+
+
+event.listen(engine, 'connect', _ao_conectar)
+event.listen(engine, 'checkout', _ao_checkout)
+event.listen(engine, 'checkin', _ao_checkin)
+event.listen(engine, 'invalidate', _ao_invalidar)
+
+
+def estatisticas_pool() -> Dict[str, Any]:
+    """Uso do pool de conexões (para `GET /db/pool` e diagnóstico de saturação)."""
+    pool = engine.pool
+    with _pool_lock:
+        dados: Dict[str, Any] = dict(_pool_contadores)
+    dados['pool'] = type(pool).__name__
+    dados['dialeto'] = engine.dialect.name
+    for nome in ('size', 'checkedin', 'checkedout', 'overflow'):
+        metodo = getattr(pool, nome, None)
+        if callable(metodo):
+            dados[nome] = metodo()
+    if hasattr(pool, '_max_overflow'):
+        dados['max_overflow'] = pool._max_overflow
+    if engine.dialect.name == 'sqlite':
+        dados['sqlite'] = {
+            'journal_mode': SQLITE_JOURNAL_MODE,
+            'synchronous': SQLITE_SYNCHRONOUS,
+            'busy_timeout_ms': SQLITE_BUSY_TIMEOUT_MS,
+        }
+    return dados
+
+
+def insert_dialeto(db, tabela):
+    """Retorna um `INSERT` específico do dialeto (sqlite/postgresql) para `tabela`.
+
+    Esses inserts suportam `on_conflict_do_nothing`/`on_conflict_do_update`.
+    Para outros bancos retorna None e o chamador deve usar o caminho genérico.
+    """
+    nome = db.get_bind().dialect.name
+    if nome == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(tabela)
+    if nome == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(tabela)
+    return None
+
+
+METODOS_LEITURA = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+def get_db(request: Request):
+    """FastAPI dependency that yields a DB session and garante o close.
+
+    Requisições de leitura usam `engine_leitura` (BEGIN DEFERRED no SQLite); as demais,
+    BEGIN IMMEDIATE.
+    """
+    db = Session(bind=engine_leitura) if request.method in METODOS_LEITURA else Session()
     try:
         yield db
     finally:
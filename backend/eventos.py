@@ -0,0 +1,273 @@
+"""Barramento de eventos em processo para mudanças de mesas/pedidos.
+
+As operações de escrita (incluir/remover item, cancelar pedido, pagamento)
+registram eventos com `publicar_apos_commit`; eles só são entregues depois do
+commit da sessão (e descartados em rollback). Os tablets recebem os eventos
+por Server-Sent Events em `GET /eventos/stream` em vez de consultar as mesas
+periodicamente.
+
+- Cada cliente tem uma fila limitada (`EVENTOS_FILA_CLIENTE`). Um cliente lento
+  nunca bloqueia quem publica: se a fila encher, os eventos perdidos são
+  reenviados a partir do buffer circular (`EVENTOS_BUFFER`) quando ele drenar.
+- Reconexões enviam `Last-Event-ID`; se o id já saiu do buffer o cliente recebe
+  um evento `resync` e deve recarregar o estado (ex: `GET /mesas/snapshot`).
+- Sem broker externo. Com vários workers, `EVENTOS_RELAY_DB=<arquivo.sqlite>`
+  faz todos os processos gravarem/lerem os eventos de um arquivo SQLite local.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from backend.database import Session as SessionLocal
+from backend.logging_config import logger
+
+EVENTOS_BUFFER = int(os.environ.get('EVENTOS_BUFFER', '1000'))
+EVENTOS_FILA_CLIENTE = int(os.environ.get('EVENTOS_FILA_CLIENTE', '256'))
+EVENTOS_KEEPALIVE_SEGUNDOS = float(os.environ.get('EVENTOS_KEEPALIVE_SEGUNDOS', '15'))
+EVENTOS_RELAY_DB = os.environ.get('EVENTOS_RELAY_DB')
+
+
+@dataclass
+class Evento:
+    id: int
+    tipo: str
+    dados: Dict[str, Any]
+    criado_em: float
+
+    def sse(self) -> str:
+        return f"id: {self.id}\nevent: {self.tipo}\ndata: {json.dumps(self.dados, default=str)}\n\n"
+
+
+class Assinatura:
+    """Cliente conectado ao stream: fila limitada consumida no event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tamanho_fila: int, ultimo_id: int = 0):
+        self.loop = loop
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=tamanho_fila)
+        self.atrasada = False
+        self.ultimo_id = ultimo_id
+
+    def _entregar(self, evento: Evento) -> None:
+        # Executa no event loop do cliente (via call_soon_threadsafe)
+        if self.atrasada:
+            return
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Descarta; o stream recupera os eventos do buffer quando a fila esvaziar
+            self.atrasada = True
+
+
+class RelaySQLite:
+    """Distribui eventos entre workers usando um arquivo SQLite compartilhado."""
+
+    def __init__(self, caminho: str, intervalo: float = 0.2, retencao_segundos: int = 3600):
+        self.caminho = caminho
+        self.intervalo = intervalo
+        self.retencao_segundos = retencao_segundos
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        with self._conectar() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS eventos ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, dados TEXT NOT NULL, criado_em REAL NOT NULL)'
+            )
+
+    def _conectar(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.caminho, timeout=5)
+
+    def gravar(self, tipo: str, dados: Dict[str, Any]) -> None:
+        with self._conectar() as conn:
+            conn.execute('INSERT INTO eventos (tipo, dados, criado_em) VALUES (?, ?, ?)', (tipo, json.dumps(dados, default=str), time.time()))
+
+    def iniciar(self, barramento: 'BarramentoEventos') -> None:
+        if self._thread is not None:
+            return
+        with self._conectar() as conn:
+            ultimo = conn.execute('SELECT COALESCE(MAX(id), 0) FROM eventos').fetchone()[0]
+        self._thread = threading.Thread(target=self._loop, args=(barramento, ultimo), name='eventos-relay', daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+
+    def _loop(self, barramento: 'BarramentoEventos', ultimo: int) -> None:
+        ultima_limpeza = time.time()
+        while not self._parar.wait(self.intervalo):
+            try:
+                with self._conectar() as conn:
+                    rows = conn.execute('SELECT id, tipo, dados, criado_em FROM eventos WHERE id > ? ORDER BY id', (ultimo,)).fetchall()
+                    for id_, tipo, dados, criado_em in rows:
+                        barramento._despachar(Evento(id_, tipo, json.loads(dados), criado_em))
+                        ultimo = id_
+                    if time.time() - ultima_limpeza > 60:
+                        conn.execute('DELETE FROM eventos WHERE criado_em < ?', (time.time() - self.retencao_segundos,))
+                        ultima_limpeza = time.time()
+            except Exception:
+                logger.exception('Falha ao ler eventos do relay %s', self.caminho)
+
+
+class BarramentoEventos:
+    def __init__(self, tamanho_buffer: int = EVENTOS_BUFFER, tamanho_fila: int = EVENTOS_FILA_CLIENTE, relay: Optional[RelaySQLite] = None):
+        self._lock = threading.Lock()
+        self._buffer: deque = deque(maxlen=tamanho_buffer)
+        self._assinaturas: set = set()
+        self._tamanho_fila = tamanho_fila
+        self._relay = relay
+        # ids crescentes entre reinícios do processo: um Last-Event-ID antigo cai em `resync`
+        self._seq = int(time.time() * 1000)
+        self._inicio = 0 if relay is not None else self._seq
+
+    @property
+    def ultimo_id(self) -> int:
+        with self._lock:
+            return self._buffer[-1].id if self._buffer else 0
+
+    def publicar(self, tipo: str, dados: Dict[str, Any]) -> None:
+        """Publica um evento (thread-safe; pode ser chamado das threads de request)."""
+        if self._relay is not None:
+            try:
+                self._relay.gravar(tipo, dados)
+                return
+            except Exception:
+                logger.exception('Falha ao gravar evento no relay; entregando apenas localmente')
+        with self._lock:
+            self._seq += 1
+            evento = Evento(self._seq, tipo, dados, time.time())
+        self._despachar(evento)
+
+    def _despachar(self, evento: Evento) -> None:
+        with self._lock:
+            self._buffer.append(evento)
+            assinaturas = list(self._assinaturas)
+        for a in assinaturas:
+            try:
+                a.loop.call_soon_threadsafe(a._entregar, evento)
+            except RuntimeError:
+                # loop encerrado: cliente já saiu
+                self.cancelar(a)
+
+    def eventos_desde(self, ultimo_id: int) -> Tuple[List[Evento], bool]:
+        """Eventos do buffer com id > ultimo_id; o bool indica se não houve lacuna."""
+        with self._lock:
+            eventos = list(self._buffer)
+        if not eventos:
+            return [], ultimo_id >= self._inicio
+        completo = ultimo_id >= eventos[0].id - 1
+        return [e for e in eventos if e.id > ultimo_id], completo
+
+    def assinar(self, ultimo_id: Optional[int] = None) -> Tuple[Assinatura, List[Evento], bool]:
+        """Registra um cliente e retorna (assinatura, eventos a reenviar, completo)."""
+        a = Assinatura(asyncio.get_running_loop(), self._tamanho_fila)
+        with self._lock:
+            self._assinaturas.add(a)
+            inicio = self._buffer[-1].id if self._buffer else 0
+        if ultimo_id is None:
+            a.ultimo_id = inicio
+            return a, [], True
+        a.ultimo_id = ultimo_id
+        pendentes, completo = self.eventos_desde(ultimo_id)
+        return a, pendentes, completo
+
+    def cancelar(self, a: Assinatura) -> None:
+        with self._lock:
+            self._assinaturas.discard(a)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'clientes': len(self._assinaturas),
+                'buffer': len(self._buffer),
+                'ultimo_id': self._buffer[-1].id if self._buffer else 0,
+                'relay': self._relay.caminho if self._relay else None,
+            }
+
+    def iniciar(self) -> None:
+        if self._relay is not None:
+            self._relay.iniciar(self)
+
+    def parar(self) -> None:
+        if self._relay is not None:
+            self._relay.parar()
+
+
+barramento = BarramentoEventos(relay=RelaySQLite(EVENTOS_RELAY_DB) if EVENTOS_RELAY_DB else None)
+
+
+# ----- Integração com a sessão: publicar somente após commit -----
+def publicar_apos_commit(db, tipo: str, dados: Dict[str, Any]) -> None:
+    """Agenda um evento para ser publicado quando a transação de `db` for confirmada."""
+    db.info.setdefault('eventos_pendentes', []).append((tipo, dados))
+
+
+def _apos_commit(session) -> None:
+    pendentes = session.info.pop('eventos_pendentes', None)
+    for tipo, dados in pendentes or []:
+        try:
+            barramento.publicar(tipo, dados)
+        except Exception:
+            logger.exception('Falha ao publicar evento %s', tipo)
+
+
+def _apos_rollback(session, previous_transaction) -> None:
+    # Rollback de savepoint mantém a transação externa: só descartar no rollback da transação toda
+    if not session.in_transaction():
+        session.info.pop('eventos_pendentes', None)
+
+
+event.listen(SessionLocal, 'after_commit', _apos_commit)
+event.listen(SessionLocal, 'after_soft_rollback', _apos_rollback)
+
+
+# ----- Stream SSE -----
+def _filtrar(evento: Evento, mesa_id: Optional[int]) -> bool:
+    return mesa_id is None or evento.dados.get('mesa_id') == mesa_id
+
+
+async def stream_sse(request, ultimo_id: Optional[int] = None, mesa_id: Optional[int] = None) -> AsyncIterator[str]:
+    """Gera o stream SSE de um cliente (reenvio a partir de `ultimo_id`, keep-alive e backpressure)."""
+    a, pendentes, completo = barramento.assinar(ultimo_id)
+    try:
+        yield 'retry: 3000\n\n'
+        if not completo:
+            yield f"event: resync\ndata: {json.dumps({'ultimo_id': barramento.ultimo_id})}\n\n"
+        for ev in pendentes:
+            a.ultimo_id = ev.id
+            if _filtrar(ev, mesa_id):
+                yield ev.sse()
+
+        while True:
+            if a.atrasada and a.fila.empty():
+                # A fila transbordou: recuperar os eventos descartados pelo buffer
+                a.atrasada = False
+                perdidos, completo = barramento.eventos_desde(a.ultimo_id)
+                if not completo:
+                    yield f"event: resync\ndata: {json.dumps({'ultimo_id': barramento.ultimo_id})}\n\n"
+                for ev in perdidos:
+                    a.ultimo_id = ev.id
+                    if _filtrar(ev, mesa_id):
+                        yield ev.sse()
+                continue
+            try:
+                ev = await asyncio.wait_for(a.fila.get(), timeout=EVENTOS_KEEPALIVE_SEGUNDOS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ': keep-alive\n\n'
+                continue
+            if ev.id <= a.ultimo_id:
+                continue
+            a.ultimo_id = ev.id
+            if _filtrar(ev, mesa_id):
+                yield ev.sse()
+    finally:
+        barramento.cancelar(a)
@@ -0,0 +1,124 @@
+"""Facetas do catálogo (`GET /produtos/facetas`): contagens para a barra de filtros.
+
+Contagem por categoria, empresa, estilo e faixas de ABV/IBU, calculada com
+consultas agrupadas em vez de baixar o catálogo inteiro no navegador. Os filtros
+atuais (categoria, empresa, estilo, disponível e a busca `q`) restringem as
+contagens; cada faceta ignora o próprio filtro (facetas disjuntivas), para que a
+barra continue mostrando as outras opções da dimensão já escolhida.
+
+ABV é texto livre no cadastro ('4.8', '5,5%'): os valores distintos são agrupados no
+banco e classificados nas faixas aqui.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend import busca, models
+
+# (rótulo, mínimo inclusivo, máximo exclusivo)
+FAIXAS_ABV: Sequence[Tuple[str, Optional[float], Optional[float]]] = (
+    ('ate-4', None, 4.0), ('4-6', 4.0, 6.0), ('6-8', 6.0, 8.0), ('8+', 8.0, None),
+)
+FAIXAS_IBU: Sequence[Tuple[str, Optional[float], Optional[float]]] = (
+    ('ate-20', None, 20), ('20-40', 20, 40), ('40-60', 40, 60), ('60+', 60, None),
+)
+# limite de produtos considerados quando há busca textual
+MAX_RESULTADOS_BUSCA = 5000
+
+P = models.Produto
+
+
+def _numero(valor) -> Optional[float]:
+    if valor is None:
+        return None
+    try:
+        return float(str(valor).replace('%', '').replace(',', '.').strip())
+    except ValueError:
+        return None
+
+
+def _faixa(valor: Optional[float], faixas) -> Optional[str]:
+    if valor is None:
+        return None
+    for rotulo, minimo, maximo in faixas:
+        if (minimo is None or valor >= minimo) and (maximo is None or valor < maximo):
+            return rotulo
+    return None
+
+
+def _contar_faixas(linhas, faixas) -> List[Dict[str, Any]]:
+    contagem = {rotulo: 0 for rotulo, _, _ in faixas}
+    for valor, quantidade in linhas:
+        rotulo = _faixa(_numero(valor), faixas)
+        if rotulo is not None:
+            contagem[rotulo] += quantidade
+    return [
+        {'faixa': rotulo, 'min': minimo, 'max': maximo, 'quantidade': contagem[rotulo]}
+        for rotulo, minimo, maximo in faixas
+    ]
+
+
+def calcular(
+    db: Session,
+    q: Optional[str] = None,
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    style: Optional[str] = None,
+    disponivel: Optional[bool] = None,
+) -> Dict[str, Any]:
+    ids_busca = None
+    if q and busca.termos(q):
+        ids_busca = [pid for pid, _ in busca.buscar(db, q, limit=MAX_RESULTADOS_BUSCA)]
+
+    def filtros(exceto: Optional[str] = None) -> list:
+        condicoes = []
+        if ids_busca is not None:
+            condicoes.append(P.id.in_(ids_busca))
+        if disponivel is not None:
+            condicoes.append(P.disponivel == disponivel)
+        if categoria_id is not None and exceto != 'categoria':
+            condicoes.append(P.categoria_id == categoria_id)
+        if empresa_id is not None and exceto != 'empresa':
+            condicoes.append(P.empresa_id == empresa_id)
+        if style and exceto != 'style':
+            condicoes.append(P.style == style)
+        return condicoes
+
+    contagem = func.count(P.id)
+    categorias = (
+        db.query(models.Categoria.id, models.Categoria.nome, contagem)
+        .join(P, P.categoria_id == models.Categoria.id)
+        .filter(*filtros('categoria'))
+        .group_by(models.Categoria.id, models.Categoria.nome)
+        .order_by(contagem.desc(), models.Categoria.nome)
+        .all()
+    )
+    empresas = (
+        db.query(models.Empresa.id, models.Empresa.nome, contagem)
+        .join(P, P.empresa_id == models.Empresa.id)
+        .filter(*filtros('empresa'))
+        .group_by(models.Empresa.id, models.Empresa.nome)
+        .order_by(contagem.desc(), models.Empresa.nome)
+        .all()
+    )
+    estilos = (
+        db.query(P.style, contagem)
+        .filter(P.style.isnot(None), P.style != '', *filtros('style'))
+        .group_by(P.style)
+        .order_by(contagem.desc(), P.style)
+        .all()
+    )
+    base = filtros()
+    abv = db.query(P.abv, contagem).filter(P.abv.isnot(None), *base).group_by(P.abv).all()
+    ibu = db.query(P.ibu, contagem).filter(P.ibu.isnot(None), *base).group_by(P.ibu).all()
+    total = db.query(contagem).filter(*base).scalar()
+
+    return {
+        'total': int(total or 0),
+        'categorias': [{'id': i, 'nome': nome, 'quantidade': n} for i, nome, n in categorias],
+        'empresas': [{'id': i, 'nome': nome, 'quantidade': n} for i, nome, n in empresas],
+        'estilos': [{'valor': valor, 'quantidade': n} for valor, n in estilos],
+        'abv': _contar_faixas(abv, FAIXAS_ABV),
+        'ibu': _contar_faixas(ibu, FAIXAS_IBU),
+    }
@@ -11,6 +11,7 @@ sys.path.insert(0, str(backend_dir.parent))
 
 from backend.database import Session
 from backend.models import User
+from backend.senhas import BCRYPT_ROUNDS
 import bcrypt # Biblioteca para hashing de senhas
 
 def fix_passwords():
@@ -26,7 +27,7 @@ def fix_passwords():
             default_password = "123456"
             
             # Gera o hash correto
-            salt = bcrypt.gensalt()
+            salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
             hashed = bcrypt.hashpw(default_password.encode('utf-8'), salt).decode('utf-8')
             
             # Atualiza a senha
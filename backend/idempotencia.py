@@ -0,0 +1,327 @@
+"""Cabeçalho `Idempotency-Key` nas escritas de pedido, item de mesa e pagamento.
+
+Com Wi-Fi instável os tablets reenviam `POST /mesas/{id}/itens`, `POST /pedidos/` e
+`POST /mesas/{id}/pagamento`, e cada reenvio duplicava o item ou o pagamento. O
+cliente gera uma chave por operação (ex: `crypto.randomUUID()`) e a repete nos
+reenvios; o middleware ASGI abaixo (`Idempotencia`), que só age nessas rotas:
+
+- na primeira execução registra a chave como 'em_andamento' (`idempotencia_chaves`),
+  executa a rota e grava a resposta se for 2xx (outras respostas liberam a chave,
+  para que o reenvio tente de novo);
+- nos reenvios devolve a resposta gravada sem executar a rota (cabeçalho
+  `Idempotent-Replayed: true`); 409 se a primeira execução ainda está em andamento e
+  422 se a mesma chave vier com outro corpo.
+
+As respostas concluídas ficam também num cache em memória (LRU, `IDEMPOTENCIA_CACHE_ITENS`)
+na frente da tabela. Registros vencem após `IDEMPOTENCIA_TTL_HORAS` e são apagados em
+lotes pela tarefa `idempotencia_purgar`.
+
+Limite: a escrita da rota e o `concluir` são transações separadas. Se o worker cair entre
+as duas (ou o `concluir` falhar mesmo após nova tentativa, caso em que a resposta vira
+500), a escrita fica confirmada e a chave continua 'em_andamento': os reenvios recebem 409
+e, passados `IDEMPOTENCIA_ANDAMENTO_SEGUNDOS`, assumem a chave e executam a rota de novo.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+
+from backend import models
+from backend.database import Session as SessionLocal
+from backend.logging_config import logger
+
+CABECALHO = 'Idempotency-Key'
+IDEMPOTENCIA_TTL_HORAS = float(os.environ.get('IDEMPOTENCIA_TTL_HORAS', '24'))
+IDEMPOTENCIA_CACHE_ITENS = int(os.environ.get('IDEMPOTENCIA_CACHE_ITENS', '2048'))
+# execução 'em_andamento' mais antiga que isto é considerada abandonada (worker caiu)
+IDEMPOTENCIA_ANDAMENTO_SEGUNDOS = float(os.environ.get('IDEMPOTENCIA_ANDAMENTO_SEGUNDOS', '120'))
+IDEMPOTENCIA_LIMPEZA_SEGUNDOS = float(os.environ.get('IDEMPOTENCIA_LIMPEZA_SEGUNDOS', '3600'))
+IDEMPOTENCIA_LIMPEZA_LOTE = int(os.environ.get('IDEMPOTENCIA_LIMPEZA_LOTE', '1000'))
+
+ROTAS = (
+    ('POST', re.compile(r'^/mesas/\d+/itens/?$')),
+    ('POST', re.compile(r'^/pedidos/?$')),
+    ('POST', re.compile(r'^/mesas/\d+/pagamento/?$')),
+)
+MAX_CHAVE = 128
+
+EM_ANDAMENTO = 'em_andamento'
+CONCLUIDA = 'concluida'
+
+K = models.ChaveIdempotencia
+
+
+@dataclass
+class Resposta:
+    hash_requisicao: str
+    status_code: int
+    media_type: Optional[str]
+    corpo: bytes
+
+
+def _agora() -> datetime:
+    # gravado em UTC sem fuso, como os demais DateTime no SQLite
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def rota_protegida(metodo: str, caminho: str) -> bool:
+    return any(metodo == m and padrao.match(caminho) for m, padrao in ROTAS)
+
+
+def hash_requisicao(corpo: bytes) -> str:
+    return hashlib.sha256(corpo).hexdigest()
+
+
+# ----- Cache em memória -----
+class CacheRespostas:
+    def __init__(self, max_itens: int = IDEMPOTENCIA_CACHE_ITENS, ttl: float = IDEMPOTENCIA_TTL_HORAS * 3600):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas: 'OrderedDict[Tuple[str, str], Tuple[float, Resposta]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, chave: Tuple[str, str]) -> Optional[Resposta]:
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] <= time.monotonic():
+                self._entradas.pop(chave, None)
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, chave: Tuple[str, str], resposta: Resposta) -> None:
+        if self.max_itens <= 0:
+            return
+        with self._lock:
+            self._entradas[chave] = (time.monotonic() + self.ttl, resposta)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_itens:
+                self._entradas.popitem(last=False)
+
+    def estatisticas(self) -> Dict[str, object]:
+        with self._lock:
+            return {'entradas': len(self._entradas), 'max_itens': self.max_itens, 'hits': self.hits, 'misses': self.misses}
+
+
+cache = CacheRespostas()
+
+
+# ----- Registro no banco -----
+def reivindicar(rota: str, chave: str, hash_req: str) -> Tuple[str, Optional[Resposta]]:
+    """Registra a chave como em andamento. Retorna ('nova'|'concluida'|'em_andamento', resposta gravada)."""
+    agora = _agora()
+    valores = dict(
+        hash_requisicao=hash_req, status=EM_ANDAMENTO, status_code=None, media_type=None, corpo=None,
+        created_at=agora, expira_em=agora + timedelta(hours=IDEMPOTENCIA_TTL_HORAS),
+    )
+    with SessionLocal() as db:
+        try:
+            db.add(K(rota=rota, chave=chave, **valores))
+            db.commit()
+            return 'nova', None
+        except IntegrityError:
+            db.rollback()
+        # assumir registro vencido ou execução abandonada (worker caiu no meio)
+        abandonada = (K.expira_em <= agora) | (
+            (K.status == EM_ANDAMENTO) & (K.created_at <= agora - timedelta(seconds=IDEMPOTENCIA_ANDAMENTO_SEGUNDOS))
+        )
+        assumida = db.execute(
+            update(K).where(K.rota == rota, K.chave == chave, abandonada).values(**valores)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if assumida:
+            return 'nova', None
+        registro = db.execute(select(K).where(K.rota == rota, K.chave == chave)).scalar_one_or_none()
+        if registro is None:
+            # apagada entre o INSERT e a leitura (a primeira execução falhou): tentar de novo
+            return reivindicar(rota, chave, hash_req)
+        if registro.status != CONCLUIDA:
+            return EM_ANDAMENTO, Resposta(registro.hash_requisicao, 0, None, b'')
+        return CONCLUIDA, Resposta(registro.hash_requisicao, registro.status_code, registro.media_type, registro.corpo or b'')
+
+
+def concluir(rota: str, chave: str, resposta: Resposta, tentativas: int = 2) -> None:
+    """Grava a resposta da chave; repete a gravação se falhar (ex.: 'database is locked')."""
+    for tentativa in range(1, tentativas + 1):
+        try:
+            with SessionLocal() as db:
+                db.execute(
+                    update(K).where(K.rota == rota, K.chave == chave)
+                    .values(status=CONCLUIDA, status_code=resposta.status_code, media_type=resposta.media_type, corpo=resposta.corpo)
+                    .execution_options(synchronize_session=False)
+                )
+                db.commit()
+            break
+        except Exception:
+            if tentativa == tentativas:
+                raise
+            logger.warning('Falha gravando resposta idempotente (%s); tentando de novo', rota, exc_info=True)
+    cache.guardar((rota, chave), resposta)
+
+
+def liberar(rota: str, chave: str) -> None:
+    with SessionLocal() as db:
+        db.execute(delete(K).where(K.rota == rota, K.chave == chave, K.status == EM_ANDAMENTO))
+        db.commit()
+
+
+def purgar_expiradas(lote: int = IDEMPOTENCIA_LIMPEZA_LOTE) -> int:
+    """Apaga as chaves vencidas, `lote` por commit."""
+    total = 0
+    with SessionLocal() as db:
+        while True:
+            agora = _agora()
+            chaves = db.execute(select(K.rota, K.chave).where(K.expira_em <= agora).limit(lote)).all()
+            if not chaves:
+                db.rollback()
+                break
+            db.execute(delete(K).where(tuple_(K.rota, K.chave).in_([tuple(c) for c in chaves])))
+            db.commit()
+            total += len(chaves)
+            if len(chaves) < lote:
+                break
+    if total:
+        logger.info('%s chaves de idempotência vencidas removidas', total)
+    return total
+
+
+def tarefa_purgar() -> int:
+    """Entrada usada por `backend.tarefas`."""
+    return purgar_expiradas()
+
+
+# ----- Middleware -----
+def _replay(resposta: Resposta) -> Response:
+    return Response(
+        content=resposta.corpo, status_code=resposta.status_code, media_type=resposta.media_type,
+        headers={'Idempotent-Replayed': 'true'},
+    )
+
+
+def _corpo_divergente() -> Response:
+    return JSONResponse(status_code=422, content={'detail': f'{CABECALHO} já usada com outro corpo de requisição'})
+
+
+async def _ler_corpo(receive):
+    """Lê o corpo inteiro da requisição e devolve (corpo, receive que o entrega de novo à rota)."""
+    partes = []
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] != 'http.request':
+            break
+        partes.append(mensagem.get('body', b''))
+        if not mensagem.get('more_body'):
+            break
+    corpo = b''.join(partes)
+    entregue = False
+
+    async def repetir():
+        nonlocal entregue
+        if entregue:
+            return await receive()
+        entregue = True
+        return {'type': 'http.request', 'body': corpo, 'more_body': False}
+
+    return corpo, repetir
+
+
+async def _resposta_guardada(rota: str, chave: str, hash_req: str) -> Optional[Response]:
+    """Resposta para um reenvio (replay, 409 ou 422); None se esta execução é a primeira."""
+    guardada = cache.obter((rota, chave))
+    if guardada is not None:
+        return _replay(guardada) if guardada.hash_requisicao == hash_req else _corpo_divergente()
+
+    estado, guardada = await run_in_threadpool(reivindicar, rota, chave, hash_req)
+    if estado == 'nova':
+        return None
+    if guardada.hash_requisicao != hash_req:
+        return _corpo_divergente()
+    if estado == EM_ANDAMENTO:
+        return JSONResponse(
+            status_code=409, content={'detail': 'Requisição com esta chave ainda em processamento'},
+            headers={'Retry-After': '1'},
+        )
+    cache.guardar((rota, chave), guardada)
+    return _replay(guardada)
+
+
+class Idempotencia:
+    """Middleware ASGI. Fora das rotas protegidas, ou sem o cabeçalho, repassa direto:
+    as demais requisições da API não pagam nada além do teste da rota."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not rota_protegida(scope['method'], scope['path']):
+            await self.app(scope, receive, send)
+            return
+        chave = Headers(scope=scope).get(CABECALHO)
+        if not chave:
+            await self.app(scope, receive, send)
+            return
+        if len(chave) > MAX_CHAVE:
+            resposta = JSONResponse(status_code=400, content={'detail': f'{CABECALHO} deve ter no máximo {MAX_CHAVE} caracteres'})
+            await resposta(scope, receive, send)
+            return
+
+        rota = f"{scope['method']} {scope['path']}"
+        corpo_req, receive = await _ler_corpo(receive)
+        hash_req = hash_requisicao(corpo_req)
+        resposta = await _resposta_guardada(rota, chave, hash_req)
+        if resposta is not None:
+            await resposta(scope, receive, send)
+            return
+
+        # primeira execução: a resposta é retida até a chave ser concluída ou liberada
+        inicio: Dict[str, Any] = {}
+        partes = []
+
+        async def reter(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                inicio.update(mensagem)
+            elif mensagem['type'] == 'http.response.body':
+                partes.append(mensagem.get('body', b''))
+
+        try:
+            await self.app(scope, receive, reter)
+        except Exception:
+            await run_in_threadpool(liberar, rota, chave)
+            raise
+        corpo = b''.join(partes)
+        status_code = inicio.get('status', 500)
+        if 200 <= status_code < 300:
+            try:
+                media_type = Headers(raw=inicio.get('headers') or []).get('content-type')
+                await run_in_threadpool(concluir, rota, chave, Resposta(hash_req, status_code, media_type, corpo))
+            except Exception:
+                # a escrita foi confirmada, mas um 2xx sem a chave concluída deixaria o reenvio
+                # executar de novo sem aviso. A chave fica 'em_andamento' (reenvios recebem 409).
+                logger.exception('Falha gravando resposta idempotente (%s)', rota)
+                resposta = JSONResponse(
+                    status_code=500,
+                    content={'detail': 'Operação executada, mas a resposta não foi registrada; não reenvie com outra chave'},
+                )
+                await resposta(scope, receive, send)
+                return
+        else:
+            await run_in_threadpool(liberar, rota, chave)
+        await send(inicio)
+        await send({'type': 'http.response.body', 'body': corpo})
@@ -0,0 +1,101 @@
+"""Importação de inventário (CSV) usando movimentações de estoque em lote.
+
+Colunas aceitas (cabeçalho obrigatório, separador `,` ou `;`):
+- `produto_id` ou `codigo` (código do produto)
+- `quantidade`
+- `tipo` (opcional, padrão 'entrada'; 'entrada' ou 'saida')
+- `origem` (opcional, padrão 'ajuste_inventario')
+- `observacoes` (opcional)
+
+Cada bloco de `--lote` linhas é aplicado numa única transação por
+`crud.create_movimentacoes_estoque_lote`; linhas inválidas são registradas no
+log e não impedem as demais (use `--tudo-ou-nada` para descartar o bloco inteiro).
+
+    python -m backend.importar_estoque inventario.csv
+    python -m backend.importar_estoque inventario.csv --lote 1000 --usuario 1 --tudo-ou-nada
+"""
+import argparse
+import csv
+import pathlib
+import sys
+from typing import Dict, List, Optional
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy.orm import Session
+
+from backend import crud, models
+from backend.logging_config import logger
+
+ORIGEM_PADRAO = 'ajuste_inventario'
+
+
+def ler_csv(caminho: str) -> List[dict]:
+    with open(caminho, newline='', encoding='utf-8-sig') as f:
+        amostra = f.read(4096)
+        f.seek(0)
+        delimitador = ';' if amostra.count(';') > amostra.count(',') else ','
+        return [{(k or '').strip().lower(): (v or '').strip() for k, v in linha.items()} for linha in csv.DictReader(f, delimiter=delimitador)]
+
+
+def _ids_por_codigo(db: Session, linhas: List[dict]) -> Dict[str, int]:
+    codigos = {linha['codigo'] for linha in linhas if linha.get('codigo') and not linha.get('produto_id')}
+    if not codigos:
+        return {}
+    return dict(db.query(models.Produto.codigo, models.Produto.id).filter(models.Produto.codigo.in_(codigos)).all())
+
+
+def montar_movimentacoes(db: Session, linhas: List[dict]) -> List[dict]:
+    """Converte as linhas do CSV no formato de `create_movimentacoes_estoque_lote` (códigos resolvidos numa consulta)."""
+    ids = _ids_por_codigo(db, linhas)
+    movimentacoes = []
+    for linha in linhas:
+        produto_id = linha.get('produto_id') or ids.get(linha.get('codigo'))
+        movimentacoes.append({
+            'produto_id': produto_id,
+            'quantidade': linha.get('quantidade'),
+            'tipo': linha.get('tipo') or 'entrada',
+            'origem': linha.get('origem') or ORIGEM_PADRAO,
+            'observacoes': linha.get('observacoes') or None,
+        })
+    return movimentacoes
+
+
+def importar(db: Session, linhas: List[dict], usuario_id: int = 1, lote: int = 500, tudo_ou_nada: bool = False) -> Dict[str, int]:
+    aplicadas = falhas = 0
+    for inicio in range(0, len(linhas), lote):
+        bloco = linhas[inicio:inicio + lote]
+        resultados = crud.create_movimentacoes_estoque_lote(
+            db, montar_movimentacoes(db, bloco), usuario_id=usuario_id, tudo_ou_nada=tudo_ou_nada
+        )
+        for r in resultados:
+            if r['ok']:
+                aplicadas += 1
+            else:
+                falhas += 1
+                # +2: cabeçalho e numeração a partir de 1
+                logger.warning('Linha %s ignorada: %s', inicio + r['indice'] + 2, r['erro'])
+    return {'linhas': len(linhas), 'aplicadas': aplicadas, 'falhas': falhas}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('arquivo')
+    parser.add_argument('--lote', type=int, default=500, help='linhas por transação')
+    parser.add_argument('--usuario', type=int, default=1, help='usuário registrado nas movimentações')
+    parser.add_argument('--tudo-ou-nada', action='store_true', help='descarta o bloco inteiro se alguma linha falhar')
+    args = parser.parse_args(argv)
+
+    from backend.database import Session as SessionLocal
+
+    linhas = ler_csv(args.arquivo)
+    with SessionLocal() as session:
+        resumo = importar(session, linhas, usuario_id=args.usuario, lote=max(args.lote, 1), tudo_ou_nada=args.tudo_ou_nada)
+    logger.info('Importação concluída: %s', resumo)
+
+
+if __name__ == '__main__':
+    main()
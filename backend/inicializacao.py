@@ -0,0 +1,146 @@
+"""Preparação do banco no startup, com caminho rápido para bancos já na versão atual.
+
+Antes, todo worker chamava `create_all`, as migrações e `populate_db_sqlalchemy.main()`
+(que repetia o `create_all`, contava cinco tabelas e carregava todas as mesas para
+o backfill de slug) a cada boot. Agora a tabela `banco_versao` guarda:
+
+- `schema`: impressão digital dos modelos (tabelas, colunas e índices) e das
+  migrações registradas em `backend.migracoes`;
+- `carga`: versão da carga inicial (`CARGA_VERSAO`) já aplicada.
+
+No startup (`preparar`) uma única consulta lê os marcadores. Se conferem, nada mais
+roda (partida quente). Senão o banco é preparado como antes e os marcadores são
+gravados ao final (partida fria). A carga inicial e os backfills também rodam à mão:
+
+    python -m backend.inicializacao              # schema + migrações + carga inicial
+    python -m backend.inicializacao --sem-carga  # só schema + migrações
+    python -m backend.inicializacao --status     # marcadores gravados x esperados
+"""
+import argparse
+import hashlib
+import os
+import sys
+import pathlib
+import time
+from typing import Dict, Optional
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+
+from backend import migracoes, models
+from backend.logging_config import logger
+
+# incrementar quando a carga inicial (populate) mudar e precisar rodar de novo
+CARGA_VERSAO = '1'
+# carga inicial no startup quando o banco ainda não tem o marcador (0 = só pelo comando)
+INICIALIZACAO_CARGA = os.environ.get('INICIALIZACAO_CARGA', '1').lower() not in ('0', 'false', 'no')
+# ignora os marcadores e refaz a preparação completa em todo startup
+INICIALIZACAO_FORCAR = os.environ.get('INICIALIZACAO_FORCAR', '0').lower() in ('1', 'true', 'yes')
+
+SCHEMA = 'schema'
+CARGA = 'carga'
+
+V = models.VersaoBanco
+
+
+def impressao_schema() -> str:
+    """Hash dos modelos e migrações: muda quando uma tabela, coluna, índice ou migração muda."""
+    partes = []
+    for tabela in sorted(models.Base.metadata.tables.values(), key=lambda t: t.name):
+        colunas = ','.join(f'{c.name}:{c.type!r}:{int(bool(c.nullable))}' for c in tabela.columns)
+        indices = ','.join(sorted(i.name or '' for i in tabela.indexes))
+        partes.append(f'{tabela.name}({colunas})[{indices}]')
+    partes.append('migracoes:' + ','.join(sorted(m.versao for m in migracoes.MIGRACOES)))
+    return hashlib.sha256('\n'.join(partes).encode()).hexdigest()[:32]
+
+
+def ler_marcadores(engine: Engine) -> Dict[str, str]:
+    """Marcadores gravados ({} se a tabela ainda não existe)."""
+    try:
+        with engine.connect() as conn:
+            return dict(conn.execute(select(V.chave, V.valor)).all())
+    except (OperationalError, ProgrammingError):
+        return {}
+
+
+def gravar_marcadores(engine: Engine, valores: Dict[str, str]) -> None:
+    from backend.database import Session as SessionLocal
+
+    with SessionLocal(bind=engine) as db:
+        for chave, valor in valores.items():
+            db.merge(V(chave=chave, valor=valor))
+        try:
+            db.commit()
+        except IntegrityError:
+            # outro worker gravou o mesmo marcador ao mesmo tempo
+            db.rollback()
+
+
+def preparar_schema(engine: Engine) -> None:
+    models.Base.metadata.create_all(bind=engine)
+    logger.info('Tabelas do banco verificadas/criadas')
+    migracoes.aplicar(engine)
+
+
+def carga_inicial() -> bool:
+    """Popula o banco vazio e faz os backfills de dados. Retorna True se populou."""
+    from backend.populate_db_sqlalchemy import main as populate_main
+
+    return populate_main(criar_tabelas=False)
+
+
+def preparar(engine: Optional[Engine] = None, carga: bool = INICIALIZACAO_CARGA, forcar: bool = INICIALIZACAO_FORCAR) -> str:
+    """Prepara o banco no startup. Retorna 'quente' (marcadores conferem, nada feito) ou 'fria'."""
+    engine = engine or models.engine
+    inicio = time.perf_counter()
+    esperado = impressao_schema()
+    marcadores = {} if forcar else ler_marcadores(engine)
+    carga_pendente = carga and marcadores.get(CARGA) != CARGA_VERSAO
+    if marcadores.get(SCHEMA) == esperado and not carga_pendente:
+        logger.info('Banco na versão atual: startup sem create_all/migrações/carga (%.1f ms)', (time.perf_counter() - inicio) * 1000)
+        return 'quente'
+
+    novos = {}
+    if marcadores.get(SCHEMA) != esperado:
+        preparar_schema(engine)
+        novos[SCHEMA] = esperado
+    if carga_pendente:
+        carga_inicial()
+        novos[CARGA] = CARGA_VERSAO
+    gravar_marcadores(engine, novos)
+    logger.info('Banco preparado (partida fria) em %.0f ms', (time.perf_counter() - inicio) * 1000)
+    return 'fria'
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Prepara o banco: schema, migrações e carga inicial.')
+    parser.add_argument('--sem-carga', action='store_true', help='não executa a carga inicial/backfills')
+    parser.add_argument('--status', action='store_true', help='mostra os marcadores gravados e os esperados')
+    args = parser.parse_args(argv)
+
+    engine = models.engine
+    if args.status:
+        marcadores = ler_marcadores(engine)
+        esperado = impressao_schema()
+        logger.info('schema: gravado=%s esperado=%s (%s)', marcadores.get(SCHEMA), esperado,
+                    'ok' if marcadores.get(SCHEMA) == esperado else 'pendente')
+        logger.info('carga: gravada=%s esperada=%s', marcadores.get(CARGA), CARGA_VERSAO)
+        return
+
+    preparar_schema(engine)
+    novos = {SCHEMA: impressao_schema()}
+    if not args.sem_carga:
+        populou = carga_inicial()
+        logger.info('Carga inicial %s', 'executada' if populou else 'já presente (backfills aplicados)')
+        novos[CARGA] = CARGA_VERSAO
+    gravar_marcadores(engine, novos)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Contagem de consultas SQL por requisição e registro de consultas lentas.
+
+Com a instrumentação ligada (`SQL_INSTRUMENTACAO=1` ou `PUT /instrumentacao/sql`):
+
+- eventos `before/after_cursor_execute` do engine contam as consultas e somam o tempo
+  de banco da requisição corrente (ContextVar aberto pelo middleware, que acompanha o
+  request até o threadpool dos endpoints síncronos);
+- a resposta leva `Server-Timing: db;dur=..;desc="N consultas", app;dur=..` (visível
+  no DevTools do navegador);
+- requisições acima de `SQL_LIMITE_CONSULTAS` consultas ou `SQL_LIMITE_REQUISICAO_MS`
+  viram um log WARNING com os campos no `extra` (rota, consultas, tempo de banco, tempo
+  total) e entram na lista das últimas sinalizadas;
+- comandos acima de `SQL_LENTA_MS` são agrupados pelo SQL normalizado (literais e
+  listas IN trocados por `?`). O plano (`EXPLAIN`) é obtido sob demanda em
+  `GET /instrumentacao/sql/lentas?planos=true`, numa conexão separada, fora do request.
+
+Desligada, os listeners são removidos do engine e o middleware ASGI (`MedirRequisicao`)
+só testa um booleano antes de chamar a app.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+
+from backend.database import engine
+from backend.logging_config import logger
+
+SQL_INSTRUMENTACAO = os.environ.get('SQL_INSTRUMENTACAO', '0').lower() in ('1', 'true', 'yes')
+SQL_LIMITE_CONSULTAS = int(os.environ.get('SQL_LIMITE_CONSULTAS', '20'))
+SQL_LIMITE_REQUISICAO_MS = float(os.environ.get('SQL_LIMITE_REQUISICAO_MS', '500'))
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', '100'))
+SQL_LENTAS_MAX = int(os.environ.get('SQL_LENTAS_MAX', '200'))
+SQL_SINALIZADAS_MAX = int(os.environ.get('SQL_SINALIZADAS_MAX', '100'))
+
+_IGNORAR = 'instrumentacao_ignorar'
+
+
+@dataclass
+class Requisicao:
+    consultas: int = 0
+    db_ms: float = 0.0
+    rota: str = ''
+
+
+@dataclass
+class ConsultaLenta:
+    sql: str
+    ocorrencias: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    ultima_em: Optional[str] = None
+    rota: str = ''
+    # exemplo real (comando + parâmetros) usado só para o EXPLAIN; não sai na API
+    _comando: str = field(default='', repr=False)
+    _parametros: Any = field(default=None, repr=False)
+    plano: Optional[str] = None
+
+    def publico(self) -> Dict[str, Any]:
+        return {
+            'sql': self.sql, 'ocorrencias': self.ocorrencias, 'total_ms': round(self.total_ms, 1),
+            'media_ms': round(self.total_ms / self.ocorrencias, 1) if self.ocorrencias else None,
+            'max_ms': round(self.max_ms, 1), 'ultima_em': self.ultima_em, 'rota': self.rota, 'plano': self.plano,
+        }
+
+
+_atual: ContextVar[Optional[Requisicao]] = ContextVar('instrumentacao_requisicao', default=None)
+
+_RE_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_RE_PARAMETRO = re.compile(r'%\(\w+\)s|:\w+|\$\d+|%s')
+_RE_LISTA = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_RE_ESPACOS = re.compile(r'\s+')
+
+
+def normalizar(sql: str) -> str:
+    """SQL sem literais: `WHERE id IN (1, 2, 3) AND nome = 'x'` -> `WHERE id IN (...) AND nome = ?`."""
+    s = _RE_TEXTO.sub('?', sql)
+    s = _RE_PARAMETRO.sub('?', s)
+    s = _RE_NUMERO.sub('?', s)
+    s = _RE_LISTA.sub('(...)', s)
+    return _RE_ESPACOS.sub(' ', s).strip()
+
+
+class Instrumentacao:
+    def __init__(self):
+        self.ativo = False
+        self.limite_consultas = SQL_LIMITE_CONSULTAS
+        self.limite_ms = SQL_LIMITE_REQUISICAO_MS
+        self.lenta_ms = SQL_LENTA_MS
+        self._lock = threading.Lock()
+        self._lentas: 'OrderedDict[str, ConsultaLenta]' = OrderedDict()
+        self.sinalizadas: deque = deque(maxlen=SQL_SINALIZADAS_MAX)
+        self.requisicoes = 0
+        self.consultas = 0
+
+    # ----- liga/desliga -----
+    def ligar(self) -> None:
+        with self._lock:
+            if self.ativo:
+                return
+            event.listen(engine, 'before_cursor_execute', self._antes)
+            event.listen(engine, 'after_cursor_execute', self._depois)
+            event.listen(engine, 'handle_error', self._erro)
+            self.ativo = True
+        logger.info('Instrumentação SQL ligada')
+
+    def desligar(self) -> None:
+        with self._lock:
+            if not self.ativo:
+                return
+            self.ativo = False
+            event.remove(engine, 'before_cursor_execute', self._antes)
+            event.remove(engine, 'after_cursor_execute', self._depois)
+            event.remove(engine, 'handle_error', self._erro)
+        logger.info('Instrumentação SQL desligada')
+
+    def configurar(self, ativo: Optional[bool] = None, limite_consultas: Optional[int] = None,
+                   limite_ms: Optional[float] = None, lenta_ms: Optional[float] = None) -> Dict[str, Any]:
+        if limite_consultas is not None:
+            self.limite_consultas = int(limite_consultas)
+        if limite_ms is not None:
+            self.limite_ms = float(limite_ms)
+        if lenta_ms is not None:
+            self.lenta_ms = float(lenta_ms)
+        if ativo is True:
+            self.ligar()
+        elif ativo is False:
+            self.desligar()
+        return self.estado()
+
+    # ----- eventos do engine -----
+    def _antes(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault('instrumentacao_inicio', []).append(time.perf_counter())
+
+    def _depois(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        inicios = conn.info.get('instrumentacao_inicio')
+        if not inicios:
+            return
+        ms = (time.perf_counter() - inicios.pop()) * 1000
+        if conn.info.get(_IGNORAR):
+            return
+        req = _atual.get()
+        if req is not None:
+            req.consultas += 1
+            req.db_ms += ms
+        if ms >= self.lenta_ms:
+            self._registrar_lenta(statement, None if executemany else parameters, ms, req.rota if req else '')
+
+    def _erro(self, contexto_excecao) -> None:
+        conn = contexto_excecao.connection
+        if conn is not None and conn.info.get('instrumentacao_inicio'):
+            conn.info['instrumentacao_inicio'].pop()
+
+    # ----- consultas lentas -----
+    def _registrar_lenta(self, comando: str, parametros: Any, ms: float, rota: str) -> None:
+        sql = normalizar(comando)
+        with self._lock:
+            lenta = self._lentas.get(sql)
+            if lenta is None:
+                lenta = self._lentas[sql] = ConsultaLenta(sql=sql)
+                while len(self._lentas) > SQL_LENTAS_MAX:
+                    self._lentas.popitem(last=False)
+            self._lentas.move_to_end(sql)
+            lenta.ocorrencias += 1
+            lenta.total_ms += ms
+            lenta.ultima_em = datetime.now(timezone.utc).isoformat(timespec='seconds')
+            lenta.rota = rota or lenta.rota
+            if ms >= lenta.max_ms:
+                lenta.max_ms = ms
+                lenta._comando, lenta._parametros = comando, parametros
+        logger.warning('SQL lenta (%.1f ms) em %s: %s', ms, rota or '-', sql[:300],
+                       extra={'sql_ms': round(ms, 1), 'rota': rota, 'sql': sql})
+
+    def _plano(self, lenta: ConsultaLenta) -> Optional[str]:
+        if not lenta._comando:
+            return None
+        prefixo = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            with engine.connect() as conn:
+                conn.info[_IGNORAR] = True
+                try:
+                    linhas = conn.exec_driver_sql(prefixo + lenta._comando, lenta._parametros or ()).all()
+                finally:
+                    conn.info.pop(_IGNORAR, None)
+                    conn.rollback()
+        except Exception as e:
+            return f'indisponível: {e}'
+        return ' | '.join(str(linha[-1]) for linha in linhas)
+
+    def lentas(self, planos: bool = False, limite: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            ordenadas = sorted(self._lentas.values(), key=lambda l: l.total_ms, reverse=True)[:limite]
+        if planos:
+            for lenta in ordenadas:
+                if lenta.plano is None:
+                    lenta.plano = self._plano(lenta)
+        return [l.publico() for l in ordenadas]
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._lentas.clear()
+            self.sinalizadas.clear()
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            'ativo': self.ativo,
+            'limite_consultas': self.limite_consultas,
+            'limite_ms': self.limite_ms,
+            'lenta_ms': self.lenta_ms,
+            'requisicoes': self.requisicoes,
+            'consultas': self.consultas,
+            'consultas_lentas': len(self._lentas),
+            'sinalizadas': list(self.sinalizadas),
+        }
+
+    # ----- por requisição -----
+    def concluir(self, req: Requisicao, metodo: str, status: int, total_ms: float) -> None:
+        self.requisicoes += 1
+        self.consultas += req.consultas
+        if req.consultas <= self.limite_consultas and total_ms <= self.limite_ms:
+            return
+        campos = {
+            'rota': req.rota, 'metodo': metodo, 'status': status, 'sql_consultas': req.consultas,
+            'sql_ms': round(req.db_ms, 1), 'duracao_ms': round(total_ms, 1),
+        }
+        self.sinalizadas.append({**campos, 'em': datetime.now(timezone.utc).isoformat(timespec='seconds')})
+        logger.warning('Requisição acima do limite: %s %s -> %s consultas, %.1f ms de banco, %.1f ms no total',
+                       metodo, req.rota, req.consultas, req.db_ms, total_ms, extra=campos)
+
+
+instrumentacao = Instrumentacao()
+
+
+def _rota(scope) -> str:
+    # modelo da rota ('/mesas/{mesa_id}') quando já resolvida; senão o caminho
+    return getattr(scope.get('route'), 'path', None) or scope['path']
+
+
+class MedirRequisicao:
+    """Middleware ASGI. Desligada a instrumentação, repassa direto (só testa `ativo`)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not instrumentacao.ativo:
+            await self.app(scope, receive, send)
+            return
+        req = Requisicao(rota=scope['path'])
+        inicio = time.perf_counter()
+        # tempo até o início da resposta (no SSE, até o início do stream)
+        medido = {'status': 500, 'total_ms': None}
+
+        async def enviar(mensagem):
+            if mensagem['type'] == 'http.response.start':
+                total_ms = (time.perf_counter() - inicio) * 1000
+                medido.update(status=mensagem['status'], total_ms=total_ms)
+                valor = f'db;dur={req.db_ms:.1f};desc="{req.consultas} consultas", app;dur={total_ms:.1f}'
+                mensagem['headers'] = list(mensagem.get('headers') or []) + [(b'server-timing', valor.encode())]
+            await send(mensagem)
+
+        token = _atual.set(req)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _atual.reset(token)
+            req.rota = _rota(scope)
+            total_ms = medido['total_ms']
+            if total_ms is None:
+                total_ms = (time.perf_counter() - inicio) * 1000
+            instrumentacao.concluir(req, scope['method'], medido['status'], total_ms)
+
+
+if SQL_INSTRUMENTACAO:
+    instrumentacao.ligar()
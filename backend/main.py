@@ -1,15 +1,16 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import EmailStr
+from sqlalchemy import update
 from sqlalchemy.orm import Session
+from decimal import Decimal
 import datetime
 import os
-import jwt
 
-from . import models, crud, schemas
-from .database import engine, get_db
+from . import models, crud, schemas, eventos, cache_catalogo, senhas, auth, checkout, tarefas, snapshots_estoque, reservas, busca, facetas, carrinho_sessao, sincronizacao, idempotencia, inicializacao, instrumentacao
+from .database import engine, get_db, estatisticas_pool
 
 app = FastAPI(title='Choperia Backend API (refatorado)')
 from backend.logging_config import logger
@@ -25,6 +26,10 @@ allow_origins = [
 # Regex para permitir subdomínios do render (ex: frontend com sufixos dinâmicos)
 allow_origin_regex = r"https?://.*\.onrender\.com"
 
+# Idempotency-Key (ver backend/idempotencia.py). Registrado antes do CORS para ficar
+# dentro dele: respostas reenviadas também recebem os cabeçalhos de CORS.
+app.add_middleware(idempotencia.Idempotencia)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
@@ -32,8 +37,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Link", "Idempotent-Replayed", "Server-Timing"],
 )
 
+# Contagem de consultas SQL / Server-Timing (ver backend/instrumentacao.py). Registrado
+# por último para ficar por fora de todos e medir a requisição inteira.
+app.add_middleware(instrumentacao.MedirRequisicao)
+
 
 # Garantir criação das tabelas dos modelos registrados quando a app iniciar.
 """
@@ -51,21 +61,106 @@ def startup_event():
     except Exception as e:
         logger.warning(f"Aviso: falha ao importar backend.models no startup: {e}")
 
-    # Agora criar todas as tabelas registradas na metadata compartilhada
-    try:
-        # Usar o engine já importado no módulo para garantir criação de tabelas.
-        models.Base.metadata.create_all(bind=engine)
-        logger.info("Tabelas do banco verificadas/criadas (startup)")
-    except Exception as e:
-        logger.exception(f"Erro ao criar/verificar tabelas no startup: {e}")
+    # bcrypt em processos separados (ver backend/senhas.py)
+    senhas.pool.iniciar()
 
-    # Popular o banco automaticamente (idempotente)
+    # Tabelas, migrações e carga inicial. Com os marcadores de `banco_versao` em dia
+    # (partida quente) é só uma consulta; ver backend/inicializacao.py
     try:
-        from backend.populate_db_sqlalchemy import main as populate_main
-        populate_main()
-        logger.info("Banco populado automaticamente (startup)")
+        inicializacao.preparar(engine)
     except Exception as e:
-        logger.exception(f"Erro ao popular o banco no startup: {e}")
+        logger.exception(f"Erro ao preparar o banco no startup: {e}")
+
+    # Relay de eventos entre workers (apenas se EVENTOS_RELAY_DB estiver configurado)
+    eventos.barramento.iniciar()
+
+    # Tarefas periódicas (ver backend/tarefas.py)
+    tarefas.agendador.registrar(
+        'snapshots_estoque', snapshots_estoque.SNAPSHOT_ESTOQUE_INTERVALO_SEGUNDOS, snapshots_estoque.tarefa_agregar
+    )
+    tarefas.agendador.registrar('reservas_expirar', reservas.RESERVAS_VARREDURA_SEGUNDOS, reservas.tarefa_expirar)
+    tarefas.agendador.registrar('carrinhos_purgar', carrinho_sessao.CARRINHOS_LIMPEZA_SEGUNDOS, carrinho_sessao.tarefa_purgar)
+    tarefas.agendador.registrar('sync_purgar', sincronizacao.SYNC_LIMPEZA_SEGUNDOS, sincronizacao.tarefa_purgar)
+    tarefas.agendador.registrar('idempotencia_purgar', idempotencia.IDEMPOTENCIA_LIMPEZA_SEGUNDOS, idempotencia.tarefa_purgar)
+    tarefas.agendador.iniciar()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    tarefas.agendador.parar()
+    eventos.barramento.parar()
+    senhas.pool.encerrar()
+
+
+# ----- Serialização compartilhada -----
+def _serializar_itens(itens) -> List[dict]:
+    """Converte itens de pedido/carrinho no formato simples usado pelo frontend."""
+    return [
+        {
+            'id': it.id,
+            'produto_id': it.produto_id,
+            'nome': it.nome,
+            'quantidade': it.quantidade,
+            'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
+            'subtotal': float(it.subtotal) if it.subtotal is not None else None,
+        }
+        for it in itens
+    ]
+
+
+def _serializar_mesa(m: models.Mesa, pedido: Optional[models.Pedido] = None) -> dict:
+    """Mesa no formato de `schemas.MesaOut`, com o pedido Pendente e seus itens."""
+    return {
+        'id': m.id,
+        'nome': m.nome,
+        'slug': m.slug,
+        'status': m.status,
+        'pedido': pedido.id if pedido else 0,
+        'itens': _serializar_itens(pedido.itens) if pedido else [],
+        'statusPedido': pedido.status if pedido else None,
+        'capacidade': m.capacidade,
+        'usuario_responsavel_id': m.usuario_responsavel_id,
+        'observacoes': m.observacoes,
+    }
+
+
+def _serializar_carrinho(cart: models.Carrinho) -> dict:
+    return {'id': cart.id, 'itens': _serializar_itens(cart.itens), 'total': float(cart.total or 0)}
+
+
+# ----- Listagens: projeção (fields=) e paginação por cursor -----
+def _parse_campos(fields: Optional[str]) -> Optional[List[str]]:
+    if not fields:
+        return None
+    campos = [c.strip() for c in fields.split(',') if c.strip()]
+    return list(dict.fromkeys(['id', *campos])) if campos else None
+
+
+def _valor_json(v):
+    # Mesmo formato do response_model: Decimal como string, datas em ISO 8601
+    if isinstance(v, Decimal):
+        return str(v)
+    if isinstance(v, (datetime.datetime, datetime.date)):
+        return v.isoformat()
+    if hasattr(v, 'value'):
+        return v.value
+    return v
+
+
+def _projetar(obj, campos: List[str]) -> dict:
+    return {c: _valor_json(getattr(obj, c)) for c in campos}
+
+
+def _headers_paginacao(request: Request, proximo_cursor: Optional[str]) -> dict:
+    if not proximo_cursor:
+        return {}
+    url = request.url.remove_query_params('skip').include_query_params(cursor=proximo_cursor)
+    return {'X-Next-Cursor': proximo_cursor, 'Link': f'<{url}>; rel="next"'}
+
+
+@app.exception_handler(senhas.SobrecargaSenhas)
+def _senhas_sobrecarga(request: Request, exc: senhas.SobrecargaSenhas):
+    return JSONResponse(status_code=503, content={'detail': str(exc)}, headers={'Retry-After': '1'})
 
 
 @app.get('/ping')
@@ -109,25 +204,44 @@ def api_delete_user(username: str, db: Session = Depends(get_db)):
 
 # ----- Auth (simplified) -----
 @app.post('/auth/login')
-def api_login(payload: dict, db: Session = Depends(get_db)):
+def api_login(payload: dict, request: Request, db: Session = Depends(get_db)):
     email = payload.get('email')
     password = payload.get('password')
     if not email or not password:
         raise HTTPException(status_code=400, detail='email e password são obrigatórios')
     user = crud.get_user_by_email(db, email)
-    if not user or not user.check_password(password):
+    if not user:
         raise HTTPException(status_code=401, detail='Credenciais inválidas')
-    secret = os.environ.get('JWT_SECRET', 'devsecret')
-    exp_minutes = int(os.environ.get('JWT_EXP_MINUTES', '1440'))
-    payload_jwt = {'sub': str(user.id), 'email': user.email, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=exp_minutes)}
-    token = jwt.encode(payload_jwt, secret, algorithm='HS256')
-    resp = JSONResponse(content={'id': user.id, 'username': user.username, 'email': user.email, 'nome': user.nome, 'tipo': user.tipo.value if hasattr(user.tipo, 'value') else str(user.tipo)})
-    resp.set_cookie(key='access_token', value=token, httponly=True, samesite='lax', max_age=exp_minutes * 60)
+    usuario = auth.UsuarioAutenticado.de_modelo(user)
+    hash_armazenado = user.password
+    # Devolver a conexão ao pool antes do bcrypt: a verificação pode esperar o pool de
+    # senhas por até SENHAS_TIMEOUT_SEGUNDOS e não deve segurar conexão nem transação.
+    db.rollback()
+    if not senhas.verificar(password, hash_armazenado):
+        raise HTTPException(status_code=401, detail='Credenciais inválidas')
+    if senhas.precisa_rehash(hash_armazenado):
+        # Custo do hash diferente de BCRYPT_ROUNDS: refazer com a senha que acabou de ser
+        # validada. O hash novo é gerado fora da transação, que só faz o UPDATE.
+        try:
+            novo_hash = senhas.gerar_hash(password)
+            db.execute(
+                update(models.User)
+                .where(models.User.id == usuario.id, models.User.password == hash_armazenado)
+                .values(password=novo_hash)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except senhas.SobrecargaSenhas:
+            db.rollback()
+    token = auth.emitir_token(usuario)
+    resp = JSONResponse(content=usuario.publico())
+    resp.set_cookie(key='access_token', value=token, httponly=True, samesite='lax', max_age=auth.JWT_EXP_MINUTES * 60)
+    _mesclar_carrinho_sessao(request, resp, db, usuario.id)
     return resp
 
 
 @app.post('/auth/register')
-def api_register(payload: dict, db: Session = Depends(get_db)):
+def api_register(payload: dict, request: Request, db: Session = Depends(get_db)):
     nome = payload.get('nome')
     email = payload.get('email')
     password = payload.get('password')
@@ -141,99 +255,33 @@ def api_register(payload: dict, db: Session = Depends(get_db)):
     user_in = schemas.UserCreate(username=username, email=email, nome=nome, password=password, tipo=tipo)
     u = crud.create_user(db, user_in)
     # gerar token
-    secret = os.environ.get('JWT_SECRET', 'devsecret')
-    exp_minutes = int(os.environ.get('JWT_EXP_MINUTES', '1440'))
-    payload_jwt = {'sub': str(u.id), 'email': u.email, 'exp': datetime.datetime.utcnow() + datetime.timedelta(minutes=exp_minutes)}
-    token = jwt.encode(payload_jwt, secret, algorithm='HS256')
-    resp = JSONResponse(content={'id': u.id, 'username': u.username, 'email': u.email, 'nome': u.nome, 'tipo': u.tipo.value if hasattr(u.tipo, 'value') else str(u.tipo)})
-    resp.set_cookie(key='access_token', value=token, httponly=True, samesite='lax', max_age=exp_minutes * 60)
+    token = auth.emitir_token(u)
+    resp = JSONResponse(content=auth.UsuarioAutenticado.de_modelo(u).publico())
+    resp.set_cookie(key='access_token', value=token, httponly=True, samesite='lax', max_age=auth.JWT_EXP_MINUTES * 60)
+    _mesclar_carrinho_sessao(request, resp, db, u.id)
     return resp
 
 
 # Endpoint para retornar informações do usuário autenticado
 @app.get('/auth/me')
-def api_me(request: Request, db: Session = Depends(get_db)):
+def api_me(usuario: auth.UsuarioAutenticado = Depends(auth.usuario_atual)):
     """Retorna os dados do usuário autenticado.
 
-    Busca o token JWT no cookie 'access_token' ou no header Authorization Bearer.
-    Se válido, decodifica e busca o usuário no banco retornando os campos básicos.
+    Busca o token JWT no cookie 'access_token' ou no header Authorization Bearer
+    (ver `backend.auth`); 401 sem token válido, 404 se o usuário não existe.
     """
-    # tentar cookie primeiro
-    token = request.cookies.get('access_token')
-    # se não houver cookie, tentar header Authorization: Bearer <token>
-    if not token:
-        auth = request.headers.get('Authorization') or ''
-        if auth.lower().startswith('bearer '):
-            token = auth.split(' ', 1)[1]
-
-    if not token:
-        # Sem token -> não autenticado
-        raise HTTPException(status_code=401, detail='Token ausente')
-
-    secret = os.environ.get('JWT_SECRET', 'devsecret')
-    try:
-        payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail='Token expirado')
-    except Exception:
-        raise HTTPException(status_code=401, detail='Token inválido')
-
-    user_id = payload_jwt.get('sub')
-    if not user_id:
-        raise HTTPException(status_code=401, detail='Payload inválido')
-
-    # buscar usuário no banco
-    try:
-        u = db.query(models.User).get(int(user_id))
-    except Exception:
-        u = None
-
-    if not u:
-        raise HTTPException(status_code=404, detail='Usuário não encontrado')
-
-    return {
-        'id': u.id,
-        'username': u.username,
-        'email': u.email,
-        'nome': u.nome,
-        'tipo': u.tipo.value if hasattr(u.tipo, 'value') else str(u.tipo),
-    }
+    return usuario.publico()
 
 
 @app.get('/auth')
-def api_auth_root(request: Request, db: Session = Depends(get_db)):
+def api_auth_root(usuario: Optional[auth.UsuarioAutenticado] = Depends(auth.usuario_opcional)):
     """Rota compatível com GET /auth usada por alguns frontends.
 
     Se houver token válido retorna os dados do usuário (mesmo comportamento de /auth/me).
     Caso contrário retorna um objeto com informação básica e endpoints disponíveis.
     """
-    token = request.cookies.get('access_token')
-    if not token:
-        auth = request.headers.get('Authorization') or ''
-        if auth.lower().startswith('bearer '):
-            token = auth.split(' ', 1)[1]
-
-    if token:
-        secret = os.environ.get('JWT_SECRET', 'devsecret')
-        try:
-            payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-            user_id = payload_jwt.get('sub')
-            u = None
-            try:
-                u = db.query(models.User).get(int(user_id))
-            except Exception:
-                u = None
-            if u:
-                return {
-                    'id': u.id,
-                    'username': u.username,
-                    'email': u.email,
-                    'nome': u.nome,
-                    'tipo': u.tipo.value if hasattr(u.tipo, 'value') else str(u.tipo),
-                }
-        except Exception:
-            # token inválido/expirado -> continuará para retornar a lista de endpoints
-            pass
+    if usuario:
+        return usuario.publico()
 
     # sem token válido: retornar meta informação para o frontend
     return {
@@ -292,9 +340,171 @@ def api_create_produto(payload: schemas.ProdutoCreate, db: Session = Depends(get
 
 
 @app.get('/produtos/', response_model=List[schemas.ProdutoOut])
-def api_list_produtos(limit: int = 100, db: Session = Depends(get_db)):
-    # usar a função existente em crud
-    return crud.get_produtos(db, limit=limit)
+def api_list_produtos(
+    request: Request,
+    limit: int = 100,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    disponivel: Optional[bool] = None,
+    fields: Optional[str] = None,
+    ordenar: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Lista produtos (cacheada por versão do catálogo, com ETag / 304).
+
+    Paginação: `cursor` (keyset; o próximo vem no header `X-Next-Cursor`)
+    ou `skip`. `fields=id,nome,venda` retorna apenas as colunas pedidas.
+    `ordenar=rating` ordena pela média das avaliações (maior primeiro).
+    """
+    campos = _parse_campos(fields)
+
+    def gerar():
+        produtos = crud.get_produtos(db, skip, limit, cursor, categoria_id, empresa_id, disponivel, campos, ordenar)
+        if campos:
+            dados = [_projetar(p, campos) for p in produtos]
+        else:
+            dados = [schemas.ProdutoOut.model_validate(p, from_attributes=True).model_dump(mode='json') for p in produtos]
+        proximo = crud.cursor_produto(produtos[-1], ordenar) if produtos and len(produtos) == limit else None
+        return dados, _headers_paginacao(request, proximo)
+
+    chave = ('produtos', limit, skip, cursor, categoria_id, empresa_id, disponivel, tuple(campos or ()), ordenar)
+    try:
+        return cache_catalogo.resposta(request, db, chave, gerar)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/produtos/search', response_model=List[schemas.ProdutoOut])
+def api_search_produtos(
+    request: Request,
+    q: str = '',
+    limit: int = 20,
+    skip: int = 0,
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    disponivel: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    """Busca produtos por nome, descrição, estilo, categoria e empresa (ver backend/busca.py).
+
+    Cada termo é buscado como prefixo e sem acentos; resultados em ordem de
+    relevância (campo `relevancia`). Cacheada por versão do catálogo, como a listagem.
+    """
+    limit = max(1, min(limit, 100))
+    termos = busca.termos(q)
+
+    def gerar():
+        encontrados = busca.buscar(db, q, limit, skip, categoria_id, empresa_id, disponivel)
+        produtos = {p.id: p for p in db.query(models.Produto).filter(models.Produto.id.in_([pid for pid, _ in encontrados]))}
+        return [
+            {**schemas.ProdutoOut.model_validate(produtos[pid], from_attributes=True).model_dump(mode='json'), 'relevancia': relevancia}
+            for pid, relevancia in encontrados
+            if pid in produtos
+        ]
+
+    chave = ('busca', tuple(termos), limit, skip, categoria_id, empresa_id, disponivel)
+    return cache_catalogo.resposta(request, db, chave, gerar)
+
+
+@app.get('/produtos/facetas')
+def api_facetas_produtos(
+    request: Request,
+    q: str = '',
+    categoria_id: Optional[int] = None,
+    empresa_id: Optional[int] = None,
+    style: Optional[str] = None,
+    disponivel: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    """Contagens por categoria, empresa, estilo e faixas de ABV/IBU (ver backend/facetas.py).
+
+    Restritas pelos filtros e pela busca `q` atuais; cacheadas por versão do catálogo.
+    """
+    def gerar():
+        return facetas.calcular(db, q, categoria_id, empresa_id, style, disponivel)
+
+    chave = ('facetas', tuple(busca.termos(q)), categoria_id, empresa_id, style or None, disponivel)
+    return cache_catalogo.resposta(request, db, chave, gerar)
+
+
+@app.get('/cache/catalogo')
+def api_cache_catalogo_stats(db: Session = Depends(get_db)):
+    return {'versao': cache_catalogo.versao_atual(db), **cache_catalogo.cache.estatisticas()}
+
+
+@app.get('/cache/idempotencia')
+def api_cache_idempotencia_stats():
+    """Cache em memória das respostas de Idempotency-Key (ver backend/idempotencia.py)."""
+    return idempotencia.cache.estatisticas()
+
+
+@app.get('/db/pool')
+def api_db_pool_stats():
+    """Uso do pool de conexões do banco (em uso, pico, overflow)."""
+    return estatisticas_pool()
+
+
+@app.get('/instrumentacao/sql')
+def api_instrumentacao_sql():
+    """Estado da instrumentação SQL e as últimas requisições acima dos limites."""
+    return instrumentacao.instrumentacao.estado()
+
+
+def _exigir_superusuario(usuario: auth.UsuarioAutenticado) -> None:
+    if not usuario.is_superuser:
+        raise HTTPException(status_code=403, detail='Apenas administradores')
+
+
+@app.put('/instrumentacao/sql')
+def api_configurar_instrumentacao_sql(payload: dict, usuario: auth.UsuarioAutenticado = Depends(auth.usuario_atual)):
+    """Liga/desliga em tempo de execução (só administradores).
+
+    Payload: { ativo, limite_consultas, limite_ms, lenta_ms } (todos opcionais).
+    """
+    _exigir_superusuario(usuario)
+    try:
+        ativo = payload.get('ativo')
+        return instrumentacao.instrumentacao.configurar(
+            ativo=None if ativo is None else bool(ativo),
+            limite_consultas=payload.get('limite_consultas'),
+            limite_ms=payload.get('limite_ms'),
+            lenta_ms=payload.get('lenta_ms'),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/instrumentacao/sql/lentas')
+def api_consultas_lentas(
+    planos: bool = False, limit: int = 50, usuario: auth.UsuarioAutenticado = Depends(auth.usuario_atual),
+):
+    """Consultas lentas agrupadas pelo SQL normalizado (maior tempo total primeiro); `planos=true` inclui o EXPLAIN.
+
+    Só administradores: o SQL traz nomes de tabelas/colunas e o EXPLAIN roda no banco.
+    """
+    _exigir_superusuario(usuario)
+    return instrumentacao.instrumentacao.lentas(planos=planos, limite=max(1, min(limit, 200)))
+
+
+@app.delete('/instrumentacao/sql/lentas')
+def api_limpar_consultas_lentas(usuario: auth.UsuarioAutenticado = Depends(auth.usuario_atual)):
+    _exigir_superusuario(usuario)
+    instrumentacao.instrumentacao.limpar()
+    return {'ok': True}
+
+
+@app.get('/auth/senhas/stats')
+def api_senhas_stats():
+    """Uso do pool de hash de senhas (executadas, recusadas por sobrecarga)."""
+    return senhas.pool.estatisticas()
+
+
+@app.get('/auth/cache/stats')
+def api_auth_cache_stats():
+    """Hits/misses dos caches de tokens e usuários autenticados."""
+    return auth.estatisticas()
 
 
 # ----- Mesas / Pedidos -----
@@ -309,6 +519,12 @@ def api_list_mesas(db: Session = Depends(get_db)):
     return crud.get_mesas(db)
 
 
+# Visão do salão: todas as mesas com pedido pendente e itens em uma única chamada
+@app.get('/mesas/snapshot', response_model=List[schemas.MesaOut])
+def api_mesas_snapshot(db: Session = Depends(get_db)):
+    return [_serializar_mesa(m, pedido) for m, pedido in crud.get_mesas_snapshot(db)]
+
+
 # Recuperar mesa por ID (inclui pedido pendente e itens)
 @app.get('/mesas/{mesa_id}', response_model=schemas.MesaOut)
 def api_get_mesa(mesa_id: int, db: Session = Depends(get_db)):
@@ -317,34 +533,7 @@ def api_get_mesa(mesa_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail='Mesa não encontrada')
 
     pedido = crud.get_pedido_pendente_por_mesa(db, mesa_id)
-    itens = []
-    pedido_id = 0
-    statusPedido = None
-    if pedido:
-        pedido_id = pedido.id
-        statusPedido = pedido.status
-        for it in pedido.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-
-    return {
-        'id': m.id,
-        'nome': m.nome,
-        'slug': m.slug,
-        'status': m.status,
-        'pedido': pedido_id,
-        'itens': itens,
-        'statusPedido': statusPedido,
-        'capacidade': m.capacidade,
-        'usuario_responsavel_id': m.usuario_responsavel_id,
-        'observacoes': m.observacoes,
-    }
+    return _serializar_mesa(m, pedido)
 
 
 # Recuperar mesa por slug
@@ -355,34 +544,7 @@ def api_get_mesa_by_slug(slug: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail='Mesa não encontrada')
 
     pedido = crud.get_pedido_pendente_por_mesa(db, m.id)
-    itens = []
-    pedido_id = 0
-    statusPedido = None
-    if pedido:
-        pedido_id = pedido.id
-        statusPedido = pedido.status
-        for it in pedido.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-
-    return {
-        'id': m.id,
-        'nome': m.nome,
-        'slug': m.slug,
-        'status': m.status,
-        'pedido': pedido_id,
-        'itens': itens,
-        'statusPedido': statusPedido,
-        'capacidade': m.capacidade,
-        'usuario_responsavel_id': m.usuario_responsavel_id,
-        'observacoes': m.observacoes,
-    }
+    return _serializar_mesa(m, pedido)
 
 
 # Adicionar item à mesa via API (endpoint usado pelo frontend)
@@ -413,33 +575,18 @@ def api_add_item_to_mesa(mesa_id: int, payload: dict, db: Session = Depends(get_
         pedido = crud.add_item_to_pedido(db, mesa_id, produto_id, quantidade, usuario_id, preco_unitario, numero_sugerido)
 
         # construir resposta simplificada contendo pedido id e mesa atualizada
-        itens = []
-        for it in pedido.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-
         mesa = crud.get_mesa(db, mesa_id)
 
         return {
             'pedido': pedido.id,
-            'mesa': {
-                'id': mesa.id,
-                'nome': mesa.nome,
-                'slug': mesa.slug,
-                'status': mesa.status,
-                'pedido': pedido.id,
-                'itens': itens,
-            }
+            'mesa': _serializar_mesa(mesa, pedido),
         }
     except HTTPException:
         # re-raise HTTPExceptions (validation) unchanged
         raise
+    except reservas.EstoqueInsuficiente as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail={'erro': str(e), 'produto_id': e.produto_id, 'disponivel': e.disponivel})
     except Exception as e:
         # Log full exception for easier debugging on server
         logger.exception(f"[api_add_item_to_mesa] erro ao adicionar item na mesa {mesa_id}: {e}")
@@ -500,16 +647,163 @@ def api_create_movimentacao(payload: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post('/estoque/movimentacoes/lote')
+def api_create_movimentacoes_lote(payload: dict, db: Session = Depends(get_db)):
+    """Aplica várias movimentações de estoque numa única transação.
+
+    Payload: { movimentacoes: [{produto_id, quantidade, tipo, origem, observacoes}, ...],
+               usuario_id, tudo_ou_nada }
+    Retorna um resultado por linha (na ordem recebida).
+    """
+    try:
+        movimentacoes = payload.get('movimentacoes') or payload.get('itens') or []
+        if not isinstance(movimentacoes, list) or not movimentacoes:
+            raise HTTPException(status_code=400, detail='movimentacoes deve ser uma lista não vazia')
+        usuario_id = int(payload.get('usuario_id')) if payload.get('usuario_id') else 1
+        tudo_ou_nada = bool(payload.get('tudo_ou_nada', False))
+
+        resultados = crud.create_movimentacoes_estoque_lote(db, movimentacoes, usuario_id=usuario_id, tudo_ou_nada=tudo_ou_nada)
+        aplicadas = sum(1 for r in resultados if r['ok'])
+        return {'ok': aplicadas == len(resultados), 'aplicadas': aplicadas, 'falhas': len(resultados) - aplicadas, 'resultados': resultados}
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"Erro aplicando lote de movimentações: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_data(valor: str, campo: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f'{campo} inválido (use AAAA-MM-DD)')
+
+
+@app.get('/estoque/disponivel')
+def api_estoque_disponivel(produto_ids: Optional[str] = None, db: Session = Depends(get_db)):
+    """Disponível para venda (estoque - reservas ativas) por produto; `produto_ids=1,2,3` ou todos."""
+    if produto_ids:
+        try:
+            ids = [int(x) for x in produto_ids.split(',') if x.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail='produto_ids deve ser uma lista de inteiros separados por vírgula')
+    else:
+        ids = [pid for (pid,) in db.query(models.Produto.id)]
+    return {'disponivel': reservas.disponiveis(db, ids), 'cache': reservas.cache_disponivel.estatisticas()}
+
+
+@app.get('/estoque/produtos/{produto_id}/posicao')
+def api_estoque_posicao(produto_id: int, em: Optional[str] = None, db: Session = Depends(get_db)):
+    """Estoque do produto em um instante (`em`: AAAA-MM-DD = fechamento do dia, ou data/hora ISO; padrão agora)."""
+    try:
+        if not em:
+            instante = datetime.datetime.now(datetime.timezone.utc)
+        elif len(em) == 10:
+            instante = datetime.datetime.combine(_parse_data(em, 'em'), datetime.time.max)
+        else:
+            instante = datetime.datetime.fromisoformat(em.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='em inválido (use AAAA-MM-DD ou data/hora ISO)')
+    try:
+        return snapshots_estoque.estoque_em(db, produto_id, instante)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get('/estoque/resumo')
+def api_estoque_resumo(desde: str, ate: str, produto_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Entradas, saídas e estoques inicial/final por produto no período (dias UTC, inclusive)."""
+    inicio, fim = _parse_data(desde, 'desde'), _parse_data(ate, 'ate')
+    try:
+        produtos = snapshots_estoque.resumo_periodo(db, inicio, fim, produto_id=produto_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'desde': inicio, 'ate': fim, 'marca_agregada': snapshots_estoque.marca_atual(db), 'produtos': produtos}
+
+
+@app.post('/estoque/snapshots/agregar')
+def api_estoque_agregar(db: Session = Depends(get_db)):
+    """Incorpora agora as movimentações pendentes aos snapshots (normalmente feito pela tarefa periódica)."""
+    try:
+        agregadas = snapshots_estoque.agregar(db)
+    except Exception as e:
+        logger.exception(f"Erro agregando snapshots de estoque: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'agregadas': agregadas, 'marca_agregada': snapshots_estoque.marca_atual(db)}
+
+
+@app.get('/tarefas')
+def api_tarefas():
+    return tarefas.agendador.estatisticas()
+
+
 @app.get('/pedidos/', response_model=List[schemas.PedidoOut])
-def api_list_pedidos(limit: int = 100, tipo: Optional[str] = None, db: Session = Depends(get_db)):
-    """Lista pedidos; endpoint GET esperado pelo frontend."""
+def api_list_pedidos(
+    request: Request,
+    response: Response,
+    limit: int = 100,
+    skip: int = 0,
+    tipo: Optional[str] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    mesa_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    desde: Optional[datetime.datetime] = None,
+    ate: Optional[datetime.datetime] = None,
+    ordem: str = 'asc',
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Lista pedidos; endpoint GET esperado pelo frontend.
+
+    Filtros: tipo, status, mesa_id, user_id, desde/ate (created_at). Paginação
+    keyset com `cursor` (próximo no header `X-Next-Cursor`) e `ordem=asc|desc`.
+    `fields=id,numero,total` retorna apenas os campos pedidos (`itens` opcional).
+    """
     try:
-        return crud.get_pedidos(db, limit=limit, tipo=tipo)
+        campos = _parse_campos(fields)
+        pedidos = crud.get_pedidos(
+            db, skip=skip, limit=limit, tipo=tipo, cursor=cursor, status=status, mesa_id=mesa_id,
+            user_id=user_id, desde=desde, ate=ate, ordem=ordem, campos=campos
+        )
+        proximo = crud.cursor_pedido(pedidos[-1]) if pedidos and len(pedidos) == limit else None
+        headers = _headers_paginacao(request, proximo)
+        if campos:
+            dados = []
+            for p in pedidos:
+                d = _projetar(p, [c for c in campos if c != 'itens'])
+                if 'itens' in campos:
+                    d['itens'] = [schemas.PedidoItemOut.model_validate(it, from_attributes=True).model_dump(mode='json') for it in p.itens]
+                dados.append(d)
+            return JSONResponse(content=dados, headers=headers)
+        response.headers.update(headers)
+        return pedidos
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.exception(f"Erro ao listar pedidos: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.post('/pedidos/reconciliar-totais')
+def api_reconciliar_totais_pedidos(
+    corrigir: bool = False, status: Optional[str] = 'Pendente', db: Session = Depends(get_db),
+    usuario: auth.UsuarioAutenticado = Depends(auth.usuario_atual),
+):
+    """Compara subtotal/total dos pedidos com a soma dos itens (job de reconciliação).
+
+    Com `corrigir=true` grava os valores recalculados nos pedidos divergentes. Só administradores.
+    """
+    _exigir_superusuario(usuario)
+    try:
+        divergencias = crud.reconciliar_totais_pedidos(db, corrigir=corrigir, status=status or None)
+        return {'divergentes': len(divergencias), 'corrigidos': corrigir, 'pedidos': divergencias}
+    except Exception as e:
+        logger.exception(f"Erro ao reconciliar totais de pedidos: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post('/pedidos/', response_model=schemas.PedidoOut)
 def api_create_pedido(payload: dict, db: Session = Depends(get_db)):
     """Cria pedido aceitando o formato enviado pelo frontend.
@@ -518,27 +812,7 @@ def api_create_pedido(payload: dict, db: Session = Depends(get_db)):
     Aqui normalizamos para o schema esperado (produto_id, preco_unitario).
     """
     try:
-        itens_in = []
-        for it in payload.get('itens', []) or []:
-            produto_id = it.get('produto_id') if it.get('produto_id') is not None else it.get('id')
-            preco_unitario = it.get('preco_unitario') if it.get('preco_unitario') is not None else it.get('venda') if it.get('venda') is not None else it.get('preco')
-            itens_in.append({
-                'produto_id': produto_id,
-                'nome': it.get('nome') or '',
-                'quantidade': int(it.get('quantidade') or 0),
-                'preco_unitario': preco_unitario
-            })
-
-        pedido_in = schemas.PedidoCreate(
-            tipo=payload.get('tipo') or payload.get('metodoPagamento') or 'online',
-            user_id=payload.get('user_id') or payload.get('userId') or None,
-            numero=payload.get('numero') or payload.get('numeroPedido') or None,
-            metodo_pagamento=payload.get('metodoPagamento') or payload.get('metodo_pagamento'),
-            itens=[schemas.PedidoItemCreate(**it) for it in itens_in],
-            nome_cliente=payload.get('nome') or payload.get('nome_cliente'),
-            mesa_id=payload.get('mesa_id') if payload.get('mesa_id') else None,
-            observacoes=payload.get('observacoes') or ''
-        )
+        pedido_in = schemas.PedidoCreate.do_frontend(payload)
 
         usuario_id = payload.get('user_id') or payload.get('userId') or 1
         p = crud.create_pedido(db, pedido_in, usuario_id)
@@ -563,65 +837,19 @@ def api_add_item(pedido_id: int, payload: schemas.PedidoItemCreate, db: Session
 def api_processar_pagamento(mesa_id: int, payload: dict, db: Session = Depends(get_db)):
     """Processa o pagamento de um pedido Pendente associado à mesa.
 
+    Tudo numa única transação (ver `backend.checkout`):
     - Localiza o pedido pendente da mesa
-    - Aplica decremento de estoque (registrando movimentações) para cada item
+    - Aplica decremento de estoque (registrando movimentações) para todos os itens
     - Cria um registro de Pagamento
     - Marca o pedido como 'Entregue' e atualiza total
-    - Retorna a mesa atualizada (sem pedido pendente)
+    - Libera a mesa e retorna a mesa atualizada (sem pedido pendente)
     """
     try:
         metodo = payload.get('metodo') or payload.get('metodoPagamento') or payload.get('metodo_pagamento')
         total = payload.get('total')
         usuario_id = payload.get('usuario_id') if payload.get('usuario_id') is not None else 1
 
-        pedido = crud.get_pedido_pendente_por_mesa(db, mesa_id)
-        if not pedido:
-            raise HTTPException(status_code=404, detail='Pedido pendente não encontrado para a mesa')
-
-        # Aplicar decremento de estoque e registrar movimentações
-        for it in pedido.itens:
-            try:
-                # Usar a função de movimentação para garantir consistência
-                # Passar usuario_id como keyword para não confundir com o parâmetro 'observacoes'
-                crud.create_movimentacao_estoque(db, it.produto_id, int(it.quantidade or 0), 'saida', 'venda_fisica', usuario_id=usuario_id)
-            except Exception as e:
-                logger.exception(f"Falha ao criar movimentacao para produto {it.produto_id}: {e}")
-                # continuar com outros itens
-
-        # Criar registro de pagamento
-        try:
-            valor = float(total) if total is not None else float(pedido.total or 0)
-        except Exception:
-            valor = float(pedido.total or 0)
-
-        db_pag = crud.create_pagamento(db, pedido.id, valor, metodo or 'indefinido', status='Confirmado')
-
-        # Marcar pedido como entregue e atualizar total
-        try:
-            pedido.status = 'Entregue'
-            pedido.total = valor
-            db.add(pedido)
-            db.commit()
-            db.refresh(pedido)
-        except Exception:
-            db.rollback()
-            logger.exception('Erro ao atualizar pedido após pagamento')
-
-        # Atualizar mesa para status 'Livre' e limpar usuario_responsavel_id
-        mesa = crud.get_mesa(db, mesa_id)
-        if mesa:
-            try:
-                mesa.status = 'Livre'
-                mesa.usuario_responsavel_id = None
-                db.add(mesa)
-                db.commit()
-                db.refresh(mesa)
-                logger.info(f"Mesa {mesa_id} liberada após pagamento")
-            except Exception:
-                db.rollback()
-                logger.exception(f'Erro ao liberar mesa {mesa_id} após pagamento')
-                # Recarregar mesa após erro
-                mesa = crud.get_mesa(db, mesa_id)
+        db_pag, mesa, _ = checkout.fechar_mesa(db, mesa_id, metodo, total, usuario_id)
 
         return {
             'ok': True,
@@ -633,8 +861,10 @@ def api_processar_pagamento(mesa_id: int, payload: dict, db: Session = Depends(g
                 'status': mesa.status,
                 'pedido': 0,
                 'itens': []
-            }
+            } if mesa else None
         }
+    except checkout.PedidoNaoEncontrado as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -642,25 +872,39 @@ def api_processar_pagamento(mesa_id: int, payload: dict, db: Session = Depends(g
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ----- Eventos (server push para os tablets) -----
+@app.get('/eventos/stream')
+async def api_eventos_stream(request: Request, mesa_id: Optional[int] = None, ultimo_id: Optional[int] = None):
+    """Stream SSE de mudanças de mesas/pedidos.
+
+    Tipos: mesa.item_adicionado, mesa.item_removido, mesa.pedido_cancelado,
+    mesa.pagamento e resync (recarregar o estado completo). Reconexões enviam
+    o header `Last-Event-ID` (ou `?ultimo_id=`) para receber os eventos perdidos.
+    `?mesa_id=` limita o stream a uma mesa.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or ultimo_id
+    try:
+        desde = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        desde = 0
+    return StreamingResponse(
+        eventos.stream_sse(request, desde, mesa_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.get('/eventos/stats')
+def api_eventos_stats():
+    return eventos.barramento.estatisticas()
+
+
 # ----- Favoritos (loja online) -----
 @app.get('/favoritos/')
 def api_get_favoritos(request: Request, db: Session = Depends(get_db)):
     """Retorna todos os favoritos do usuário autenticado com dados completos do produto."""
     try:
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             user_id = 1
@@ -680,21 +924,7 @@ def api_create_favorito(payload: dict, request: Request, db: Session = Depends(g
     Se não houver token válido, tenta usar `user_id` do payload ou usa 1.
     """
     try:
-        # tentar extrair user do token (mesma lógica do api_me)
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             user_id = int(payload.get('user_id')) if payload.get('user_id') else 1
@@ -710,20 +940,7 @@ def api_create_favorito(payload: dict, request: Request, db: Session = Depends(g
 @app.delete('/favoritos/{produto_id}')
 def api_remove_favorito(produto_id: int, request: Request, db: Session = Depends(get_db)):
     try:
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             # permitir remoção via query/body fallback? usamos 1
@@ -745,20 +962,7 @@ def api_remove_favorito(produto_id: int, request: Request, db: Session = Depends
 def api_get_avaliacoes(request: Request, db: Session = Depends(get_db)):
     """Retorna todas as avaliações do usuário autenticado."""
     try:
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             user_id = 1
@@ -786,20 +990,7 @@ def api_create_or_update_avaliacao(payload: dict, request: Request, db: Session
     Payload: { produto_id, rating, comentario }
     """
     try:
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             user_id = int(payload.get('user_id')) if payload.get('user_id') else 1
@@ -808,17 +999,8 @@ def api_create_or_update_avaliacao(payload: dict, request: Request, db: Session
         rating = int(payload.get('rating'))
         comentario = payload.get('comentario')
 
-        # Checar se já existe -> atualizar
-        existing = db.query(models.Avaliacao).filter(models.Avaliacao.user_id == user_id, models.Avaliacao.produto_id == produto_id).first()
-        if existing:
-            existing.rating = rating
-            existing.comentario = comentario
-            db.add(existing)
-            db.commit()
-            db.refresh(existing)
-            return {'id': existing.id, 'user_id': existing.user_id, 'produto_id': existing.produto_id, 'rating': existing.rating}
-
-        aval = crud.create_avaliacao(db, user_id, produto_id, rating, comentario)
+        # Cria ou atualiza (e mantém os agregados de rating do produto)
+        aval = crud.salvar_avaliacao(db, user_id, produto_id, rating, comentario)
         return {'id': aval.id, 'user_id': aval.user_id, 'produto_id': aval.produto_id, 'rating': aval.rating}
     except Exception as e:
         logger.exception(f"Erro criando/atualizando avaliacao: {e}")
@@ -828,29 +1010,13 @@ def api_create_or_update_avaliacao(payload: dict, request: Request, db: Session
 @app.delete('/avaliacoes/{produto_id}')
 def api_remove_avaliacao(produto_id: int, request: Request, db: Session = Depends(get_db)):
     try:
-        token = request.cookies.get('access_token')
-        if not token:
-            auth = request.headers.get('Authorization') or ''
-            if auth.lower().startswith('bearer '):
-                token = auth.split(' ', 1)[1]
-
-        user_id = None
-        if token:
-            secret = os.environ.get('JWT_SECRET', 'devsecret')
-            try:
-                payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-                user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-            except Exception:
-                user_id = None
+        user_id = auth.usuario_id_opcional(request)
 
         if not user_id:
             user_id = 1
 
-        db_aval = db.query(models.Avaliacao).filter(models.Avaliacao.user_id == user_id, models.Avaliacao.produto_id == produto_id).first()
-        if not db_aval:
+        if not crud.delete_avaliacao(db, user_id, produto_id):
             raise HTTPException(status_code=404, detail='Avaliacao nao encontrada')
-        db.delete(db_aval)
-        db.commit()
         return {'ok': True}
     except HTTPException:
         raise
@@ -860,60 +1026,62 @@ def api_remove_avaliacao(produto_id: int, request: Request, db: Session = Depend
 
 
 # ----------------- Carrinho (loja online) -----------------
-def _extract_user_id_from_request(request: Request, payload: dict = None) -> int:
-    token = request.cookies.get('access_token')
-    if not token:
-        auth = request.headers.get('Authorization') or ''
-        if auth.lower().startswith('bearer '):
-            token = auth.split(' ', 1)[1]
-
-    user_id = None
-    if token:
-        secret = os.environ.get('JWT_SECRET', 'devsecret')
-        try:
-            payload_jwt = jwt.decode(token, secret, algorithms=['HS256'])
-            user_id = int(payload_jwt.get('sub')) if payload_jwt.get('sub') else None
-        except Exception:
-            user_id = None
+def _dono_carrinho(request: Request, response: Response = None):
+    """(user_id, session_id) do carrinho: usuário do token ou sessão anônima do cookie.
 
-    if not user_id and payload:
-        user_id = int(payload.get('user_id')) if payload.get('user_id') else None
-
-    if not user_id:
-        # fallback para ambiente de desenvolvimento
-        user_id = 1
-    return user_id
+    Nunca o `user_id` do payload: sem token, quem chama só alcança o carrinho da própria sessão.
+    Com `response`, cria a sessão anônima se preciso e (re)grava o cookie.
+    """
+    user_id = auth.usuario_id_opcional(request)
+    if user_id:
+        return user_id, None
+    session_id = carrinho_sessao.do_request(request)
+    if response is not None:
+        session_id = session_id or carrinho_sessao.novo_id()
+        carrinho_sessao.gravar_cookie(response, session_id)
+    return None, session_id
+
+
+def _carrinho_do_chamador(request: Request, db: Session):
+    """Carrinho do usuário do token ou da sessão anônima (None se não existe)."""
+    user_id, session_id = _dono_carrinho(request)
+    if user_id:
+        return crud.get_cart_by_user(db, user_id)
+    return crud.get_cart_by_session(db, session_id) if session_id else None
+
+
+def _mesclar_carrinho_sessao(request: Request, resp: Response, db: Session, user_id: int) -> None:
+    """Login/cadastro: leva o carrinho anônimo da sessão para o usuário e remove o cookie."""
+    session_id = carrinho_sessao.do_request(request)
+    if not session_id:
+        return
+    try:
+        carrinho_sessao.mesclar(db, session_id, user_id)
+    except Exception as e:
+        # não impedir o login; o carrinho anônimo continua disponível até expirar
+        logger.exception(f"Erro mesclando carrinho da sessão: {e}")
+        return
+    carrinho_sessao.apagar_cookie(resp)
 
 
 @app.get('/carrinho/')
 def api_get_carrinho(request: Request, db: Session = Depends(get_db)):
-    """Retorna o carrinho do usuário autenticado (ou usuário fallback)."""
+    """Retorna o carrinho do usuário autenticado ou da sessão anônima (cookie)."""
     try:
-        user_id = _extract_user_id_from_request(request)
-        cart = crud.get_cart_by_user(db, user_id)
+        cart = _carrinho_do_chamador(request, db)
         if not cart:
             return {'id': None, 'itens': [], 'total': 0}
-        itens = []
-        for it in cart.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-        return {'id': cart.id, 'itens': itens, 'total': float(cart.total or 0)}
+        return _serializar_carrinho(cart)
     except Exception as e:
         logger.exception(f"Erro ao obter carrinho: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post('/carrinho/items')
-def api_add_item_carrinho(payload: dict, request: Request, db: Session = Depends(get_db)):
-    """Adiciona item ao carrinho. Payload: { produto_id, quantidade, venda/precoUnitario, user_id (opcional) }"""
+def api_add_item_carrinho(payload: dict, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Adiciona item ao carrinho. Payload: { produto_id, quantidade, venda/precoUnitario }"""
     try:
-        user_id = _extract_user_id_from_request(request, payload)
+        user_id, session_id = _dono_carrinho(request, response)
         produto_id = int(payload.get('produto_id')) if payload.get('produto_id') is not None else None
         quantidade = int(payload.get('quantidade') or 1)
         preco = None
@@ -922,40 +1090,54 @@ def api_add_item_carrinho(payload: dict, request: Request, db: Session = Depends
         elif payload.get('precoUnitario') is not None:
             preco = float(payload.get('precoUnitario'))
 
-        cart = crud.add_item_to_cart(db, user_id=user_id, produto_id=produto_id, quantidade=quantidade, preco_unitario=preco)
+        cart = crud.add_item_to_cart(db, user_id=user_id, produto_id=produto_id, quantidade=quantidade, preco_unitario=preco, session_id=session_id)
         # montar resposta simples
-        itens = []
-        for it in cart.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-        return {'id': cart.id, 'itens': itens, 'total': float(cart.total or 0)}
+        return _serializar_carrinho(cart)
     except Exception as e:
         logger.exception(f"Erro adicionando item ao carrinho: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@app.put('/carrinho/')
+def api_set_carrinho(payload: dict, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Substitui o conteúdo do carrinho numa única transação (sincronização do modo offline).
+
+    Payload: { itens: [{ produto_id, quantidade, venda/precoUnitario (opcional) }] }
+    """
+    try:
+        user_id, session_id = _dono_carrinho(request, response)
+        itens = payload.get('itens')
+        if not isinstance(itens, list):
+            raise HTTPException(status_code=400, detail='itens deve ser uma lista')
+        itens = [
+            {
+                'produto_id': it.get('produto_id'),
+                'quantidade': it.get('quantidade'),
+                'preco_unitario': it.get('venda') if it.get('venda') is not None else it.get('precoUnitario'),
+            }
+            for it in itens
+        ]
+        cart = crud.set_cart_contents(db, itens, user_id=user_id, session_id=session_id)
+        return _serializar_carrinho(cart)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Erro substituindo carrinho: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.patch('/carrinho/items/{item_id}')
 def api_update_carrinho_item(item_id: int, payload: dict, request: Request, db: Session = Depends(get_db)):
     try:
         quantidade = int(payload.get('quantidade'))
-        cart = crud.update_cart_item_quantity(db, item_id, quantidade)
-        itens = []
-        for it in cart.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-        return {'id': cart.id, 'itens': itens, 'total': float(cart.total or 0)}
+        cart = _carrinho_do_chamador(request, db)
+        if cart:
+            cart = crud.update_cart_item_quantity(db, item_id, quantidade, carrinho_id=cart.id)
+        if not cart:
+            raise HTTPException(status_code=404, detail='Item não encontrado')
+        return _serializar_carrinho(cart)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception(f"Erro atualizando item do carrinho: {e}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -964,20 +1146,12 @@ def api_update_carrinho_item(item_id: int, payload: dict, request: Request, db:
 @app.delete('/carrinho/items/{item_id}')
 def api_remove_carrinho_item(item_id: int, request: Request, db: Session = Depends(get_db)):
     try:
-        cart = crud.remove_item_from_cart(db, item_id)
+        cart = _carrinho_do_chamador(request, db)
+        if cart:
+            cart = crud.remove_item_from_cart(db, item_id, carrinho_id=cart.id)
         if not cart:
             raise HTTPException(status_code=404, detail='Item não encontrado')
-        itens = []
-        for it in cart.itens:
-            itens.append({
-                'id': it.id,
-                'produto_id': it.produto_id,
-                'nome': it.nome,
-                'quantidade': it.quantidade,
-                'preco_unitario': float(it.preco_unitario) if it.preco_unitario is not None else None,
-                'subtotal': float(it.subtotal) if it.subtotal is not None else None,
-            })
-        return {'id': cart.id, 'itens': itens, 'total': float(cart.total or 0)}
+        return _serializar_carrinho(cart)
     except HTTPException:
         raise
     except Exception as e:
@@ -988,16 +1162,11 @@ def api_remove_carrinho_item(item_id: int, request: Request, db: Session = Depen
 @app.post('/carrinho/clear')
 def api_clear_carrinho(payload: dict, request: Request, db: Session = Depends(get_db)):
     try:
-        # payload pode conter user_id ou cart_id
+        # `cart_id` (opcional) precisa ser o carrinho de quem chama
         cart_id = payload.get('cart_id') if payload else None
-        if cart_id:
-            ok = crud.clear_cart(db, int(cart_id))
-            if not ok:
-                raise HTTPException(status_code=404, detail='Carrinho não encontrado')
-            return {'ok': True}
-
-        user_id = _extract_user_id_from_request(request, payload)
-        cart = crud.get_cart_by_user(db, user_id)
+        cart = _carrinho_do_chamador(request, db)
+        if cart_id and (not cart or cart.id != int(cart_id)):
+            raise HTTPException(status_code=404, detail='Carrinho não encontrado')
         if not cart:
             return {'ok': True}
         ok = crud.clear_cart(db, cart.id)
@@ -1009,6 +1178,41 @@ def api_clear_carrinho(payload: dict, request: Request, db: Session = Depends(ge
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# ----- Sincronização do modo offline -----
+@app.post('/sync/batch')
+def api_sync_batch(payload: dict, request: Request):
+    """Aplica em ordem a fila de operações feitas offline (ver backend/sincronizacao.py).
+
+    Payload: { operacoes: [{ id, tipo, dados }], parar_no_erro (opcional) }
+    Dono como no carrinho: usuário do token ou sessão anônima do cookie. Sem usuário,
+    favoritos e avaliações voltam como erro.
+    Retorna um resultado por operação: aplicada, duplicada (já aplicada antes), erro ou ignorada.
+    """
+    operacoes = payload.get('operacoes')
+    if not isinstance(operacoes, list) or not operacoes:
+        raise HTTPException(status_code=400, detail='operacoes deve ser uma lista não vazia')
+    if len(operacoes) > sincronizacao.SYNC_MAX_OPERACOES:
+        raise HTTPException(status_code=413, detail=f'no máximo {sincronizacao.SYNC_MAX_OPERACOES} operações por requisição')
+    try:
+        usuario_id, session_id = _dono_carrinho(request)
+        dono = sincronizacao.Dono(usuario_id=usuario_id, session_id=session_id)
+        resultados = sincronizacao.aplicar(operacoes, dono, parar_no_erro=bool(payload.get('parar_no_erro', False)))
+    except Exception as e:
+        logger.exception(f"Erro na sincronização em lote: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    contagem = {status: 0 for status in (sincronizacao.APLICADA, sincronizacao.DUPLICADA, sincronizacao.ERRO, sincronizacao.IGNORADA)}
+    for r in resultados:
+        contagem[r['status']] += 1
+    return {
+        'ok': contagem[sincronizacao.ERRO] == 0 and contagem[sincronizacao.IGNORADA] == 0,
+        'aplicadas': contagem[sincronizacao.APLICADA],
+        'duplicadas': contagem[sincronizacao.DUPLICADA],
+        'falhas': contagem[sincronizacao.ERRO],
+        'ignoradas': contagem[sincronizacao.IGNORADA],
+        'resultados': resultados,
+    }
+
+
 # ----- Mercado Pago -----
 @app.post('/api/mercadopago/create')
 def api_create_mercadopago_preference(payload: dict):
@@ -0,0 +1,233 @@
+"""Migrações de schema versionadas.
+
+`Base.metadata.create_all` só cria tabelas que ainda não existem: índices e
+colunas novas declarados em `models.py` nunca chegam a um banco já em uso. Cada
+alteração de schema é registrada aqui como uma migração numerada, aplicada uma
+única vez e anotada na tabela `schema_migracoes`.
+
+As migrações precisam ser idempotentes (`IF NOT EXISTS`, checar colunas antes de
+adicionar): num banco novo o `create_all` já criou tudo e a migração só é
+registrada. O startup da API aplica as pendentes; também pode ser executado à mão:
+
+    python backend/migracoes.py            # aplica as pendentes
+    python backend/migracoes.py --status   # lista aplicadas/pendentes
+"""
+import sys
+import time
+import pathlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy import Index, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+
+from backend import models
+from backend.logging_config import logger
+
+
+@dataclass
+class Migracao:
+    versao: str
+    descricao: str
+    aplicar: Callable[[Connection], None]
+
+
+MIGRACOES: List[Migracao] = []
+
+
+def migracao(versao: str, descricao: str):
+    """Decorator que registra uma função `f(conn)` como migração `versao`."""
+    def registrar(f: Callable[[Connection], None]):
+        MIGRACOES.append(Migracao(versao, descricao, f))
+        return f
+    return registrar
+
+
+# ----- Helpers para escrever migrações -----
+def indice(tabela: str, nome: str) -> Index:
+    """Retorna o Index `nome` declarado em `models.py` para `tabela`."""
+    for idx in models.Base.metadata.tables[tabela].indexes:
+        if idx.name == nome:
+            return idx
+    raise KeyError(f'índice {nome} não declarado em {tabela}')
+
+
+def criar_indices(conn: Connection, indices: Sequence[Tuple[str, str]]) -> None:
+    """Cria (se ainda não existirem) os índices (tabela, nome) declarados nos modelos."""
+    for tabela, nome in indices:
+        conn.execute(CreateIndex(indice(tabela, nome), if_not_exists=True))
+
+
+def adicionar_colunas(conn: Connection, colunas: Sequence[Tuple[str, str]]) -> None:
+    """Adiciona (se ainda não existirem) as colunas (tabela, coluna) declaradas nos modelos.
+
+    Só para colunas que aceitam NULL ou têm `server_default`: o ALTER TABLE não
+    preenche as linhas existentes.
+    """
+    inspetor = inspect(conn)
+    for tabela, nome in colunas:
+        if nome in {c['name'] for c in inspetor.get_columns(tabela)}:
+            continue
+        coluna = models.Base.metadata.tables[tabela].c[nome]
+        ddl = f'ALTER TABLE {tabela} ADD COLUMN {nome} {coluna.type.compile(conn.dialect)}'
+        if coluna.server_default is not None:
+            ddl += f' DEFAULT {coluna.server_default.arg}'
+        if not coluna.nullable:
+            ddl += ' NOT NULL'
+        conn.execute(text(ddl))
+
+
+# ----- Migrações (em ordem) -----
+INDICES_CAMINHOS_QUENTES = [
+    ('pedidos', 'ix_pedidos_mesa_status'),
+    ('pedidos', 'ix_pedidos_created_at_id'),
+    ('pedido_itens', 'ix_pedido_itens_pedido_id'),
+    ('carrinhos', 'ix_carrinhos_user_id'),
+    ('carrinhos', 'ix_carrinhos_session_id'),
+    # ('carrinho_items', 'ix_carrinho_items_carrinho_produto'): substituído pelo índice único da 0005
+    ('avaliacoes', 'ix_avaliacoes_produto_id'),
+    ('movimentacoes_estoque', 'ix_movimentacoes_estoque_produto_created'),
+]
+
+
+@migracao('0001', 'índices de pedidos, itens, carrinhos, avaliações e movimentações de estoque')
+def _m0001_indices(conn: Connection) -> None:
+    criar_indices(conn, INDICES_CAMINHOS_QUENTES)
+
+
+@migracao('0002', 'reservas de estoque: coluna pedido_item_id e índices de status/expiração, produto e pedido')
+def _m0002_reservas(conn: Connection) -> None:
+    adicionar_colunas(conn, [('estoques_reserva', 'pedido_item_id')])
+    criar_indices(conn, [
+        ('estoques_reserva', 'ix_estoques_reserva_status_expira'),
+        ('estoques_reserva', 'ix_estoques_reserva_produto_status'),
+        ('estoques_reserva', 'ix_estoques_reserva_pedido_id'),
+    ])
+
+
+@migracao('0003', 'agregados de avaliação em produtos (quantidade/soma/média) e índice por rating')
+def _m0003_ratings(conn: Connection) -> None:
+    adicionar_colunas(conn, [('produtos', 'avaliacoes_quantidade'), ('produtos', 'avaliacoes_soma')])
+    criar_indices(conn, [('produtos', 'ix_produtos_rating_id')])
+    # SQL congelado (não usa crud.stmt_recalcular_ratings, que acompanha o schema atual)
+    conn.execute(text(
+        'UPDATE produtos SET '
+        'avaliacoes_quantidade = (SELECT COUNT(a.id) FROM avaliacoes a WHERE a.produto_id = produtos.id), '
+        'avaliacoes_soma = (SELECT COALESCE(SUM(a.rating), 0) FROM avaliacoes a WHERE a.produto_id = produtos.id)'
+    ))
+    conn.execute(text(
+        'UPDATE produtos SET rating = CASE WHEN avaliacoes_quantidade > 0 '
+        'THEN ROUND(avaliacoes_soma * 1.0 / avaliacoes_quantidade, 2) ELSE 0 END'
+    ))
+
+
+@migracao('0004', 'índice de busca textual de produtos (FTS5 no SQLite, tsvector no PostgreSQL)')
+def _m0004_busca(conn: Connection) -> None:
+    from backend import busca
+
+    if busca.criar_indice(conn):
+        busca.indexar(conn)
+
+
+@migracao('0005', 'carrinho: índice único (carrinho_id, produto_id) e totais recalculados')
+def _m0005_carrinho_unico(conn: Connection) -> None:
+    # junta itens repetidos do mesmo produto no item mais antigo antes de criar o índice único
+    duplicados = conn.execute(text(
+        'SELECT carrinho_id, produto_id, MIN(id), SUM(quantidade), SUM(subtotal) FROM carrinho_items '
+        'WHERE produto_id IS NOT NULL GROUP BY carrinho_id, produto_id HAVING COUNT(*) > 1'
+    )).all()
+    for carrinho_id, produto_id, manter, quantidade, subtotal in duplicados:
+        conn.execute(
+            text('UPDATE carrinho_items SET quantidade = :q, subtotal = :s WHERE id = :id'),
+            {'q': quantidade, 's': subtotal, 'id': manter},
+        )
+        conn.execute(
+            text('DELETE FROM carrinho_items WHERE carrinho_id = :c AND produto_id = :p AND id <> :id'),
+            {'c': carrinho_id, 'p': produto_id, 'id': manter},
+        )
+    if duplicados:
+        logger.info('Migração 0005: %s itens de carrinho repetidos agrupados', len(duplicados))
+    conn.execute(text('DROP INDEX IF EXISTS ix_carrinho_items_carrinho_produto'))
+    criar_indices(conn, [('carrinho_items', 'uix_carrinho_items_carrinho_produto')])
+    # a partir daqui o total é mantido por delta: partir dos valores corretos (SQL congelado,
+    # não crud.stmt_recalcular_totais_carrinho)
+    conn.execute(text(
+        'UPDATE carrinhos SET total = ROUND((SELECT COALESCE(SUM(i.subtotal), 0) FROM carrinho_items i '
+        'WHERE i.carrinho_id = carrinhos.id), 2)'
+    ))
+
+
+@migracao('0006', 'carrinhos: índice por updated_at para a limpeza de carrinhos abandonados')
+def _m0006_carrinhos_updated_at(conn: Connection) -> None:
+    criar_indices(conn, [('carrinhos', 'ix_carrinhos_updated_at')])
+
+
+# ----- Execução -----
+def _tabela():
+    return models.MigracaoAplicada.__table__
+
+
+def versoes_aplicadas(conn: Connection) -> Set[str]:
+    return set(conn.execute(select(_tabela().c.versao)).scalars())
+
+
+def _garantir_tabela(engine: Engine) -> None:
+    try:
+        _tabela().create(engine, checkfirst=True)
+    except (OperationalError, ProgrammingError):
+        # outro worker criou a tabela entre a checagem e o CREATE
+        logger.debug('schema_migracoes já criada por outro processo')
+
+
+def pendentes(engine: Optional[Engine] = None) -> List[Migracao]:
+    engine = engine or models.engine
+    _garantir_tabela(engine)
+    with engine.connect() as conn:
+        feitas = versoes_aplicadas(conn)
+    return [m for m in sorted(MIGRACOES, key=lambda m: m.versao) if m.versao not in feitas]
+
+
+def aplicar(engine: Optional[Engine] = None) -> List[str]:
+    """Aplica as migrações pendentes, cada uma na sua transação. Retorna as versões aplicadas."""
+    engine = engine or models.engine
+    aplicadas = []
+    for m in pendentes(engine):
+        inicio = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if m.versao in versoes_aplicadas(conn):
+                    continue
+                m.aplicar(conn)
+                conn.execute(insert(_tabela()).values(
+                    versao=m.versao, descricao=m.descricao, aplicada_em=datetime.now(timezone.utc)
+                ))
+        except IntegrityError:
+            # Vários workers no startup: outro processo registrou a mesma versão
+            logger.info('Migração %s aplicada por outro processo', m.versao)
+            continue
+        logger.info('Migração %s aplicada (%s) em %.0f ms', m.versao, m.descricao, (time.perf_counter() - inicio) * 1000)
+        aplicadas.append(m.versao)
+    return aplicadas
+
+
+if __name__ == '__main__':
+    from backend.database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    if '--status' in sys.argv[1:]:
+        _garantir_tabela(engine)
+        with engine.connect() as conn:
+            feitas = versoes_aplicadas(conn)
+        for m in sorted(MIGRACOES, key=lambda m: m.versao):
+            logger.info('%s [%s] %s', m.versao, 'aplicada' if m.versao in feitas else 'pendente', m.descricao)
+    else:
+        versoes = aplicar(engine)
+        logger.info('Migrações aplicadas: %s', ', '.join(versoes) if versoes else 'nenhuma pendente')
@@ -6,7 +6,7 @@ from decimal import Decimal
 import enum # Enumeração para tipos de usuário
 
 from sqlalchemy import (
-    Column, Integer, String, Text, DateTime, Date, Boolean, ForeignKey, Numeric, UniqueConstraint, Enum as SAEnum
+    Column, Integer, String, Text, DateTime, Date, Boolean, ForeignKey, Numeric, UniqueConstraint, Index, LargeBinary, Enum as SAEnum
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy import event
@@ -22,13 +22,18 @@ class UserType(enum.Enum):
     admin = 'admin'
 
 
+def remover_acentos(text: str) -> str:
+    """'Pão de Açúcar' -> 'Pao de Acucar' (NFKD + descarte do que não é ASCII)."""
+    t = unicodedata.normalize('NFKD', text or '')
+    return t.encode('ascii', 'ignore').decode('ascii')
+
+
 def gerar_slug(text: str) -> str:
     """Gera um slug simples a partir de um texto (normaliza acentos, espaços e caracteres inválidos)."""
     if not text:
         return ''
     # normalizar acentos
-    t = unicodedata.normalize('NFKD', text)
-    t = t.encode('ascii', 'ignore').decode('ascii')
+    t = remover_acentos(text)
     t = t.strip()
 
     # Se o nome for somente números (ex: '1' ou '01'), produz 'Mesa-01'
@@ -69,25 +74,14 @@ class User(Base):
     date_joined = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     def set_password(self, password: str):
-        """Gera um hash da senha usando bcrypt"""
-        import bcrypt # Biblioteca para hashing de senhas
-        # Converte a senha para bytes se for string
-        if isinstance(password, str):
-            password = password.encode('utf-8')
-        # Gera o salt e o hash
-        salt = bcrypt.gensalt()
-        self.password = bcrypt.hashpw(password, salt).decode('utf-8')
+        """Gera um hash da senha usando bcrypt (no pool de processos de `backend.senhas`)"""
+        from backend import senhas
+        self.password = senhas.gerar_hash(password)
 
     def check_password(self, password: str) -> bool:
-        """Verifica se a senha está correta"""
-        import bcrypt
-        # Converte a senha para bytes se for string
-        if isinstance(password, str):
-            password = password.encode('utf-8')
-        # Converte o hash armazenado de string para bytes
-        stored = self.password.encode('utf-8')
-        # Verifica se a senha corresponde ao hash
-        return bcrypt.checkpw(password, stored)
+        """Verifica se a senha está correta (no pool de processos de `backend.senhas`)"""
+        from backend import senhas
+        return senhas.verificar(password, self.password)
 
 
 # ----------------- Core: Empresas, Notas Fiscais, Categorias, Produtos -----------------
@@ -146,6 +140,7 @@ class Categoria(Base):
 
 class Produto(Base):
     __tablename__ = 'produtos'
+    __table_args__ = (Index('ix_produtos_rating_id', 'rating', 'id'),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     nome = Column(String(200), nullable=False)
@@ -163,7 +158,11 @@ class Produto(Base):
     style = Column(String(100), nullable=True)
     abv = Column(String(20), nullable=True)
     ibu = Column(Integer, nullable=True)
+    # média das avaliações, mantida junto com quantidade/soma a cada escrita em `avaliacoes`
+    # (ver crud.aplicar_delta_rating; reparo: python -m backend.recalcular_ratings)
     rating = Column(Numeric(3, 2), default=0.0)
+    avaliacoes_quantidade = Column(Integer, nullable=False, default=0, server_default='0')
+    avaliacoes_soma = Column(Integer, nullable=False, default=0, server_default='0')
 
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -201,6 +200,11 @@ class Mesa(Base):
 class Pedido(Base):
     """Pedido unificado: pode ser do tipo 'online' ou 'fisica'."""
     __tablename__ = 'pedidos'
+    __table_args__ = (
+        # pedido pendente da mesa (toda ação no salão) e listagem por data (cursor)
+        Index('ix_pedidos_mesa_status', 'mesa_id', 'status'),
+        Index('ix_pedidos_created_at_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     tipo = Column(String(20), default='online')
@@ -232,6 +236,7 @@ class Pedido(Base):
 
 class PedidoItem(Base):
     __tablename__ = 'pedido_itens'
+    __table_args__ = (Index('ix_pedido_itens_pedido_id', 'pedido_id'),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     pedido_id = Column(Integer, ForeignKey('pedidos.id', ondelete='CASCADE'), nullable=False)
@@ -248,6 +253,7 @@ class PedidoItem(Base):
 # ----------------- Online features -----------------
 class Favorito(Base):
     __tablename__ = 'favoritos'
+    # A unique (user_id, produto_id) já serve de índice para consultas por user_id
     __table_args__ = (UniqueConstraint('user_id', 'produto_id', name='uix_user_produto_favorito'),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -261,7 +267,10 @@ class Favorito(Base):
 
 class Avaliacao(Base):
     __tablename__ = 'avaliacoes'
-    __table_args__ = (UniqueConstraint('user_id', 'produto_id', name='uix_user_produto_avaliacao'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'produto_id', name='uix_user_produto_avaliacao'),
+        Index('ix_avaliacoes_produto_id', 'produto_id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('usuarios.id', ondelete='CASCADE'), nullable=False)
@@ -278,6 +287,7 @@ class Avaliacao(Base):
 # ----------------- Estoque / Pagamento -----------------
 class MovimentacaoEstoque(Base):
     __tablename__ = 'movimentacoes_estoque'
+    __table_args__ = (Index('ix_movimentacoes_estoque_produto_created', 'produto_id', 'created_at'),)
 
     id = Column(Integer, primary_key=True)
     produto_id = Column(Integer, ForeignKey('produtos.id'), nullable=False)
@@ -295,8 +305,39 @@ class MovimentacaoEstoque(Base):
     usuario = relationship('User')
 
 
+class EstoqueSnapshot(Base):
+    """Fechamento diário de estoque por produto, agregado a partir de `movimentacoes_estoque`.
+
+    Só existem linhas para dias com movimentação; o estoque de um dia sem linha é o
+    fechamento do último dia anterior. Mantido por `backend.snapshots_estoque`.
+    """
+    __tablename__ = 'estoque_snapshots'
+    __table_args__ = (UniqueConstraint('produto_id', 'dia', name='uix_estoque_snapshot_produto_dia'),)
+
+    id = Column(Integer, primary_key=True)
+    produto_id = Column(Integer, ForeignKey('produtos.id'), nullable=False)
+    dia = Column(Date, nullable=False)
+    entradas = Column(Integer, nullable=False, default=0)
+    saidas = Column(Integer, nullable=False, default=0)
+    movimentacoes = Column(Integer, nullable=False, default=0)
+    quantidade_abertura = Column(Integer, nullable=False)
+    quantidade_fechamento = Column(Integer, nullable=False)
+    ultima_movimentacao_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
 class EstoqueReserva(Base):
+    """Reserva de estoque de um item de mesa (ver `backend.reservas`).
+
+    status: 'ativa' -> 'convertida' (pagamento), 'liberada' (item removido/pedido
+    cancelado) ou 'expirada' (varredura periódica).
+    """
     __tablename__ = 'estoques_reserva'
+    __table_args__ = (
+        Index('ix_estoques_reserva_status_expira', 'status', 'expira_em'),
+        Index('ix_estoques_reserva_produto_status', 'produto_id', 'status'),
+        Index('ix_estoques_reserva_pedido_id', 'pedido_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     produto_id = Column(Integer, ForeignKey('produtos.id'), nullable=False)
@@ -306,6 +347,8 @@ class EstoqueReserva(Base):
     status = Column(String(20), default='ativa')
     expira_em = Column(DateTime, nullable=False)
     pedido_id = Column(Integer, ForeignKey('pedidos.id'), nullable=True)
+    # sem FK: o item pode ser apagado e a reserva fica como histórico
+    pedido_item_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
@@ -339,10 +382,15 @@ class Cupom(Base):
 # ----------------- Carrinho (loja online) -----------------
 class Carrinho(Base):
     __tablename__ = 'carrinhos'
+    __table_args__ = (
+        Index('ix_carrinhos_user_id', 'user_id'),
+        Index('ix_carrinhos_session_id', 'session_id'),
+        Index('ix_carrinhos_updated_at', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('usuarios.id', ondelete='SET NULL'), nullable=True)
-    session_id = Column(String(255), nullable=True)  # opcional para carrinhos anônimos
+    session_id = Column(String(255), nullable=True)  # carrinhos anônimos (ver backend/carrinho_sessao.py)
     total = Column(Numeric(10, 2), nullable=False, default=0)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
@@ -353,6 +401,8 @@ class Carrinho(Base):
 
 class CarrinhoItem(Base):
     __tablename__ = 'carrinho_items'
+    # único: permite o upsert do item por (carrinho, produto) em crud.add_item_to_cart
+    __table_args__ = (Index('uix_carrinho_items_carrinho_produto', 'carrinho_id', 'produto_id', unique=True),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     carrinho_id = Column(Integer, ForeignKey('carrinhos.id', ondelete='CASCADE'), nullable=False)
@@ -397,6 +447,77 @@ class Pagamento(Base):
     pedido = relationship('Pedido')
 
 
+# ----------------- Contadores (sequências) -----------------
+class Contador(Base):
+    """Contador nomeado usado para gerar números sequenciais em O(1).
+
+    Cada linha representa um escopo (ex: 'pedido' ou 'pedido:20251108') e guarda
+    o último valor entregue. Ver `backend.sequencias`.
+    """
+    __tablename__ = 'contadores'
+
+    escopo = Column(String(100), primary_key=True)
+    valor = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+
+# ----------------- Sincronização do modo offline -----------------
+class SyncOperacao(Base):
+    """Operação do modo offline já aplicada por `POST /sync/batch` (ver `backend.sincronizacao`).
+
+    `op_id` é gerado pelo cliente; reenvios da mesma operação devolvem o `resultado`
+    gravado em vez de aplicá-la de novo. Linhas antigas são apagadas pela tarefa
+    `sync_purgar`.
+    """
+    __tablename__ = 'sync_operacoes'
+    __table_args__ = (Index('ix_sync_operacoes_created_at', 'created_at'),)
+
+    op_id = Column(String(64), primary_key=True)
+    tipo = Column(String(50), nullable=False)
+    resultado = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+# ----------------- Idempotência -----------------
+class ChaveIdempotencia(Base):
+    """Resposta gravada para um `Idempotency-Key` (ver `backend.idempotencia`).
+
+    `status` 'em_andamento' enquanto a primeira execução roda; 'concluida' com a
+    resposta (2xx) que é devolvida aos reenvios até `expira_em`.
+    """
+    __tablename__ = 'idempotencia_chaves'
+    __table_args__ = (Index('ix_idempotencia_chaves_expira_em', 'expira_em'),)
+
+    rota = Column(String(200), primary_key=True)  # 'POST /mesas/3/itens'
+    chave = Column(String(128), primary_key=True)
+    hash_requisicao = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    media_type = Column(String(100), nullable=True)
+    corpo = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    expira_em = Column(DateTime, nullable=False)
+
+
+# ----------------- Migrações de schema -----------------
+class MigracaoAplicada(Base):
+    """Registro das migrações já aplicadas ao banco (ver `backend.migracoes`)."""
+    __tablename__ = 'schema_migracoes'
+
+    versao = Column(String(50), primary_key=True)
+    descricao = Column(String(255), nullable=False)
+    aplicada_em = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class VersaoBanco(Base):
+    """Marcadores de versão do schema e da carga inicial (ver `backend.inicializacao`)."""
+    __tablename__ = 'banco_versao'
+
+    chave = Column(String(50), primary_key=True)
+    valor = Column(String(128), nullable=False)
+    atualizado_em = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
 # Listeners de calculo de subtotal para itens
 def _calc_subtotal(mapper, connection, target):
     try:
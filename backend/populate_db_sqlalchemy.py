@@ -1,12 +1,16 @@
 """Script idempotente para popular o banco SQLite (bancodados.db) usando SQLAlchemy.
 
 Cria categorias, empresas, produtos, usuário admin, mesas e movimentações de estoque.
+Cada tipo de entidade é gravado com INSERT em lote (`ON CONFLICT DO NOTHING` no
+SQLite/PostgreSQL) numa única transação: rodar de novo não duplica nada.
+
+Modo gerador (`--gerar`): além da carga padrão, sintetiza N produtos, M mesas, K
+usuários e meses de pedidos (com itens, pagamentos e movimentações de estoque) a
+partir de uma semente fixa, para montar bancos grandes de benchmark/carga.
 
 Usage:
     python populate_db_sqlalchemy.py
-
-Este script assume que os arquivos `core_models.py`, `fisica_models.py` e `user_models.py`
-estão na mesma pasta e expõem `Session`, `Base` e os modelos utilizados.
+    python populate_db_sqlalchemy.py --gerar --produtos 5000 --mesas 80 --usuarios 20000 --meses 12 --pedidos-dia 1500
 """
 
 # executar no powershell
@@ -18,11 +22,15 @@ $env:PYTHONPATH = (Get-Location).Path
 python ./backend/populate_db_sqlalchemy.py
 """
 # populate_db_sqlalchemy.py
+import argparse
 import os
+import random
 import sys
 import pathlib
+import time
 from decimal import Decimal
 from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
 
 # Quando este script é executado diretamente (python populate_db_sqlalchemy.py)
 # o import "backend.*" pode falhar porque a raiz do projeto pode não estar em
@@ -34,9 +42,18 @@ if __package__ is None:
     if project_root_str not in sys.path:
         sys.path.insert(0, project_root_str)
 
-from backend.database import Session as Session, Base, engine as db
-from backend.models import Categoria, Empresa, Produto, Mesa, MovimentacaoEstoque, User, UserType
+from sqlalchemy import bindparam, insert, select, tuple_, update
+
+from backend.database import Session as Session, Base, engine as db, insert_dialeto
+from backend.models import (
+    Categoria, Empresa, NotaFiscal, Produto, Mesa, User, UserType, Pedido, PedidoItem, Pagamento, MovimentacaoEstoque,
+    gerar_slug,
+)
 from backend.logging_config import logger
+from backend import busca, senhas
+
+# linhas por INSERT em lote
+LOTE = 5000
 
 DEFAULT_CATEGORIES = [
     "BEBIDA", "COMIDA", "LANCHE", "SUCO", "TAPIOCA",
@@ -453,218 +470,445 @@ PRODUTOS_DEFAULT = [
         }
     ]
 
+# ----- INSERT em lote -----
+def _lotes(linhas: Sequence[Dict[str, Any]], tamanho: int = LOTE) -> Iterable[Sequence[Dict[str, Any]]]:
+    for i in range(0, len(linhas), tamanho):
+        yield linhas[i:i + tamanho]
+
+
+def inserir_ignorando(session, modelo, linhas: List[Dict[str, Any]], chave: Sequence[str], retornando: Sequence[str] = ()):
+    """INSERT em lote que pula as linhas já existentes. Não faz commit.
+
+    SQLite/PostgreSQL: `INSERT ... ON CONFLICT DO NOTHING`. Outros bancos: consulta as
+    `chave`s existentes e insere o resto. Com `retornando`, devolve essas colunas das
+    linhas inseridas; senão, quantas foram inseridas.
+    """
+    tabela = modelo.__table__
+    colunas_ret = [tabela.c[c] for c in retornando]
+    inseridas: List[Any] = []
+    total = 0
+    if not linhas:
+        return inseridas if retornando else total
+
+    stmt = insert_dialeto(session, tabela)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_nothing()
+        if colunas_ret:
+            stmt = stmt.returning(*colunas_ret)
+        for lote in _lotes(linhas):
+            resultado = session.execute(stmt, lote)
+            if colunas_ret:
+                inseridas.extend(resultado.all())
+            else:
+                total += max(resultado.rowcount, 0)
+        return inseridas if retornando else total
+
+    colunas = [tabela.c[c] for c in chave]
+    chaves = [tuple(linha[c] for c in chave) for linha in linhas]
+    existentes = set()
+    for lote in _lotes(chaves):
+        existentes.update(tuple(r) for r in session.execute(select(*colunas).where(tuple_(*colunas).in_(lote))))
+    novas = [linha for linha, k in zip(linhas, chaves) if k not in existentes]
+    for lote in _lotes(novas):
+        session.execute(insert(tabela), lote)
+    if colunas_ret:
+        novas_chaves = [tuple(linha[c] for c in chave) for linha in novas]
+        for lote in _lotes(novas_chaves):
+            inseridas.extend(session.execute(select(*colunas_ret).where(tuple_(*colunas).in_(lote))).all())
+        return inseridas
+    return len(novas)
+
+
+def _ids_por(session, coluna) -> Dict[Any, int]:
+    """{valor da coluna: id} da tabela inteira (tabelas pequenas: categorias, empresas)."""
+    tabela = coluna.class_
+    return dict(session.execute(select(coluna, tabela.id)).all())
+
+
+def _hashes(senhas_claras: Iterable[str]) -> Dict[str, str]:
+    # bcrypt é caro: um hash por senha distinta, reaproveitado entre os usuários
+    return {senha: senhas.gerar_hash(senha) for senha in set(senhas_claras)}
+
+
+def _atualizar_estoques(session, estoques: Dict[int, int]) -> None:
+    stmt = update(Produto.__table__).where(Produto.__table__.c.id == bindparam('b_id')).values(estoque=bindparam('b_estoque'))
+    linhas = [{'b_id': pid, 'b_estoque': qtd} for pid, qtd in estoques.items()]
+    for lote in _lotes(linhas):
+        session.execute(stmt, lote)
+
+
+def _indexar_busca(session, produto_ids: Optional[List[int]]) -> None:
+    # os INSERTs em lote não passam pelo listener de flush de `backend.busca`
+    if produto_ids is None or produto_ids:
+        busca.indexar(session.connection(), produto_ids)
+
+
+# ----- Carga padrão (uma transação por tipo de entidade) -----
 def create_categories(session):
-    for nome in DEFAULT_CATEGORIES:
-        cat = session.query(Categoria).filter_by(nome=nome).first()
-        if not cat:
-            cat = Categoria(nome=nome, descricao=f"Categoria {nome}")
-            session.add(cat)
-            logger.info(f"Criada categoria: {nome}")
+    n = inserir_ignorando(session, Categoria, [
+        {'nome': nome, 'descricao': f'Categoria {nome}'} for nome in DEFAULT_CATEGORIES
+    ], chave=['nome'])
     session.commit()
+    logger.info(f'Categorias criadas: {n}')
 
 def create_empresas(session):
-    for ed in EMPRESAS_DEFAULT:
-        emp = session.query(Empresa).filter_by(cnpj=ed['cnpj']).first()
-        if not emp:
-            emp = Empresa(nome=ed['nome'], endereco=ed['endereco'], telefone=ed['telefone'], email=ed['email'], cnpj=ed['cnpj'], slug=ed['slug'])
-            session.add(emp)
-            session.commit()
-            nf = ed.get('nota_fiscal')
-            if nf:
-                # NotaFiscal pode não existir no modelo atual; tenta importar dinamicamente
-                try:
-                    from backend.models import NotaFiscal
-                except Exception:
-                    logger.warning('Modelo NotaFiscal não encontrado; pulando criação de nota fiscal para %s', emp.nome)
-                else:
-                    nf_obj = NotaFiscal(empresa_id=emp.id, serie=nf['serie'], numero=nf['numero'], descricao=nf['descricao'], data=date.fromisoformat(nf['data']))
-                    session.add(nf_obj)
-                    session.commit()
-                    logger.info(f"Empresa e nota fiscal criadas: {emp.nome}")
-        else:
-            logger.info(f"Empresa já existe: {emp.nome}")
+    n = inserir_ignorando(session, Empresa, [
+        {k: ed[k] for k in ('nome', 'endereco', 'telefone', 'email', 'cnpj', 'slug')} for ed in EMPRESAS_DEFAULT
+    ], chave=['cnpj'])
+    empresas = _ids_por(session, Empresa.cnpj)
+    notas = [
+        {
+            'empresa_id': empresas[ed['cnpj']], 'serie': ed['nota_fiscal']['serie'], 'numero': ed['nota_fiscal']['numero'],
+            'descricao': ed['nota_fiscal']['descricao'], 'data': date.fromisoformat(ed['nota_fiscal']['data']),
+        }
+        for ed in EMPRESAS_DEFAULT if ed.get('nota_fiscal') and ed['cnpj'] in empresas
+    ]
+    nf = inserir_ignorando(session, NotaFiscal, notas, chave=['empresa_id', 'serie', 'numero'])
+    session.commit()
+    logger.info(f'Empresas criadas: {n}; notas fiscais: {nf}')
 
 def create_user_admin(session):
-    user = session.query(User).filter_by(username='admin').first()
-    if not user:
-        user = User(username='admin', email='admin@example.com', nome='Administrador', tipo=UserType.admin)
-        user.set_password('admin123')  # Usa set_password para fazer hash correto
-        user.is_superuser = True
-        session.add(user)
+    admin = {'username': 'admin', 'email': 'admin@example.com', 'nome': 'Administrador', 'tipo': UserType.admin,
+             'is_superuser': True}
+    if session.execute(select(User.id).where(User.username == 'admin')).scalar() is None:
+        admin['password'] = senhas.gerar_hash('admin123')
+        if inserir_ignorando(session, User, [admin], chave=['username']):
+            logger.info('Usuário admin criado: admin')
         session.commit()
-        logger.info('Usuário admin criado: admin')
     else:
         logger.info('Usuário admin já existe')
-    # Recarrega o usuário pelo username no contexto da sessão e retorna o id
-    user_obj = session.query(User).filter_by(username='admin').first()
-    return user_obj.id if user_obj else None
+    return session.execute(select(User.id).where(User.username == 'admin')).scalar()
+
+USUARIOS_DEFAULT = [
+    # fisica
+    {"username": "julia", "email": "julia@gmail.com", "nome": "Julia", "password": "2325*-9+", "tipo": UserType.fisica},
+    {"username": "mariana", "email": "mariana@gmail.com", "nome": "Mariana", "password": "2325*-9+", "tipo": UserType.fisica},
+    # online
+    {"username": "osmar", "email": "osmar@gmail.com", "nome": "Osmar", "password": "2325*-9+", "tipo": UserType.online},
+    {"username": "amanda", "email": "amanda@gmail.com", "nome": "Amanda", "password": "2325*-9+", "tipo": UserType.online},
+    {"username": "gabriela", "email": "gabriela@gmail.com", "nome": "Gabriela", "password": "2325*-9+", "tipo": UserType.online},
+    {"username": "juliana", "email": "juliana@gmail.com", "nome": "Juliana", "password": "2325*-9+", "tipo": UserType.online},
+]
+
+def create_users_custom(session):
+    """Cria os usuários físicos e online padrão que ainda não existirem. Retorna os ids de todos."""
+    usernames = [u['username'] for u in USUARIOS_DEFAULT]
+    emails = [u['email'] for u in USUARIOS_DEFAULT]
+    existentes = session.execute(
+        select(User.username, User.email).where(User.username.in_(usernames) | User.email.in_(emails))
+    ).all()
+    ocupados = {r.username for r in existentes} | {r.email for r in existentes}
+    novos = [u for u in USUARIOS_DEFAULT if u['username'] not in ocupados and u['email'] not in ocupados]
+    hashes = _hashes(u['password'] for u in novos)
+    n = inserir_ignorando(session, User, [dict(u, password=hashes[u['password']]) for u in novos], chave=['username'])
+    session.commit()
+    logger.info(f'Usuários criados: {n} (já existentes: {len(USUARIOS_DEFAULT) - len(novos)})')
+    return list(session.execute(
+        select(User.id).where(User.username.in_(usernames) | User.email.in_(emails)).order_by(User.id)
+    ).scalars())
 
 def create_produtos(session, usuario_id):
+    # produtos novos já entram com o estoque inicial, registrado como uma entrada cada
+    categorias = _ids_por(session, Categoria.nome)
+    empresas = _ids_por(session, Empresa.nome)
+    linhas = []
     for pd in PRODUTOS_DEFAULT:
-        cat = session.query(Categoria).filter_by(nome=pd['categoria']).first()
-        emp = session.query(Empresa).filter_by(nome=pd['empresa']).first()
-        if not cat or not emp:
+        if pd['categoria'] not in categorias or pd['empresa'] not in empresas:
             logger.info(f"Pular produto {pd['nome']}: categoria ou empresa ausente")
             continue
-        slug = f"{pd['nome'].lower().replace(' ', '-')[:200]}"
-        prod = session.query(Produto).filter_by(codigo=pd['codigo']).first()
-        if not prod:
+        linhas.append({
             # modelo Produto usa campos 'custo' e 'venda' (nome antigo: preco_compra/preco_venda)
-            prod = Produto(
-                nome=pd['nome'],
-                categoria_id=cat.id,
-                empresa_id=emp.id,
-                descricao=pd['descricao'],
-                custo=pd['custo'],
-                venda=pd['venda'],
-                codigo=pd['codigo'],
-                estoque=pd['estoque'],
-                disponivel=pd['disponivel'],
-                imagem=pd['imagem'],
-                slug=slug,
-            )
-            session.add(prod)
-            session.commit()
-            logger.info(f"Produto criado: {prod.nome}")
-            # criar movimentacao de entrada
-            mov = MovimentacaoEstoque(produto_id=prod.id, tipo='entrada', origem='compra', quantidade=prod.estoque, quantidade_anterior=0, quantidade_nova=prod.estoque, usuario_id=usuario_id if usuario_id else 1, observacoes='Entrada inicial')
-            session.add(mov)
-            session.commit()
-            logger.info('Movimentacao de estoque criada')
-        else:
-            logger.info(f"Produto já existe: {prod.nome}")
-
-def create_mesas(session, usuario_id=None):
-    # cria mesas 01..10 e alguns balcões
-    for i in range(1, 11): # percorre de 1 a 10
-        nome = str(i).zfill(2) # Formata com dois dígitos ex: 01, 02, ..., 10
-        # gerar slug via função utilitária dos modelos, se disponível
-        try:
-            from backend.models import gerar_slug
-        except Exception:
-            def gerar_slug(t):
-                return t.lower().replace(' ', '-')[:100]
-
-        slug = gerar_slug(nome)
-        mesa = session.query(Mesa).filter_by(nome=nome).first()
-        if not mesa:
-            mesa = Mesa(nome=nome, slug=slug, status='Livre', usuario_responsavel_id=usuario_id, capacidade=4, observacoes='')
-            session.add(mesa)
-            logger.info(f'Mesa criada: {nome} (responsavel_id={usuario_id})')
-    for nome in ['Balcão 1', 'Balcão 2', 'Entrega 1']:
-        try:
-            from backend.models import gerar_slug
-        except Exception:
-            def gerar_slug(t):
-                return t.lower().replace(' ', '-')[:100]
-
-        slug = gerar_slug(nome)
-        mesa = session.query(Mesa).filter_by(nome=nome).first()
-        if not mesa:
-            mesa = Mesa(nome=nome, slug=slug, status='Livre', usuario_responsavel_id=usuario_id, capacidade=1, observacoes='Mesa de balcão')
-            session.add(mesa)
-            logger.info(f'Mesa criada: {nome} (responsavel_id={usuario_id})')
+            'nome': pd['nome'], 'categoria_id': categorias[pd['categoria']], 'empresa_id': empresas[pd['empresa']],
+            'descricao': pd['descricao'], 'custo': pd['custo'], 'venda': pd['venda'], 'codigo': pd['codigo'],
+            'estoque': pd['estoque'], 'disponivel': pd['disponivel'], 'imagem': pd['imagem'],
+            'slug': pd['nome'].lower().replace(' ', '-')[:200],
+        })
+    novos = inserir_ignorando(session, Produto, linhas, chave=['codigo'], retornando=['id', 'estoque'])
+    agora = datetime.now(timezone.utc)
+    movimentacoes = [
+        {'produto_id': pid, 'tipo': 'entrada', 'origem': 'compra', 'quantidade': estoque, 'quantidade_anterior': 0,
+         'quantidade_nova': estoque, 'usuario_id': usuario_id or 1, 'observacoes': 'Entrada inicial', 'created_at': agora}
+        for pid, estoque in novos if estoque
+    ]
+    for lote in _lotes(movimentacoes):
+        session.execute(insert(MovimentacaoEstoque.__table__), lote)
+    _indexar_busca(session, [pid for pid, _ in novos])
     session.commit()
+    logger.info(f'Produtos criados: {len(novos)}; {len(movimentacoes)} movimentações de estoque criadas')
 
-def create_users_custom(session):
-    """Cria os usuários físicos e online solicitados, se não existirem."""
-    users_to_create = [
-        # fisica
-        {"username": "julia", "email": "julia@gmail.com", "nome": "Julia", "password": "2325*-9+", "tipo": UserType.fisica},
-        {"username": "mariana", "email": "mariana@gmail.com", "nome": "Mariana", "password": "2325*-9+", "tipo": UserType.fisica},
-        # online
-        {"username": "osmar", "email": "osmar@gmail.com", "nome": "Osmar", "password": "2325*-9+", "tipo": UserType.online},
-        {"username": "amanda", "email": "amanda@gmail.com", "nome": "Amanda", "password": "2325*-9+", "tipo": UserType.online},
-        {"username": "gabriela", "email": "gabriela@gmail.com", "nome": "Gabriela", "password": "2325*-9+", "tipo": UserType.online},
-        {"username": "juliana", "email": "juliana@gmail.com", "nome": "Juliana", "password": "2325*-9+", "tipo": UserType.online},
+def create_mesas(session, usuario_id=None):
+    # mesas 01..10 e alguns balcões
+    mesas = [
+        {'nome': str(i).zfill(2), 'capacidade': 4, 'observacoes': ''} for i in range(1, 11)
+    ] + [
+        {'nome': nome, 'capacidade': 1, 'observacoes': 'Mesa de balcão'} for nome in ['Balcão 1', 'Balcão 2', 'Entrega 1']
     ]
+    n = inserir_ignorando(session, Mesa, [
+        dict(m, slug=gerar_slug(m['nome']), status='Livre', usuario_responsavel_id=usuario_id) for m in mesas
+    ], chave=['slug'])
+    session.commit()
+    logger.info(f'Mesas criadas: {n} (responsavel_id={usuario_id})')
 
-    created_ids = []
-    for u in users_to_create:
-        exists = session.query(User).filter((User.username == u['username']) | (User.email == u['email'])).first()
-        if exists:
-            logger.info(f"Usuário já existe: {exists.username} <{exists.email}>")
-            created_ids.append(exists.id)
-            continue
-        try:
-            new_user = User(username=u['username'], email=u['email'], nome=u['nome'], tipo=u['tipo'])
-            new_user.set_password(u['password'])  # Usa set_password para fazer hash correto
-            # se for admin (nenhum aqui) poderia setar is_superuser
-            session.add(new_user)
+def backfill_slugs_mesas(session) -> int:
+    """Gera slug para as mesas que ainda não têm (consulta só essas)."""
+    try:
+        mesas = session.query(Mesa).filter((Mesa.slug.is_(None)) | (Mesa.slug == '')).all()
+        for m in mesas:
+            m.slug = gerar_slug(m.nome)
+        if mesas:
             session.commit()
-            logger.info(f"Usuário criado: {new_user.username} <{new_user.email}> tipo={new_user.tipo}")
-            created_ids.append(new_user.id)
-        except Exception as e:
-            session.rollback()
-            logger.exception('Erro ao criar usuário %s: %s', u['username'], e)
-    return created_ids
-
-def main():
-    # Garante criação das tabelas usando o engine compartilhado (db)
-    Base.metadata.create_all(bind=db)
+            logger.info(f'Backfill: slugs gerados para {len(mesas)} mesas')
+        return len(mesas)
+    except Exception as e:
+        session.rollback()
+        logger.exception('Erro no backfill de slug: %s', e)
+        return 0
+
+
+def main(criar_tabelas: bool = True) -> bool:
+    """Popula o banco se as tabelas principais estiverem vazias. Retorna True se populou.
+
+    O startup da API não chama mais este script a cada boot: ver `backend/inicializacao.py`.
+    """
+    if criar_tabelas:
+        # Garante criação das tabelas usando o engine compartilhado (db)
+        Base.metadata.create_all(bind=db)
     with Session() as session:
         # Se já houver dados nas tabelas principais, não executa a população completa.
-        try:
-            totais = {
-                'categorias': session.query(Categoria).count(),
-                'empresas': session.query(Empresa).count(),
-                'produtos': session.query(Produto).count(),
-                'mesas': session.query(Mesa).count(),
-                'usuarios': session.query(User).count(),
-            }
-        except Exception:
-            # Se alguma tabela não existir ainda, continua com a população (create_all já foi chamada acima)
-            totais = { 'categorias': 0, 'empresas': 0, 'produtos': 0, 'mesas': 0, 'usuarios': 0 }
-
-        total_registros = sum(totais.values())
-        if total_registros > 0:
-            logger.info('Banco já contém dados; pulando populate. Totais: %s', totais)
-            # Ainda realiza o backfill de slug se necessário
-            try:
-                from backend.models import gerar_slug
-                all_mesas = session.query(Mesa).all()
-                updated = 0
-                for m in all_mesas:
-                    if not getattr(m, 'slug', None):
-                        m.slug = gerar_slug(m.nome)
-                        session.add(m)
-                        updated += 1
-                if updated > 0:
-                    session.commit()
-                    logger.info(f'Backfill: slugs gerados para {updated} mesas')
-            except Exception as e:
-                session.rollback()
-                logger.exception('Erro no backfill de slug: %s', e)
+        # (EXISTS por tabela, parando na primeira com dados, em vez de COUNT(*) em todas)
+        tem_dados = any(
+            session.query(modelo.id).limit(1).first() is not None
+            for modelo in (Categoria, Empresa, Produto, Mesa, User)
+        )
+        if tem_dados:
+            logger.info('Banco já contém dados; pulando populate.')
+            backfill_slugs_mesas(session)
+            return False
+        popular_padrao(session)
+        return True
+
+
+def popular_padrao(session) -> Optional[int]:
+    """Carga padrão (idempotente). Retorna o id do usuário admin."""
+    create_categories(session)
+    create_empresas(session)
+    # cria/garante o usuário admin e obtém o id no mesmo contexto da sessão
+    usuario_id = create_user_admin(session)
+    # cria os usuários físicos e online solicitados
+    created_user_ids = create_users_custom(session)
+    # se não obteve um usuario_id admin, usa o primeiro criado como fallback
+    if not usuario_id and created_user_ids:
+        usuario_id = created_user_ids[0]
+    create_produtos(session, usuario_id)
+    create_mesas(session, usuario_id)
+    backfill_slugs_mesas(session)
+    return usuario_id
+
+
+# ----- Modo gerador (bancos grandes para benchmark/carga) -----
+ESTILOS_GERADOS = ['Pilsen', 'IPA', 'APA', 'Weiss', 'Stout', 'Porter', 'Lager', 'Red Ale', 'Sour', 'Tripel']
+ADJETIVOS_GERADOS = ['da Casa', 'Especial', 'Artesanal', 'do Morro', 'Reserva', 'Clássica', 'Tropical', 'Imperial']
+METODOS_PAGAMENTO = ['dinheiro', 'pix', 'cartao_credito', 'cartao_debito']
+PREFIXO_GERADO = 'GEN'
+SENHA_GERADA = 'gerado123'
+
+
+def _gerar_usuarios(session, rnd: random.Random, n: int) -> List[int]:
+    senha = senhas.gerar_hash(SENHA_GERADA)
+    linhas = [
+        {'username': f'gen{i:07d}', 'email': f'gen{i:07d}@exemplo.gen', 'nome': f'Cliente {i}', 'password': senha,
+         'tipo': UserType.fisica if rnd.random() < 0.05 else UserType.online}
+        for i in range(1, n + 1)
+    ]
+    inserir_ignorando(session, User, linhas, chave=['username'])
+    session.commit()
+    return list(session.execute(select(User.id).where(User.email.like('%@exemplo.gen')).order_by(User.id)).scalars())
+
+
+def _gerar_produtos(session, rnd: random.Random, n: int) -> Dict[int, tuple]:
+    categorias = list(_ids_por(session, Categoria.nome).values())
+    empresas = list(_ids_por(session, Empresa.nome).values())
+    linhas = []
+    for i in range(1, n + 1):
+        estilo = rnd.choice(ESTILOS_GERADOS)
+        custo = Decimal(rnd.randint(300, 6000)) / 100
+        linhas.append({
+            'nome': f'{estilo} {rnd.choice(ADJETIVOS_GERADOS)} {i}', 'categoria_id': rnd.choice(categorias),
+            'empresa_id': rnd.choice(empresas), 'descricao': f'Produto gerado {i} ({estilo})',
+            'custo': custo, 'venda': (custo * Decimal('1.6')).quantize(Decimal('0.01')),
+            'codigo': f'{PREFIXO_GERADO}-{i:07d}', 'slug': f'gen-{i:07d}', 'estoque': 0,
+            'disponivel': rnd.random() < 0.95, 'style': estilo, 'abv': f'{rnd.uniform(3.5, 11):.1f}',
+            'ibu': rnd.randint(8, 90),
+        })
+    novos = inserir_ignorando(session, Produto, linhas, chave=['codigo'], retornando=['id'])
+    _indexar_busca(session, [r.id for r in novos])
+    session.commit()
+    return {pid: (nome, venda) for pid, nome, venda in session.execute(
+        select(Produto.id, Produto.nome, Produto.venda).where(Produto.codigo.like(f'{PREFIXO_GERADO}-%')).order_by(Produto.id)
+    )}
+
+
+def _gerar_mesas(session, n: int) -> List[int]:
+    inserir_ignorando(session, Mesa, [
+        {'nome': f'G{i:04d}', 'slug': f'gen-mesa-{i:04d}', 'status': 'Livre', 'capacidade': 4, 'observacoes': ''}
+        for i in range(1, n + 1)
+    ], chave=['slug'])
+    session.commit()
+    return list(session.execute(select(Mesa.id).where(Mesa.slug.like('gen-mesa-%')).order_by(Mesa.id)).scalars())
+
+
+class _Historico:
+    """Acumula pedidos/itens/pagamentos/movimentações e grava em lotes na mesma transação."""
+
+    def __init__(self, session, usuario_id: int):
+        self.session = session
+        self.usuario_id = usuario_id
+        self.pedidos: List[Dict[str, Any]] = []
+        self.itens: Dict[str, List[Dict[str, Any]]] = {}
+        self.movimentacoes: List[Dict[str, Any]] = []
+        self.totais = {'pedidos': 0, 'pedido_itens': 0, 'pagamentos': 0, 'movimentacoes_estoque': 0}
+
+    def gravar(self) -> None:
+        if not self.pedidos and not self.movimentacoes:
             return
+        P = Pedido.__table__
+        ids: Dict[str, int] = {}
+        for lote in _lotes(self.pedidos):
+            # sem `sort_by_parameter_order` (no SQLite viraria um INSERT por linha): o número identifica a linha
+            ids.update((r.numero, r.id) for r in self.session.execute(insert(P).returning(P.c.id, P.c.numero), lote))
+        itens = [dict(it, pedido_id=ids[numero]) for numero, lista in self.itens.items() for it in lista]
+        pagamentos = [
+            {'pedido_id': ids[p['numero']], 'metodo': p['metodo_pagamento'], 'valor_total': p['total'],
+             'valor_recebido': p['total'], 'troco': 0, 'status': 'Confirmado', 'created_at': p['created_at'],
+             'updated_at': p['created_at']}
+            for p in self.pedidos if p['status'] == 'Entregue'
+        ]
+        movimentacoes = [
+            dict(m, pedido_id=ids[m['pedido_id']] if m['pedido_id'] else None) for m in self.movimentacoes
+        ]
+        for tabela, linhas in ((PedidoItem, itens), (Pagamento, pagamentos), (MovimentacaoEstoque, movimentacoes)):
+            for lote in _lotes(linhas):
+                self.session.execute(insert(tabela.__table__), lote)
+        self.totais['pedidos'] += len(self.pedidos)
+        self.totais['pedido_itens'] += len(itens)
+        self.totais['pagamentos'] += len(pagamentos)
+        self.totais['movimentacoes_estoque'] += len(movimentacoes)
+        self.pedidos, self.itens, self.movimentacoes = [], {}, []
+
+
+def _gerar_pedidos(
+    session, rnd: random.Random, produtos: Dict[int, tuple], mesas: List[int], usuarios: List[int],
+    meses: int, pedidos_dia: int, usuario_id: int,
+) -> Dict[str, int]:
+    """Pedidos dos últimos `meses`, com itens, pagamentos e as saídas/reposições de estoque, em ordem cronológica."""
+    historico = _Historico(session, usuario_id)
+    estoque = {pid: 0 for pid in produtos}
+    produto_ids = list(produtos)
+
+    def movimentar(produto_id, tipo, origem, quantidade, quando, pedido_numero=None):
+        anterior = estoque[produto_id]
+        estoque[produto_id] = anterior + quantidade if tipo == 'entrada' else anterior - quantidade
+        historico.movimentacoes.append({
+            'produto_id': produto_id, 'tipo': tipo, 'origem': origem, 'quantidade': quantidade,
+            'quantidade_anterior': anterior, 'quantidade_nova': estoque[produto_id], 'usuario_id': usuario_id,
+            'observacoes': None, 'pedido_id': pedido_numero, 'created_at': quando,
+        })
+
+    dias = meses * 30
+    inicio = (datetime.now(timezone.utc) - timedelta(days=dias)).replace(hour=0, minute=0, second=0, microsecond=0)
+    for pid in produto_ids:
+        movimentar(pid, 'entrada', 'compra', rnd.randint(50, 300), inicio)
+
+    seq = 0
+    for dia in range(dias):
+        base = inicio + timedelta(days=dia)
+        # movimento da casa concentrado à noite: 16h-24h
+        horarios = sorted(rnd.randint(16 * 3600, 24 * 3600 - 1) for _ in range(rnd.randint(pedidos_dia // 2, pedidos_dia * 3 // 2)))
+        for segundos in horarios:
+            seq += 1
+            quando = base + timedelta(seconds=segundos)
+            numero = f'{PREFIXO_GERADO}{seq:09d}'
+            na_mesa = mesas and rnd.random() < 0.7
+            cancelado = rnd.random() < 0.03
+            quantidades: Dict[int, int] = {}
+            for pid in rnd.sample(produto_ids, min(len(produto_ids), rnd.randint(1, 5))):
+                quantidades[pid] = rnd.randint(1, 3)
+            itens = [
+                {'produto_id': pid, 'nome': produtos[pid][0], 'quantidade': q, 'preco_unitario': produtos[pid][1],
+                 'subtotal': produtos[pid][1] * q}
+                for pid, q in quantidades.items()
+            ]
+            total = sum(it['subtotal'] for it in itens)
+            historico.pedidos.append({
+                'tipo': 'fisica' if na_mesa else 'online', 'numero': numero,
+                'status': 'Cancelado' if cancelado else 'Entregue', 'metodo_pagamento': rnd.choice(METODOS_PAGAMENTO),
+                'subtotal': total, 'desconto': 0, 'total': total,
+                'mesa_id': rnd.choice(mesas) if na_mesa else None,
+                'user_id': None if na_mesa or not usuarios else rnd.choice(usuarios),
+                'atendente_id': usuario_id if na_mesa else None, 'nome_cliente': None, 'observacoes': None,
+                'created_at': quando, 'updated_at': quando,
+            })
+            historico.itens[numero] = itens
+            if not cancelado:
+                for pid, q in quantidades.items():
+                    if estoque[pid] < q:
+                        movimentar(pid, 'entrada', 'compra', rnd.randint(50, 300) + q, quando)
+                    movimentar(pid, 'saida', 'venda_fisica' if na_mesa else 'venda_online', q, quando, numero)
+            if len(historico.pedidos) >= LOTE:
+                historico.gravar()
+    historico.gravar()
+    _atualizar_estoques(session, estoque)
+    return historico.totais
+
+
+def gerar(
+    produtos: int = 1000,
+    mesas: int = 40,
+    usuarios: int = 5000,
+    meses: int = 6,
+    pedidos_dia: int = 300,
+    semente: int = 42,
+) -> Dict[str, int]:
+    """Gera um banco sintético e determinístico (mesma `semente` = mesmos dados).
+
+    Produtos, mesas e usuários gerados são idempotentes (códigos/slugs fixos); o
+    histórico de pedidos só é gerado se ainda não existir pedido gerado.
+    """
+    rnd = random.Random(semente)
+    inicio = time.perf_counter()
+    with Session() as session:
+        usuario_id = popular_padrao(session) or 1
+        usuario_ids = _gerar_usuarios(session, rnd, usuarios)
+        produtos_venda = _gerar_produtos(session, rnd, produtos)
+        mesa_ids = _gerar_mesas(session, mesas)
+        totais = {'usuarios': len(usuario_ids), 'produtos': len(produtos_venda), 'mesas': len(mesa_ids)}
+        if session.execute(select(Pedido.id).where(Pedido.numero.like(f'{PREFIXO_GERADO}%')).limit(1)).first():
+            logger.info('Histórico de pedidos gerado já existe; pulando pedidos/movimentações')
+        elif produtos_venda:
+            totais.update(_gerar_pedidos(session, rnd, produtos_venda, mesa_ids, usuario_ids, meses, pedidos_dia, usuario_id))
+            session.commit()
+    logger.info('Banco gerado em %.1f s: %s', time.perf_counter() - inicio, totais)
+    return totais
+
+
+def _argumentos(argv=None):
+    parser = argparse.ArgumentParser(description='Popula o banco (carga padrão ou gerador de dados sintéticos).')
+    parser.add_argument('--gerar', action='store_true', help='gera dados sintéticos além da carga padrão')
+    parser.add_argument('--produtos', type=int, default=1000)
+    parser.add_argument('--mesas', type=int, default=40)
+    parser.add_argument('--usuarios', type=int, default=5000)
+    parser.add_argument('--meses', type=int, default=6)
+    parser.add_argument('--pedidos-dia', type=int, default=300)
+    parser.add_argument('--semente', type=int, default=42)
+    return parser.parse_args(argv)
 
-        # Sem registros: executa a população idempotente
-        create_categories(session)
-        create_empresas(session)
-        # cria/garante o usuário admin e obtém o id no mesmo contexto da sessão
-        usuario_id = create_user_admin(session)
-        # cria os usuários físicos e online solicitados
-        created_user_ids = create_users_custom(session)
-        # se não obteve um usuario_id admin, usa o primeiro criado como fallback
-        if not usuario_id and created_user_ids:
-            usuario_id = created_user_ids[0]
-        create_produtos(session, usuario_id)
-        create_mesas(session, usuario_id)
-        # Backfill: garantir que todas as mesas tenham slug (usa gerar_slug do modelo)
-        try:
-            from backend.models import gerar_slug
-            all_mesas = session.query(Mesa).all()
-            updated = 0
-            for m in all_mesas:
-                if not getattr(m, 'slug', None):
-                    m.slug = gerar_slug(m.nome)
-                    session.add(m)
-                    updated += 1
-            if updated > 0:
-                session.commit()
-                logger.info(f'Backfill: slugs gerados para {updated} mesas')
-        except Exception as e:
-            session.rollback()
-            logger.exception('Erro no backfill de slug: %s', e)
 
 if __name__ == '__main__':
-    main()
+    args = _argumentos()
+    if args.gerar:
+        # tabelas + migrações (índices, busca) antes de gerar volume
+        from backend import inicializacao
+        inicializacao.preparar_schema(db)
+        gerar(args.produtos, args.mesas, args.usuarios, args.meses, args.pedidos_dia, args.semente)
+    else:
+        main()
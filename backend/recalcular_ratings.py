@@ -0,0 +1,35 @@
+"""
+Recalcula os agregados de avaliação dos produtos (quantidade, soma e média).
+
+Normalmente eles são mantidos a cada escrita em /avaliacoes/; use este script
+para reparar divergências (ex: avaliações apagadas direto no banco ou em cascata
+ao excluir um usuário).
+
+    python -m backend.recalcular_ratings            # todos os produtos
+    python -m backend.recalcular_ratings 3 7 12     # apenas os ids informados
+"""
+import sys
+from pathlib import Path
+
+# Adiciona o diretório pai ao path para importar os módulos
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir.parent))
+
+from backend import crud
+from backend.database import Session
+from backend.logging_config import logger
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    produto_ids = [int(x) for x in argv] or None
+    db = Session()
+    try:
+        atualizados = crud.recalcular_ratings(db, produto_ids)
+        logger.info('Agregados de avaliação recalculados para %s produto(s)', atualizados)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
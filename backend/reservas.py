@@ -0,0 +1,272 @@
+"""Reservas de estoque para itens de mesa (`EstoqueReserva`).
+
+O estoque só é baixado no pagamento (`backend.checkout`); sem reserva, duas mesas
+podiam pedir o último barril. Agora:
+
+- incluir item na mesa reserva a quantidade numa única instrução (INSERT ... SELECT
+  condicionado a `estoque - reservas ativas >= quantidade`), com a linha do produto
+  travada antes (`FOR UPDATE` onde o banco suporta). Sem saldo, `EstoqueInsuficiente`;
+- o pagamento converte as reservas do pedido (`convertida`) na mesma transação das
+  saídas de estoque;
+- remover o item ou cancelar o pedido libera as reservas (`liberada`);
+- a tarefa periódica `reservas_expirar` marca como `expirada`, em lotes, as reservas
+  vencidas (índice `(status, expira_em)`). Reservas vencidas já deixam de contar no
+  disponível mesmo antes da varredura.
+
+O disponível para venda (`estoque - reservas ativas`) fica em cache por produto por
+`RESERVAS_CACHE_SEGUNDOS`; commits que mexem em reservas ou no estoque invalidam os
+produtos afetados.
+
+`RESERVAS_MODO`: 'bloquear' (padrão, recusa sem saldo), 'registrar' (reserva mesmo
+sem saldo, só para acompanhamento) ou 'desligado'.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import Session as SessionLocal
+from backend.logging_config import logger
+
+RESERVAS_MODO = os.environ.get('RESERVAS_MODO', 'bloquear').lower()
+RESERVAS_TTL_MINUTOS = float(os.environ.get('RESERVAS_TTL_MINUTOS', '240'))
+RESERVAS_VARREDURA_SEGUNDOS = float(os.environ.get('RESERVAS_VARREDURA_SEGUNDOS', '60'))
+RESERVAS_VARREDURA_LOTE = int(os.environ.get('RESERVAS_VARREDURA_LOTE', '500'))
+RESERVAS_CACHE_SEGUNDOS = float(os.environ.get('RESERVAS_CACHE_SEGUNDOS', '2'))
+
+ATIVA = 'ativa'
+CONVERTIDA = 'convertida'
+LIBERADA = 'liberada'
+EXPIRADA = 'expirada'
+
+R = models.EstoqueReserva
+
+
+class EstoqueInsuficiente(Exception):
+    def __init__(self, produto_id: int, solicitado: int, disponivel: int):
+        self.produto_id = produto_id
+        self.solicitado = solicitado
+        self.disponivel = disponivel
+        super().__init__(f'Estoque insuficiente para o produto {produto_id}: solicitado {solicitado}, disponível {disponivel}')
+
+
+def _agora() -> datetime:
+    # gravado em UTC sem fuso, como os demais DateTime no SQLite
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ----- Cache do disponível -----
+class CacheDisponivel:
+    def __init__(self, ttl: float = RESERVAS_CACHE_SEGUNDOS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entradas: Dict[int, Tuple[float, int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, produto_id: int) -> Optional[int]:
+        with self._lock:
+            entrada = self._entradas.get(produto_id)
+            if entrada is None or entrada[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entrada[1]
+
+    def guardar(self, valores: Dict[int, int]) -> None:
+        if self.ttl <= 0:
+            return
+        expira = time.monotonic() + self.ttl
+        with self._lock:
+            for produto_id, valor in valores.items():
+                self._entradas[produto_id] = (expira, valor)
+
+    def invalidar(self, produto_ids: Optional[Iterable[int]] = None) -> None:
+        with self._lock:
+            if produto_ids is None:
+                self._entradas.clear()
+                return
+            for produto_id in produto_ids:
+                self._entradas.pop(produto_id, None)
+
+    def estatisticas(self) -> Dict[str, object]:
+        with self._lock:
+            return {'entradas': len(self._entradas), 'ttl_segundos': self.ttl, 'hits': self.hits, 'misses': self.misses}
+
+
+cache_disponivel = CacheDisponivel()
+
+
+def _marcar(db: Session, produto_ids: Iterable[int]) -> None:
+    db.info.setdefault('reservas_produtos', set()).update(produto_ids)
+
+
+def _apos_flush(session, flush_context) -> None:
+    # mudanças de estoque pelo ORM (movimentações, edição do produto)
+    alterados = [o.id for o in session.dirty if isinstance(o, models.Produto)]
+    if alterados:
+        _marcar(session, alterados)
+
+
+def _apos_commit(session) -> None:
+    produtos = session.info.pop('reservas_produtos', None)
+    if produtos:
+        cache_disponivel.invalidar(produtos)
+
+
+def _apos_rollback(session, previous_transaction) -> None:
+    if not session.in_transaction():
+        session.info.pop('reservas_produtos', None)
+
+
+event.listen(SessionLocal, 'after_flush', _apos_flush)
+event.listen(SessionLocal, 'after_commit', _apos_commit)
+event.listen(SessionLocal, 'after_soft_rollback', _apos_rollback)
+
+
+# ----- Disponível para venda -----
+def _reservado(produto_ids: List[int], agora: datetime):
+    return (
+        select(R.produto_id, func.sum(R.quantidade).label('reservado'))
+        .where(R.produto_id.in_(produto_ids), R.status == ATIVA, R.expira_em > agora)
+        .group_by(R.produto_id)
+        .subquery()
+    )
+
+
+def disponiveis(db: Session, produto_ids: Iterable[int]) -> Dict[int, int]:
+    """Disponível para venda (estoque - reservas ativas, mínimo 0) dos produtos existentes em `produto_ids`."""
+    resultado: Dict[int, int] = {}
+    faltando = []
+    for produto_id in dict.fromkeys(produto_ids):
+        valor = cache_disponivel.obter(produto_id)
+        if valor is None:
+            faltando.append(produto_id)
+        else:
+            resultado[produto_id] = valor
+    if faltando:
+        sub = _reservado(faltando, _agora())
+        rows = db.execute(
+            select(models.Produto.id, func.coalesce(models.Produto.estoque, 0) - func.coalesce(sub.c.reservado, 0))
+            .outerjoin(sub, sub.c.produto_id == models.Produto.id)
+            .where(models.Produto.id.in_(faltando))
+        ).all()
+        calculados = {produto_id: max(int(valor), 0) for produto_id, valor in rows}
+        cache_disponivel.guardar(calculados)
+        resultado.update(calculados)
+    return resultado
+
+
+def disponivel(db: Session, produto_id: int) -> Optional[int]:
+    return disponiveis(db, [produto_id]).get(produto_id)
+
+
+# ----- Ciclo de vida -----
+def reservar(
+    db: Session,
+    produto_id: int,
+    quantidade: int,
+    mesa_id: int,
+    usuario_id: int,
+    pedido_id: Optional[int] = None,
+    pedido_item_id: Optional[int] = None,
+    permitir_excedente: bool = False,
+) -> bool:
+    """Reserva `quantidade` do produto (sem commit). Levanta `EstoqueInsuficiente` sem saldo no modo 'bloquear'."""
+    if RESERVAS_MODO == 'desligado' or quantidade <= 0:
+        return False
+    agora = _agora()
+    valores = {
+        'produto_id': produto_id,
+        'quantidade': int(quantidade),
+        'mesa_id': mesa_id,
+        'usuario_id': usuario_id or 1,
+        'status': ATIVA,
+        'expira_em': agora + timedelta(minutes=RESERVAS_TTL_MINUTOS),
+        'pedido_id': pedido_id,
+        'pedido_item_id': pedido_item_id,
+        'created_at': agora,
+        'updated_at': agora,
+    }
+    _marcar(db, [produto_id])
+    if permitir_excedente or RESERVAS_MODO != 'bloquear':
+        db.execute(insert(R).values(**valores))
+        return True
+
+    # PostgreSQL: trava o produto; no SQLite o próprio INSERT ... SELECT é atômico
+    db.execute(select(models.Produto.id).where(models.Produto.id == produto_id).with_for_update())
+    estoque = select(func.coalesce(models.Produto.estoque, 0)).where(models.Produto.id == produto_id).scalar_subquery()
+    reservado = (
+        select(func.coalesce(func.sum(R.quantidade), 0))
+        .where(R.produto_id == produto_id, R.status == ATIVA, R.expira_em > agora)
+        .scalar_subquery()
+    )
+    colunas = list(valores)
+    origem = select(*[literal(valores[c], type_=R.__table__.c[c].type) for c in colunas]).where(estoque - reservado >= int(quantidade))
+    if db.execute(insert(R).from_select(colunas, origem)).rowcount == 0:
+        cache_disponivel.invalidar([produto_id])
+        raise EstoqueInsuficiente(produto_id, int(quantidade), disponivel(db, produto_id) or 0)
+    return True
+
+
+def _mudar_status(db: Session, filtro, de: Tuple[str, ...], para: str) -> int:
+    produto_ids = db.scalars(select(R.produto_id).where(filtro, R.status.in_(de)).distinct()).all()
+    if not produto_ids:
+        return 0
+    _marcar(db, produto_ids)
+    resultado = db.execute(
+        update(R).where(filtro, R.status.in_(de)).values(status=para, updated_at=_agora())
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+
+def liberar_item(db: Session, pedido_item_id: int) -> int:
+    """Libera a reserva do item removido (sem commit)."""
+    return _mudar_status(db, R.pedido_item_id == pedido_item_id, (ATIVA,), LIBERADA)
+
+
+def liberar_pedido(db: Session, pedido_id: int) -> int:
+    """Libera as reservas do pedido cancelado (sem commit) e desvincula do pedido, que será apagado."""
+    liberadas = _mudar_status(db, R.pedido_id == pedido_id, (ATIVA,), LIBERADA)
+    db.execute(
+        update(R).where(R.pedido_id == pedido_id).values(pedido_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    return liberadas
+
+
+def converter_pedido(db: Session, pedido_id: int) -> int:
+    """Marca as reservas do pedido pago como convertidas (sem commit; a baixa é feita pelo checkout)."""
+    return _mudar_status(db, R.pedido_id == pedido_id, (ATIVA, EXPIRADA), CONVERTIDA)
+
+
+def expirar_vencidas(db: Session, lote: int = RESERVAS_VARREDURA_LOTE) -> int:
+    """Marca as reservas ativas vencidas como expiradas, `lote` por commit."""
+    total = 0
+    while True:
+        agora = _agora()
+        ids = db.scalars(
+            select(R.id).where(R.status == ATIVA, R.expira_em <= agora).order_by(R.expira_em).limit(lote)
+        ).all()
+        if not ids:
+            db.rollback()
+            break
+        total += _mudar_status(db, R.id.in_(ids), (ATIVA,), EXPIRADA)
+        db.commit()
+        if len(ids) < lote:
+            break
+    if total:
+        logger.info('%s reservas de estoque expiradas', total)
+    return total
+
+
+def tarefa_expirar() -> int:
+    """Entrada usada por `backend.tarefas` (sessão própria)."""
+    with SessionLocal() as db:
+        return expirar_vencidas(db)
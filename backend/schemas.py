@@ -69,6 +69,8 @@ class ProdutoCreate(BaseModel):
 
 class ProdutoOut(ProdutoCreate):
     id: int
+    rating: Optional[float] = 0
+    avaliacoes_quantidade: Optional[int] = 0
 
     class Config:
         orm_mode = True
@@ -113,6 +115,31 @@ class PedidoCreate(BaseModel):
     mesa_id: Optional[int] = None
     observacoes: Optional[str] = ''
 
+    @classmethod
+    def do_frontend(cls, payload: dict) -> 'PedidoCreate':
+        """Normaliza o pedido no formato enviado pelo frontend (itens com `id`/`venda`, camelCase)."""
+        itens_in = []
+        for it in payload.get('itens', []) or []:
+            produto_id = it.get('produto_id') if it.get('produto_id') is not None else it.get('id')
+            preco_unitario = it.get('preco_unitario') if it.get('preco_unitario') is not None else it.get('venda') if it.get('venda') is not None else it.get('preco')
+            itens_in.append({
+                'produto_id': produto_id,
+                'nome': it.get('nome') or '',
+                'quantidade': int(it.get('quantidade') or 0),
+                'preco_unitario': preco_unitario
+            })
+
+        return cls(
+            tipo=payload.get('tipo') or payload.get('metodoPagamento') or 'online',
+            user_id=payload.get('user_id') or payload.get('userId') or None,
+            numero=payload.get('numero') or payload.get('numeroPedido') or None,
+            metodo_pagamento=payload.get('metodoPagamento') or payload.get('metodo_pagamento'),
+            itens=[PedidoItemCreate(**it) for it in itens_in],
+            nome_cliente=payload.get('nome') or payload.get('nome_cliente'),
+            mesa_id=payload.get('mesa_id') if payload.get('mesa_id') else None,
+            observacoes=payload.get('observacoes') or ''
+        )
+
 
 class PedidoItemOut(PedidoItemCreate):
     id: int
@@ -0,0 +1,160 @@
+"""Hash e verificação de senhas (bcrypt) fora das threads de request.
+
+Cada bcrypt com custo 12 consome ~250 ms de CPU. Rodando direto nas threads do
+FastAPI, uma rajada de logins na abertura da casa ocupa todas as threads e o
+resto da API (mesas, pedidos) fica esperando. Aqui o trabalho vai para um pool
+de processos dedicado e limitado:
+
+- `SENHAS_PROCESSOS` processos (padrão: metade das CPUs, mínimo 1); `0` executa
+  na própria thread.
+- O pool só é usado depois de `pool.iniciar()` (startup da API). Scripts avulsos
+  (populate, fix_passwords) fazem o hash na própria thread: processos `spawn`
+  reimportam o módulo principal, o que reexecutaria scripts sem guarda `__main__`.
+- `SENHAS_FILA_MAX` operações em andamento (executando + na fila). Acima disso
+  `SobrecargaSenhas` é levantada e a API responde 503 com `Retry-After`. O padrão
+  (metade do menor entre as 40 threads do anyio e as conexões do pool do banco) deixa
+  threads e conexões livres para o resto da API durante uma rajada de logins.
+- `BCRYPT_ROUNDS` define o custo de novos hashes (padrão 12). Hashes com custo
+  diferente são refeitos de forma transparente no próximo login (`precisa_rehash`).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import bcrypt
+
+from backend.database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+from backend.logging_config import logger
+
+# limite padrão de threads do anyio (threadpool dos endpoints síncronos)
+THREADS_ANYIO = 40
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+SENHAS_PROCESSOS = int(os.environ.get('SENHAS_PROCESSOS', str(max((os.cpu_count() or 2) // 2, 1))))
+SENHAS_FILA_MAX = int(os.environ.get('SENHAS_FILA_MAX', str(max(min(THREADS_ANYIO, DB_POOL_SIZE + DB_MAX_OVERFLOW) // 2, 1))))
+SENHAS_TIMEOUT_SEGUNDOS = float(os.environ.get('SENHAS_TIMEOUT_SEGUNDOS', '10'))
+
+
+class SobrecargaSenhas(Exception):
+    """Fila de hash de senhas cheia (ou operação demorou demais): tentar novamente depois."""
+
+
+# ----- Funções executadas nos processos do pool (precisam ser top-level) -----
+def _gerar_hash(senha: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(senha, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _verificar(senha: bytes, hash_armazenado: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(senha, hash_armazenado)
+    except ValueError:
+        # hash inválido/corrompido no banco
+        return False
+
+
+def _bytes(valor) -> bytes:
+    return valor.encode('utf-8') if isinstance(valor, str) else valor
+
+
+class PoolSenhas:
+    def __init__(self, processos: int = SENHAS_PROCESSOS, fila_max: int = SENHAS_FILA_MAX, timeout: float = SENHAS_TIMEOUT_SEGUNDOS):
+        self.processos = processos
+        self.fila_max = fila_max
+        self.timeout = timeout
+        self._vagas = threading.BoundedSemaphore(max(fila_max, 1))
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.ativo = False
+        self.recusadas = 0
+        self.executadas = 0
+
+    def _obter_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: não herdar conexões do banco e threads do processo da API
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processos, mp_context=multiprocessing.get_context('spawn')
+                )
+                logger.info('Pool de senhas iniciado com %s processo(s)', self.processos)
+            return self._executor
+
+    def iniciar(self) -> None:
+        """Habilita o pool (os processos são criados na primeira operação)."""
+        self.ativo = self.processos > 0
+
+    def executar(self, funcao, *args):
+        if not self.ativo:
+            return funcao(*args)
+        if not self._vagas.acquire(blocking=False):
+            with self._lock:
+                self.recusadas += 1
+            raise SobrecargaSenhas('Muitas operações de senha em andamento')
+        try:
+            futuro = self._obter_executor().submit(funcao, *args)
+            try:
+                resultado = futuro.result(timeout=self.timeout)
+            except FuturesTimeout:
+                futuro.cancel()
+                raise SobrecargaSenhas('Tempo esgotado aguardando o pool de senhas')
+            except BrokenProcessPool:
+                # Processo do pool morreu: recriar na próxima chamada e não perder esta operação
+                logger.exception('Pool de senhas quebrado; executando na thread atual')
+                self._descartar_executor()
+                resultado = funcao(*args)
+            with self._lock:
+                self.executadas += 1
+            return resultado
+        finally:
+            self._vagas.release()
+
+    def _descartar_executor(self) -> None:
+        """Encerra os processos; a próxima operação recria o pool se ele continuar ativo."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def encerrar(self) -> None:
+        """Desabilita o pool (operações seguintes rodam na própria thread) e encerra os processos."""
+        self.ativo = False
+        self._descartar_executor()
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                'processos': self.processos,
+                'ativo': self.ativo,
+                'fila_max': self.fila_max,
+                'executadas': self.executadas,
+                'recusadas': self.recusadas,
+                'bcrypt_rounds': BCRYPT_ROUNDS,
+            }
+
+
+pool = PoolSenhas()
+
+
+def gerar_hash(senha) -> str:
+    """Gera o hash bcrypt de `senha` com o custo `BCRYPT_ROUNDS`."""
+    return pool.executar(_gerar_hash, _bytes(senha), BCRYPT_ROUNDS)
+
+
+def verificar(senha, hash_armazenado: Optional[str]) -> bool:
+    if not hash_armazenado:
+        return False
+    return pool.executar(_verificar, _bytes(senha), _bytes(hash_armazenado))
+
+
+def custo_do_hash(hash_armazenado: Optional[str]) -> Optional[int]:
+    """Extrai o custo de um hash '$2b$12$...' (None se o formato for desconhecido)."""
+    partes = (hash_armazenado or '').split('$')
+    if len(partes) >= 4 and partes[2].isdigit():
+        return int(partes[2])
+    return None
+
+
+def precisa_rehash(hash_armazenado: Optional[str]) -> bool:
+    return custo_do_hash(hash_armazenado) != BCRYPT_ROUNDS
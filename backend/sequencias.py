@@ -0,0 +1,195 @@
+"""Subsistema de sequências (contadores nomeados).
+
+Gera números sequenciais (ex: `Pedido.numero`) em tempo constante usando a
+tabela `contadores`, em vez de carregar todos os pedidos e procurar o maior
+número em Python. O incremento é um único UPDATE atômico na linha do escopo,
+então aberturas de mesa concorrentes nunca recebem o mesmo número.
+
+Escopos de número de pedido (variável de ambiente `PEDIDO_NUMERO_MODO`):
+- 'global' (padrão): numeração contínua '01', '02', ... (compatível com os dados atuais)
+- 'diario': numeração reinicia a cada dia (UTC), formato 'AAAAMMDD-01'
+
+Outros módulos podem usar `proximo_valor` com qualquer escopo (ex: 'pedido:empresa:3').
+
+Backfill (uma vez, após atualizar um banco existente):
+    python -m backend.sequencias
+"""
+import os
+import re
+import sys
+import pathlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import insert_dialeto
+from backend.logging_config import logger
+
+ESCOPO_PEDIDO = 'pedido'
+PEDIDO_NUMERO_MODO = os.environ.get('PEDIDO_NUMERO_MODO', 'global').lower()
+
+_RE_NUMERO_DIARIO = re.compile(r'^(\d{8})-(\d+)$')
+_RE_DIGITOS = re.compile(r'(\d+)')
+
+
+def _incrementar(db: Session, escopo: str) -> int:
+    resultado = db.execute(
+        update(models.Contador)
+        .where(models.Contador.escopo == escopo)
+        .values(valor=models.Contador.valor + 1, updated_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return resultado.rowcount
+
+
+def _criar_se_ausente(db: Session, escopo: str, valor: int) -> None:
+    """Cria a linha do contador; ignora se outra transação já a criou."""
+    stmt = insert_dialeto(db, models.Contador.__table__)
+    if stmt is not None:
+        db.execute(stmt.values(escopo=escopo, valor=valor).on_conflict_do_nothing(index_elements=['escopo']))
+        return
+    if db.get(models.Contador, escopo) is None:
+        db.add(models.Contador(escopo=escopo, valor=valor))
+        db.flush()
+
+
+def valor_atual(db: Session, escopo: str) -> int:
+    """Retorna o último valor entregue pelo contador (0 se ainda não existir)."""
+    valor = db.execute(select(models.Contador.valor).where(models.Contador.escopo == escopo)).scalar()
+    return int(valor or 0)
+
+
+def proximo_valor(db: Session, escopo: str, semente: Optional[Callable[[], int]] = None) -> int:
+    """Incrementa e retorna o próximo valor do contador `escopo`.
+
+    Deve ser chamada dentro da transação que usa o número: se ela for revertida
+    o valor é descartado (pode haver lacunas, nunca repetições). `semente` é
+    chamada apenas na primeira vez que o escopo é usado, para iniciar o contador
+    a partir dos dados existentes.
+    """
+    if _incrementar(db, escopo) == 0:
+        inicial = int(semente()) if semente else 0
+        _criar_se_ausente(db, escopo, inicial)
+        _incrementar(db, escopo)
+    return valor_atual(db, escopo)
+
+
+def garantir_minimo(db: Session, escopo: str, valor: int) -> None:
+    """Garante que o contador seja >= `valor` (ex: número sugerido pelo cliente offline)."""
+    if int(valor) <= 0:
+        return
+    _criar_se_ausente(db, escopo, 0)
+    db.execute(
+        update(models.Contador)
+        .where(models.Contador.escopo == escopo)
+        .values(valor=case((models.Contador.valor < int(valor), int(valor)), else_=models.Contador.valor))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# ----------------- Número de pedido -----------------
+def _escopo_e_prefixo_pedido(agora: Optional[datetime] = None):
+    if PEDIDO_NUMERO_MODO == 'diario':
+        dia = (agora or datetime.now(timezone.utc)).strftime('%Y%m%d')
+        return f'{ESCOPO_PEDIDO}:{dia}', f'{dia}-'
+    return ESCOPO_PEDIDO, ''
+
+
+def _maiores_numeros_existentes(db: Session) -> Dict[str, int]:
+    """Varre `pedidos.numero` uma única vez e retorna o maior número por escopo.
+
+    Usado apenas para semear/backfill dos contadores; o caminho quente nunca
+    chama esta função depois que o contador existe.
+    """
+    maiores: Dict[str, int] = {}
+    for (raw,) in db.query(models.Pedido.numero).yield_per(1000):
+        if not raw:
+            continue
+        s = str(raw)
+        m = _RE_NUMERO_DIARIO.match(s)
+        if m:
+            escopo, v = f'{ESCOPO_PEDIDO}:{m.group(1)}', int(m.group(2))
+        else:
+            m = _RE_DIGITOS.search(s)
+            if not m:
+                continue
+            escopo, v = ESCOPO_PEDIDO, int(m.group(1))
+        if v > maiores.get(escopo, 0):
+            maiores[escopo] = v
+    return maiores
+
+
+def _maior_numero_com_prefixo(db: Session, prefixo: str) -> int:
+    """Maior número já gravado com `prefixo` ('AAAAMMDD-').
+
+    Faixa `prefixo <= numero < prefixo trocando '-' por '.'` (o caractere seguinte),
+    resolvida pelo índice único de `pedidos.numero`: lê só os pedidos do dia, não a
+    tabela inteira.
+    """
+    fim = prefixo[:-1] + chr(ord(prefixo[-1]) + 1)
+    maior = 0
+    for (raw,) in db.execute(
+        select(models.Pedido.numero).where(models.Pedido.numero >= prefixo, models.Pedido.numero < fim)
+    ):
+        m = _RE_NUMERO_DIARIO.match(str(raw))
+        if m and int(m.group(2)) > maior:
+            maior = int(m.group(2))
+    return maior
+
+
+def proximo_numero_pedido(db: Session) -> str:
+    """Retorna o próximo `Pedido.numero` no escopo configurado."""
+    escopo, prefixo = _escopo_e_prefixo_pedido()
+    if prefixo:
+        # escopo diário: a semente (1º pedido do dia) olha só o prefixo do dia
+        semente = lambda: _maior_numero_com_prefixo(db, prefixo)
+    else:
+        semente = lambda: _maiores_numeros_existentes(db).get(escopo, 0)
+    valor = proximo_valor(db, escopo, semente=semente)
+    return f'{prefixo}{str(valor).zfill(2)}'
+
+
+def registrar_numero_pedido(db: Session, numero: str) -> None:
+    """Avança o contador se um número foi escolhido fora dele (ex: sugerido offline).
+
+    Evita que o contador gere depois um número que já existe.
+    """
+    s = str(numero or '')
+    m = _RE_NUMERO_DIARIO.match(s)
+    if m:
+        garantir_minimo(db, f'{ESCOPO_PEDIDO}:{m.group(1)}', int(m.group(2)))
+        return
+    m = _RE_DIGITOS.search(s)
+    if m:
+        garantir_minimo(db, ESCOPO_PEDIDO, int(m.group(1)))
+
+
+def backfill_contadores(db: Session) -> Dict[str, int]:
+    """Semeia/ajusta os contadores de pedido a partir dos números já gravados.
+
+    Idempotente: nunca diminui um contador. Retorna {escopo: maior número encontrado}.
+    """
+    maiores = _maiores_numeros_existentes(db)
+    for escopo, valor in maiores.items():
+        garantir_minimo(db, escopo, valor)
+    db.commit()
+    logger.info('Backfill de contadores concluído: %s escopos', len(maiores))
+    return maiores
+
+
+if __name__ == '__main__':
+    from backend.database import Session as SessionLocal, Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as session:
+        resultado = backfill_contadores(session)
+        for esc, val in sorted(resultado.items()):
+            logger.info('%s -> %s', esc, val)
@@ -0,0 +1,306 @@
+"""Sincronização em lote do modo offline (`POST /sync/batch`).
+
+Ao reconectar, o frontend envia numa única requisição a fila de alterações feitas
+offline (ver MODO_OFFLINE.md), em vez de centenas de POSTs:
+
+    {"operacoes": [{"id": "<uuid do cliente>", "tipo": "mesa.item_adicionar", "dados": {...}}, ...],
+     "parar_no_erro": false}
+
+- As operações são aplicadas na ordem recebida, em blocos de `SYNC_LOTE_TAMANHO` por
+  transação. Cada operação roda num SAVEPOINT: uma falha desfaz só a operação.
+- Os `crud.*` chamados fazem `commit()`; dentro do bloco a sessão (`SessaoLote`)
+  troca esse commit por um flush e confirma tudo uma vez no fim do bloco. Os
+  listeners de `after_commit` (eventos, caches) disparam só nesse commit real, e o
+  estado que eles acumulam em `session.info` é restaurado quando uma operação falha.
+- Dono da fila: usuário do token ou, sem login, a sessão anônima do carrinho (cookie). Favoritos e avaliações exigem usuário; `carrinho.definir`
+  aceita a sessão. Operações de salão/estoque seguem os endpoints de mesa (usuário 1
+  como operador quando não há login).
+- Uma falha no bloco inteiro (ex.: "database is locked" no BEGIN) devolve `erro` para
+  todas as operações do bloco: nenhuma operação fica sem resultado.
+- O `id` de cada operação aplicada é gravado em `sync_operacoes` na mesma transação;
+  reenviar a mesma operação devolve o resultado gravado (`duplicada`). Os registros
+  são apagados após `SYNC_RETENCAO_DIAS` pela tarefa `sync_purgar`.
+"""
+import copy
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from backend import crud, models, schemas
+from backend.database import Session as SessionLocal
+from backend.logging_config import logger
+
+SYNC_LOTE_TAMANHO = int(os.environ.get('SYNC_LOTE_TAMANHO', '50'))
+SYNC_MAX_OPERACOES = int(os.environ.get('SYNC_MAX_OPERACOES', '1000'))
+SYNC_RETENCAO_DIAS = float(os.environ.get('SYNC_RETENCAO_DIAS', '7'))
+SYNC_LIMPEZA_SEGUNDOS = float(os.environ.get('SYNC_LIMPEZA_SEGUNDOS', '3600'))
+
+APLICADA = 'aplicada'
+DUPLICADA = 'duplicada'
+ERRO = 'erro'
+IGNORADA = 'ignorada'
+
+
+class SessaoLote(SessionLocal.class_):
+    """Sessão em que `commit()` vira flush enquanto `adiar_commit` estiver ligado.
+
+    `rollback()` também é adiado: quem desfaz a operação que falhou é o SAVEPOINT
+    aberto em `aplicar`.
+    """
+    adiar_commit = False
+
+    def commit(self) -> None:
+        if self.adiar_commit:
+            self.flush()
+            return
+        super().commit()
+
+    def rollback(self) -> None:
+        if self.adiar_commit:
+            return
+        super().rollback()
+
+
+@dataclass
+class Dono:
+    """Quem envia a fila: usuário autenticado ou sessão anônima do carrinho."""
+    usuario_id: Optional[int] = None
+    session_id: Optional[str] = None
+
+    @property
+    def operador_id(self) -> int:
+        # salão/estoque: mesmo padrão dos endpoints de mesa (usuário 1 sem login)
+        return self.usuario_id or 1
+
+    def usuario(self) -> int:
+        if not self.usuario_id:
+            raise PermissionError('operação exige usuário autenticado')
+        return self.usuario_id
+
+
+# ----- Operações -----
+def _int(dados: Dict[str, Any], campo: str) -> int:
+    if dados.get(campo) is None:
+        raise ValueError(f'{campo} é obrigatório')
+    return int(dados[campo])
+
+
+def _preco(dados: Dict[str, Any]) -> Optional[float]:
+    for campo in ('venda', 'preco_unitario', 'preco'):
+        if dados.get(campo) is not None:
+            return float(dados[campo])
+    return None
+
+
+def _mesa_item_adicionar(db, dados, dono: Dono):
+    pedido = crud.add_item_to_pedido(
+        db, _int(dados, 'mesa_id'), _int(dados, 'produto_id'), _int(dados, 'quantidade'),
+        int(dados['usuario_id']) if dados.get('usuario_id') else None, _preco(dados), dados.get('numero'),
+    )
+    return {'pedido_id': pedido.id, 'numero': pedido.numero}
+
+
+def _mesa_item_remover(db, dados, dono: Dono):
+    pedido = crud.remove_item_from_pedido(db, _int(dados, 'item_id'))
+    if pedido is None:
+        raise LookupError('Item não encontrado')
+    return {'pedido_id': pedido.id}
+
+
+def _mesa_cancelar(db, dados, dono: Dono):
+    return {'cancelado': crud.cancel_pedido_por_mesa(db, _int(dados, 'mesa_id'), dono.operador_id)}
+
+
+def _pedido_criar(db, dados, dono: Dono):
+    pedido = crud.create_pedido(db, schemas.PedidoCreate.do_frontend(dados), dados.get('user_id') or dono.operador_id)
+    return {'pedido_id': pedido.id, 'numero': pedido.numero}
+
+
+def _estoque_movimentacao(db, dados, dono: Dono):
+    resultado = crud.create_movimentacoes_estoque_lote(
+        db, [dados], usuario_id=int(dados.get('usuario_id') or dono.operador_id), commit=False
+    )[0]
+    if not resultado['ok']:
+        raise ValueError(resultado['erro'])
+    resultado.pop('indice', None)
+    resultado.pop('ok', None)
+    return resultado
+
+
+def _favorito_adicionar(db, dados, dono: Dono):
+    fav = crud.create_favorito(db, dono.usuario(), _int(dados, 'produto_id'))
+    return {'id': fav.id}
+
+
+def _favorito_remover(db, dados, dono: Dono):
+    return {'removido': crud.remove_favorito(db, dono.usuario(), _int(dados, 'produto_id'))}
+
+
+def _avaliacao_salvar(db, dados, dono: Dono):
+    aval = crud.salvar_avaliacao(db, dono.usuario(), _int(dados, 'produto_id'), _int(dados, 'rating'), dados.get('comentario'))
+    return {'id': aval.id, 'rating': aval.rating}
+
+
+def _avaliacao_remover(db, dados, dono: Dono):
+    return {'removida': crud.delete_avaliacao(db, dono.usuario(), _int(dados, 'produto_id'))}
+
+
+def _carrinho_definir(db, dados, dono: Dono):
+    if not dono.usuario_id and not dono.session_id:
+        raise PermissionError('carrinho exige usuário autenticado ou sessão anônima')
+    itens = [
+        {'produto_id': it.get('produto_id'), 'quantidade': it.get('quantidade'), 'preco_unitario': _preco(it)}
+        for it in dados.get('itens') or []
+    ]
+    if dono.usuario_id:
+        cart = crud.set_cart_contents(db, itens, user_id=dono.usuario_id)
+    else:
+        cart = crud.set_cart_contents(db, itens, session_id=dono.session_id)
+    return {'carrinho_id': cart.id}
+
+
+OPERACOES: Dict[str, Callable[[Any, Dict[str, Any], Dono], Dict[str, Any]]] = {
+    'mesa.item_adicionar': _mesa_item_adicionar,
+    'mesa.item_remover': _mesa_item_remover,
+    'mesa.cancelar': _mesa_cancelar,
+    'pedido.criar': _pedido_criar,
+    'estoque.movimentacao': _estoque_movimentacao,
+    'favorito.adicionar': _favorito_adicionar,
+    'favorito.remover': _favorito_remover,
+    'avaliacao.salvar': _avaliacao_salvar,
+    'avaliacao.remover': _avaliacao_remover,
+    'carrinho.definir': _carrinho_definir,
+}
+
+
+# ----- Aplicação -----
+def _validar(op: Any) -> Optional[str]:
+    if not isinstance(op, dict):
+        return 'operação deve ser um objeto'
+    op_id = op.get('id')
+    if not isinstance(op_id, str) or not op_id or len(op_id) > 64:
+        return 'id deve ser um texto de 1 a 64 caracteres'
+    if not isinstance(op.get('tipo'), str) or op['tipo'] not in OPERACOES:
+        return f"tipo desconhecido: {op.get('tipo')}"
+    if not isinstance(op.get('dados') or {}, dict):
+        return 'dados deve ser um objeto'
+    return None
+
+
+def _ja_aplicadas(db, op_ids: List[str]) -> Dict[str, Any]:
+    S = models.SyncOperacao
+    rows = db.execute(select(S.op_id, S.resultado).where(S.op_id.in_(op_ids))).all()
+    return {op_id: json.loads(resultado) if resultado else None for op_id, resultado in rows}
+
+
+def _aplicar_uma(db: SessaoLote, op: Dict[str, Any], dono: Dono) -> Dict[str, Any]:
+    """Aplica a operação num SAVEPOINT; restaura `db.info` (estado dos listeners) se falhar."""
+    info = {k: copy.copy(v) for k, v in db.info.items()}
+    savepoint = db.begin_nested()
+    try:
+        # registrar o id antes: outra requisição com a mesma operação espera ou falha aqui
+        db.add(models.SyncOperacao(op_id=op['id'], tipo=op['tipo']))
+        db.flush()
+        resultado = OPERACOES[op['tipo']](db, op.get('dados') or {}, dono)
+        registro = db.get(models.SyncOperacao, op['id'])
+        registro.resultado = json.dumps(resultado, default=str)
+        db.flush()
+        savepoint.commit()
+        return {'status': APLICADA, 'resultado': resultado}
+    except IntegrityError as e:
+        savepoint.rollback()
+        db.info.clear()
+        db.info.update(info)
+        duplicada = _ja_aplicadas(db, [op['id']])
+        if op['id'] in duplicada:
+            return {'status': DUPLICADA, 'resultado': duplicada[op['id']]}
+        return {'status': ERRO, 'erro': str(e.orig)}
+    except Exception as e:
+        savepoint.rollback()
+        db.info.clear()
+        db.info.update(info)
+        return {'status': ERRO, 'erro': str(e)}
+
+
+def aplicar(
+    operacoes: List[Any],
+    dono: Dono,
+    parar_no_erro: bool = False,
+    lote: int = SYNC_LOTE_TAMANHO,
+) -> List[Dict[str, Any]]:
+    """Aplica as operações em ordem, `lote` por transação. Retorna um resultado por operação."""
+    resultados: List[Dict[str, Any]] = []
+    parar = False
+    for inicio in range(0, len(operacoes), lote):
+        bloco = operacoes[inicio:inicio + lote]
+        if parar:
+            resultados.extend({'id': _id(op), 'status': IGNORADA} for op in bloco)
+            continue
+        db = SessaoLote(**SessionLocal.kw)
+        parciais: List[Dict[str, Any]] = []
+        try:
+            validos = [op['id'] for op in bloco if _validar(op) is None]
+            aplicadas = _ja_aplicadas(db, validos) if validos else {}
+            db.adiar_commit = True
+            for op in bloco:
+                if parar:
+                    parciais.append({'id': _id(op), 'status': IGNORADA})
+                    continue
+                erro = _validar(op)
+                if erro:
+                    r = {'status': ERRO, 'erro': erro}
+                elif op['id'] in aplicadas:
+                    r = {'status': DUPLICADA, 'resultado': aplicadas[op['id']]}
+                else:
+                    r = _aplicar_uma(db, op, dono)
+                    if r['status'] == APLICADA:
+                        aplicadas[op['id']] = r['resultado']
+                parciais.append({'id': _id(op), 'tipo': op.get('tipo') if isinstance(op, dict) else None, **r})
+                parar = parar_no_erro and r['status'] == ERRO
+            db.adiar_commit = False
+            db.commit()
+        except Exception as e:
+            db.adiar_commit = False
+            db.rollback()
+            logger.exception('Falha confirmando bloco de sincronização: %s', e)
+            erro = f'bloco não confirmado: {e}'
+            parciais = [
+                {**r, 'status': ERRO, 'erro': erro} if r['status'] == APLICADA else r
+                for r in parciais
+            ]
+            # falha antes/no meio do laço (BEGIN, leitura das já aplicadas): as operações
+            # sem resultado também falharam, nunca podem sumir da resposta
+            parciais.extend(
+                {'id': _id(op), 'tipo': op.get('tipo') if isinstance(op, dict) else None, 'status': ERRO, 'erro': erro}
+                for op in bloco[len(parciais):]
+            )
+            parar = True
+        finally:
+            db.close()
+        resultados.extend(parciais)
+    return resultados
+
+
+def _id(op: Any) -> Any:
+    return op.get('id') if isinstance(op, dict) else None
+
+
+# ----- Limpeza -----
+def purgar_antigas(dias: float = SYNC_RETENCAO_DIAS) -> int:
+    limite = datetime.now(timezone.utc) - timedelta(days=dias)
+    with SessionLocal() as db:
+        total = db.execute(delete(models.SyncOperacao).where(models.SyncOperacao.created_at < limite)).rowcount
+        db.commit()
+    if total:
+        logger.info('%s registros de sincronização removidos', total)
+    return total
+
+
+def tarefa_purgar() -> int:
+    """Entrada usada por `backend.tarefas`."""
+    return purgar_antigas()
@@ -0,0 +1,285 @@
+"""Fechamentos diários de estoque (snapshots) e consultas históricas.
+
+`movimentacoes_estoque` é um livro-razão só de inserção: responder "estoque do
+produto X na data D" ou "totais por produto no período" varrendo a tabela toda
+não escala (auditorias de um ano estouravam o tempo limite). Aqui:
+
+- `agregar` incorpora as movimentações novas em `estoque_snapshots` (uma linha
+  por produto/dia, dia UTC de `created_at`). A marca d'água (último id agregado)
+  fica na tabela `contadores` (escopo `estoque_snapshot`) e é gravada na mesma
+  transação dos snapshots, então rodar de novo nunca conta uma movimentação duas
+  vezes. Movimentações com menos de `SNAPSHOT_ESTOQUE_ATRASO_SEGUNDOS` ficam para a
+  próxima rodada: uma transação ainda aberta pode gravar um id menor que a marca.
+- As consultas usam os snapshots + a "cauda" ainda não agregada (id > marca), então
+  o resultado é correto mesmo com o agregador atrasado.
+- A agregação roda periodicamente (`backend.tarefas`, a cada
+  `SNAPSHOT_ESTOQUE_INTERVALO_SEGUNDOS`; 0 desliga) e pode ser chamada pela CLI:
+
+    python -m backend.snapshots_estoque              # agrega o pendente
+    python -m backend.snapshots_estoque --reconstruir
+"""
+import argparse
+import os
+import pathlib
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+if __package__ in (None, ''):
+    project_root_str = str(pathlib.Path(__file__).resolve().parents[1])
+    if project_root_str not in sys.path:
+        sys.path.insert(0, project_root_str)
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.orm import Session
+
+from backend import models, sequencias
+from backend.logging_config import logger
+
+ESCOPO_MARCA = 'estoque_snapshot'
+SNAPSHOT_ESTOQUE_INTERVALO_SEGUNDOS = float(os.environ.get('SNAPSHOT_ESTOQUE_INTERVALO_SEGUNDOS', '300'))
+SNAPSHOT_ESTOQUE_LOTE = int(os.environ.get('SNAPSHOT_ESTOQUE_LOTE', '5000'))
+SNAPSHOT_ESTOQUE_ATRASO_SEGUNDOS = float(os.environ.get('SNAPSHOT_ESTOQUE_ATRASO_SEGUNDOS', '60'))
+
+Mov = models.MovimentacaoEstoque
+Snap = models.EstoqueSnapshot
+
+
+def _utc_naive(instante: datetime) -> datetime:
+    # created_at é gravado em UTC sem fuso (SQLite descarta o tzinfo)
+    if instante.tzinfo is not None:
+        instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+    return instante
+
+
+def _inicio_do_dia(dia: date) -> datetime:
+    return datetime.combine(dia, time.min)
+
+
+def marca_atual(db: Session) -> int:
+    """Id da última movimentação já incorporada aos snapshots."""
+    return sequencias.valor_atual(db, ESCOPO_MARCA)
+
+
+# ----------------- Agregação -----------------
+def _travar_marca(db: Session) -> int:
+    """Cria/trava a linha da marca d'água antes de ler (dois agregadores não processam o mesmo lote)."""
+    sequencias._criar_se_ausente(db, ESCOPO_MARCA, 0)
+    db.execute(
+        update(models.Contador)
+        .where(models.Contador.escopo == ESCOPO_MARCA)
+        .values(updated_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return marca_atual(db)
+
+
+def _agregar_lote(db: Session, lote: int, limite_created_at: datetime) -> int:
+    marca = _travar_marca(db)
+    movs = db.execute(
+        select(Mov.id, Mov.produto_id, Mov.tipo, Mov.quantidade, Mov.quantidade_anterior, Mov.quantidade_nova, Mov.created_at)
+        .where(Mov.id > marca)
+        .order_by(Mov.id)
+        .limit(lote)
+    ).all()
+    # Parar na primeira movimentação recente demais (ver docstring do módulo)
+    for i, m in enumerate(movs):
+        if m.created_at is not None and m.created_at > limite_created_at:
+            movs = movs[:i]
+            break
+    if not movs:
+        db.rollback()
+        return 0
+
+    grupos: Dict[tuple, List[Any]] = {}
+    for m in movs:
+        dia = (m.created_at or limite_created_at).date()
+        grupos.setdefault((m.produto_id, dia), []).append(m)
+
+    produto_ids = {pid for pid, _ in grupos}
+    dias = {dia for _, dia in grupos}
+    existentes = {
+        (s.produto_id, s.dia): s
+        for s in db.query(Snap).filter(Snap.produto_id.in_(produto_ids), Snap.dia.in_(dias))
+        if (s.produto_id, s.dia) in grupos
+    }
+    for (produto_id, dia), itens in grupos.items():
+        snap = existentes.get((produto_id, dia))
+        if snap is None:
+            snap = Snap(produto_id=produto_id, dia=dia, entradas=0, saidas=0, movimentacoes=0,
+                        quantidade_abertura=itens[0].quantidade_anterior)
+            db.add(snap)
+        for m in itens:
+            if m.tipo == 'saida':
+                snap.saidas += int(m.quantidade)
+            else:
+                snap.entradas += int(m.quantidade)
+        snap.movimentacoes += len(itens)
+        # itens em ordem de id: o último define o fechamento do dia
+        snap.quantidade_fechamento = itens[-1].quantidade_nova
+        snap.ultima_movimentacao_id = itens[-1].id
+
+    sequencias.garantir_minimo(db, ESCOPO_MARCA, movs[-1].id)
+    db.commit()
+    return len(movs)
+
+
+def agregar(db: Session, lote: int = SNAPSHOT_ESTOQUE_LOTE, max_lotes: Optional[int] = None) -> int:
+    """Incorpora as movimentações pendentes aos snapshots (um commit por lote). Retorna quantas foram agregadas."""
+    limite = _utc_naive(datetime.now(timezone.utc)) - timedelta(seconds=SNAPSHOT_ESTOQUE_ATRASO_SEGUNDOS)
+    total = lotes = 0
+    while max_lotes is None or lotes < max_lotes:
+        try:
+            n = _agregar_lote(db, lote, limite)
+        except Exception:
+            db.rollback()
+            raise
+        total += n
+        lotes += 1
+        if n < lote:
+            break
+    if total:
+        logger.info('Snapshots de estoque: %s movimentações agregadas', total)
+    return total
+
+
+def reconstruir(db: Session, lote: int = SNAPSHOT_ESTOQUE_LOTE) -> int:
+    """Apaga os snapshots e agrega o livro-razão inteiro de novo."""
+    db.execute(delete(Snap))
+    sequencias._criar_se_ausente(db, ESCOPO_MARCA, 0)
+    db.execute(update(models.Contador).where(models.Contador.escopo == ESCOPO_MARCA).values(valor=0))
+    db.commit()
+    return agregar(db, lote=lote)
+
+
+def tarefa_agregar() -> int:
+    """Entrada usada por `backend.tarefas` (sessão própria)."""
+    from backend.database import Session as SessionLocal
+
+    with SessionLocal() as db:
+        return agregar(db)
+
+
+# ----------------- Consultas -----------------
+def _ultimas(db: Session, filtro, produto_ids: Optional[Iterable[int]]) -> Dict[int, int]:
+    """quantidade_nova da última movimentação (por id) de cada produto que satisfaz `filtro`."""
+    sub = select(Mov.produto_id, func.max(Mov.id).label('id')).where(filtro)
+    if produto_ids is not None:
+        sub = sub.where(Mov.produto_id.in_(list(produto_ids)))
+    sub = sub.group_by(Mov.produto_id).subquery()
+    rows = db.execute(select(Mov.produto_id, Mov.quantidade_nova).join(sub, Mov.id == sub.c.id)).all()
+    return {r.produto_id: r.quantidade_nova for r in rows}
+
+
+def fechamentos_antes(db: Session, dia: date, produto_ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+    """Estoque de cada produto no início de `dia` (snapshots anteriores + cauda não agregada)."""
+    produto_ids = list(produto_ids) if produto_ids is not None else None
+    sub = select(Snap.produto_id, func.max(Snap.dia).label('dia')).where(Snap.dia < dia)
+    if produto_ids is not None:
+        sub = sub.where(Snap.produto_id.in_(produto_ids))
+    sub = sub.group_by(Snap.produto_id).subquery()
+    rows = db.execute(
+        select(Snap.produto_id, Snap.quantidade_fechamento)
+        .join(sub, (Snap.produto_id == sub.c.produto_id) & (Snap.dia == sub.c.dia))
+    ).all()
+    resultado = {r.produto_id: r.quantidade_fechamento for r in rows}
+    # a cauda é posterior (no livro-razão) a tudo que já foi agregado
+    cauda = _ultimas(db, (Mov.id > marca_atual(db)) & (Mov.created_at < _inicio_do_dia(dia)), produto_ids)
+    resultado.update(cauda)
+    return resultado
+
+
+def estoque_em(db: Session, produto_id: int, instante: datetime) -> Dict[str, Any]:
+    """Estoque de `produto_id` em `instante` (UTC se sem fuso)."""
+    instante = _utc_naive(instante)
+    inicio = _inicio_do_dia(instante.date())
+    # 1) movimentação no próprio dia até o instante (intervalo curto no índice produto/created_at)
+    no_dia = _ultimas(db, (Mov.created_at >= inicio) & (Mov.created_at <= instante), [produto_id])
+    if produto_id in no_dia:
+        return {'produto_id': produto_id, 'em': instante, 'quantidade': no_dia[produto_id], 'fonte': 'movimentacoes'}
+    # 2) fechamento do último dia anterior com movimentação
+    anteriores = fechamentos_antes(db, instante.date(), [produto_id])
+    if produto_id in anteriores:
+        return {'produto_id': produto_id, 'em': instante, 'quantidade': anteriores[produto_id], 'fonte': 'snapshot'}
+    # 3) sem histórico até o instante: estoque antes da primeira movimentação posterior, ou o atual
+    primeira = db.execute(
+        select(Mov.quantidade_anterior).where(Mov.produto_id == produto_id, Mov.created_at > instante)
+        .order_by(Mov.created_at, Mov.id).limit(1)
+    ).scalar()
+    if primeira is not None:
+        return {'produto_id': produto_id, 'em': instante, 'quantidade': primeira, 'fonte': 'movimentacoes'}
+    produto = db.get(models.Produto, produto_id)
+    if produto is None:
+        raise LookupError(f'Produto {produto_id} não encontrado')
+    return {'produto_id': produto_id, 'em': instante, 'quantidade': int(produto.estoque or 0), 'fonte': 'produto'}
+
+
+def resumo_periodo(db: Session, desde: date, ate: date, produto_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Totais por produto entre `desde` e `ate` (dias UTC, inclusive) e estoques inicial/final."""
+    if ate < desde:
+        raise ValueError('ate deve ser maior ou igual a desde')
+    produto_ids = [produto_id] if produto_id is not None else None
+    totais: Dict[int, Dict[str, int]] = {}
+
+    def somar(pid, entradas, saidas, movimentacoes):
+        t = totais.setdefault(pid, {'entradas': 0, 'saidas': 0, 'movimentacoes': 0})
+        t['entradas'] += int(entradas or 0)
+        t['saidas'] += int(saidas or 0)
+        t['movimentacoes'] += int(movimentacoes or 0)
+
+    q = (
+        select(Snap.produto_id, func.sum(Snap.entradas), func.sum(Snap.saidas), func.sum(Snap.movimentacoes))
+        .where(Snap.dia >= desde, Snap.dia <= ate)
+        .group_by(Snap.produto_id)
+    )
+    if produto_id is not None:
+        q = q.where(Snap.produto_id == produto_id)
+    for row in db.execute(q):
+        somar(*row)
+
+    e_saida = Mov.tipo == 'saida'
+    q = (
+        select(
+            Mov.produto_id,
+            func.sum(case((e_saida, 0), else_=Mov.quantidade)),
+            func.sum(case((e_saida, Mov.quantidade), else_=0)),
+            func.count(Mov.id),
+        )
+        .where(Mov.id > marca_atual(db), Mov.created_at >= _inicio_do_dia(desde), Mov.created_at < _inicio_do_dia(ate + timedelta(days=1)))
+        .group_by(Mov.produto_id)
+    )
+    if produto_id is not None:
+        q = q.where(Mov.produto_id == produto_id)
+    for row in db.execute(q):
+        somar(*row)
+
+    iniciais = fechamentos_antes(db, desde, produto_ids)
+    finais = fechamentos_antes(db, ate + timedelta(days=1), produto_ids)
+    resultado = []
+    for pid in sorted(set(totais) | set(finais)):
+        t = totais.get(pid, {'entradas': 0, 'saidas': 0, 'movimentacoes': 0})
+        final = finais.get(pid)
+        inicial = iniciais.get(pid)
+        if inicial is None and final is not None:
+            # produto sem histórico antes do período
+            inicial = final - t['entradas'] + t['saidas'] if t['movimentacoes'] else final
+        resultado.append({'produto_id': pid, **t, 'estoque_inicial': inicial, 'estoque_final': final})
+    return resultado
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reconstruir', action='store_true', help='apaga e recria todos os snapshots')
+    parser.add_argument('--lote', type=int, default=SNAPSHOT_ESTOQUE_LOTE)
+    args = parser.parse_args(argv)
+
+    from backend.database import Session as SessionLocal, Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        n = reconstruir(db, lote=args.lote) if args.reconstruir else agregar(db, lote=args.lote)
+        logger.info('%s movimentações agregadas; marca d\'água em %s', n, marca_atual(db))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Tarefas periódicas em processo (agregação de snapshots, limpezas).
+
+Uma única thread daemon executa as tarefas registradas quando vencem; uma tarefa
+lenta só atrasa as outras, nunca os requests. Falhas são registradas no log e a
+tarefa roda de novo no próximo intervalo. Com vários workers cada processo roda
+as suas cópias: as tarefas devem ser idempotentes (e travar o que precisarem no
+banco). `TAREFAS_ATIVAS=0` desliga todas (ex: workers extras ou testes).
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from backend.logging_config import logger
+
+TAREFAS_ATIVAS = os.environ.get('TAREFAS_ATIVAS', '1').lower() not in ('0', 'false', 'no')
+
+
+@dataclass
+class Tarefa:
+    nome: str
+    intervalo: float
+    funcao: Callable[[], Any]
+    proxima: float = 0.0
+    execucoes: int = 0
+    falhas: int = 0
+    ultima_duracao_ms: Optional[float] = None
+    ultimo_resultado: Any = None
+    ultimo_erro: Optional[str] = None
+    # execução manual (`executar`) e a thread do agendador nunca rodam a mesma tarefa juntas
+    em_execucao: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+
+class Agendador:
+    def __init__(self, ativo: bool = TAREFAS_ATIVAS):
+        self.ativo = ativo
+        self._tarefas: Dict[str, Tarefa] = {}
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def registrar(self, nome: str, intervalo: float, funcao: Callable[[], Any], atraso_inicial: float = 0.0) -> None:
+        """Registra (ou substitui) uma tarefa; `intervalo <= 0` não registra."""
+        if intervalo <= 0:
+            logger.info('Tarefa %s desativada (intervalo %s)', nome, intervalo)
+            return
+        with self._lock:
+            self._tarefas[nome] = Tarefa(nome, intervalo, funcao, proxima=time.monotonic() + atraso_inicial)
+        self._acordar.set()
+
+    def executar(self, nome: str) -> Any:
+        """Executa a tarefa agora, na thread atual, e reagenda a próxima execução."""
+        with self._lock:
+            tarefa = self._tarefas.get(nome)
+        if tarefa is None:
+            raise KeyError(nome)
+        return self._rodar(tarefa, propagar=True)
+
+    def _rodar(self, tarefa: Tarefa, propagar: bool = False) -> Any:
+        with tarefa.em_execucao:
+            inicio = time.perf_counter()
+            try:
+                resultado = tarefa.funcao()
+                tarefa.ultimo_resultado, tarefa.ultimo_erro = resultado, None
+                return resultado
+            except Exception as e:
+                tarefa.falhas += 1
+                tarefa.ultimo_erro = str(e)
+                if propagar:
+                    raise
+                logger.exception('Falha na tarefa %s', tarefa.nome)
+            finally:
+                tarefa.execucoes += 1
+                tarefa.ultima_duracao_ms = round((time.perf_counter() - inicio) * 1000, 2)
+                tarefa.proxima = time.monotonic() + tarefa.intervalo
+
+    def _loop(self) -> None:
+        while not self._parar.is_set():
+            agora = time.monotonic()
+            with self._lock:
+                tarefas = list(self._tarefas.values())
+            for tarefa in tarefas:
+                if tarefa.proxima <= agora and not self._parar.is_set():
+                    self._rodar(tarefa)
+            with self._lock:
+                proxima = min((t.proxima for t in self._tarefas.values()), default=time.monotonic() + 60)
+            self._acordar.wait(max(proxima - time.monotonic(), 0.05))
+            self._acordar.clear()
+
+    def iniciar(self) -> None:
+        if not self.ativo or self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name='tarefas', daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout: float = 5.0) -> None:
+        self._parar.set()
+        self._acordar.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def estatisticas(self) -> Dict[str, Any]:
+        agora = time.monotonic()
+        with self._lock:
+            return {
+                'ativo': self.ativo and self._thread is not None,
+                'tarefas': {
+                    t.nome: {
+                        'intervalo_segundos': t.intervalo,
+                        'proxima_em_segundos': round(max(t.proxima - agora, 0), 1),
+                        'execucoes': t.execucoes,
+                        'falhas': t.falhas,
+                        'ultima_duracao_ms': t.ultima_duracao_ms,
+                        'ultimo_resultado': t.ultimo_resultado,
+                        'ultimo_erro': t.ultimo_erro,
+                    }
+                    for t in self._tarefas.values()
+                },
+            }
+
+
+agendador = Agendador()
@@ -0,0 +1,80 @@
+"""Fixtures da suíte: a API sobre um SQLite temporário, preparado uma vez por sessão.
+
+    python -m pytest backend/tests
+"""
+import os
+import tempfile
+import uuid
+
+_DIRETORIO = tempfile.mkdtemp(prefix='choperia-testes-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_DIRETORIO, 'testes.db')}"
+# bcrypt na própria thread e com custo mínimo: os testes não precisam do pool de processos
+os.environ['SENHAS_PROCESSOS'] = '0'
+os.environ['BCRYPT_ROUNDS'] = '4'
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import models
+from backend.database import Session as SessionLocal, engine_leitura
+from backend.main import app
+
+
+@pytest.fixture(scope='session')
+def api():
+    """App com o startup executado (schema, migrações e carga inicial)."""
+    with TestClient(app):
+        yield app
+
+
+@pytest.fixture
+def cliente(api):
+    """Cliente HTTP sem cookies (anônimo)."""
+    return TestClient(api)
+
+
+@pytest.fixture
+def cliente_logado(api):
+    """Cliente com um usuário recém-cadastrado (cookie `access_token`)."""
+    c = TestClient(api)
+    email = f'teste-{uuid.uuid4().hex[:10]}@exemplo.com'
+    r = c.post('/auth/register', json={'nome': 'Teste', 'email': email, 'password': 'segredo123'})
+    assert r.status_code == 200, r.text
+    c.usuario_id = r.json()['id']
+    return c
+
+
+@pytest.fixture
+def administrador(cliente_logado):
+    """`cliente_logado` promovido a administrador (`is_superuser`)."""
+    with SessionLocal() as escrita:
+        escrita.get(models.User, cliente_logado.usuario_id).is_superuser = True
+        escrita.commit()
+    return cliente_logado
+
+
+@pytest.fixture
+def db(api):
+    # BEGIN DEFERRED: ler no teste não segura o lock de escrita que as requisições precisam
+    with SessionLocal(bind=engine_leitura) as sessao:
+        yield sessao
+
+
+@pytest.fixture
+def produto(api):
+    """Produto novo (preço 10,00, estoque 100) para o teste mexer sem afetar os outros."""
+    # sessão de escrita (BEGIN IMMEDIATE): lê a categoria e grava na mesma transação
+    with SessionLocal() as escrita:
+        base = escrita.query(models.Produto).first()
+        sufixo = uuid.uuid4().hex[:10]
+        p = models.Produto(
+            nome=f'Produto teste {sufixo}', categoria_id=base.categoria_id, empresa_id=base.empresa_id,
+            descricao='produto de teste', custo=5, venda=10, codigo=f'T-{sufixo}', estoque=100,
+            disponivel=True, slug=f'produto-teste-{sufixo}',
+        )
+        escrita.add(p)
+        escrita.commit()
+        escrita.refresh(p)
+        escrita.expunge(p)
+        escrita.rollback()
+    return p
@@ -0,0 +1,131 @@
+"""`Carrinho.total` mantido por delta: confere com a soma dos itens após cada operação."""
+import uuid
+from decimal import Decimal
+
+from fastapi.testclient import TestClient
+
+from backend import carrinho_sessao, models
+
+
+def _total_pelos_itens(db, carrinho_id):
+    db.rollback()
+    itens = db.query(models.CarrinhoItem).filter_by(carrinho_id=carrinho_id).all()
+    return sum((Decimal(str(i.subtotal)) for i in itens), Decimal('0'))
+
+
+def _confere(db, resposta):
+    assert resposta.status_code == 200, resposta.text
+    corpo = resposta.json()
+    assert Decimal(str(corpo['total'])) == _total_pelos_itens(db, corpo['id'])
+    db.rollback()
+    assert Decimal(str(db.get(models.Carrinho, corpo['id']).total)) == Decimal(str(corpo['total']))
+    return corpo
+
+
+def _item(corpo, produto_id):
+    return next(i for i in corpo['itens'] if i['produto_id'] == produto_id)
+
+
+def test_total_acompanha_adicionar_alterar_e_remover(cliente_logado, db, produto):
+    c = cliente_logado
+    corpo = _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 2, 'venda': 10}))
+    assert Decimal(str(corpo['total'])) == Decimal('20')
+
+    # mesmo produto de novo: soma no item existente (upsert), não cria outro
+    corpo = _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 1, 'venda': 10}))
+    assert len(corpo['itens']) == 1 and Decimal(str(corpo['total'])) == Decimal('30')
+
+    item_id = _item(corpo, produto.id)['id']
+    corpo = _confere(db, c.patch(f'/carrinho/items/{item_id}', json={'quantidade': 5}))
+    assert Decimal(str(corpo['total'])) == Decimal('50')
+
+    corpo = _confere(db, c.delete(f'/carrinho/items/{item_id}'))
+    assert corpo['itens'] == [] and Decimal(str(corpo['total'])) == Decimal('0')
+
+
+def test_total_com_varios_produtos_e_precos_quebrados(cliente_logado, db, produto):
+    c = cliente_logado
+    outro = db.query(models.Produto).filter(models.Produto.id != produto.id).first()
+    _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 3, 'venda': 10.1}))
+    corpo = _confere(db, c.post('/carrinho/items', json={'produto_id': outro.id, 'quantidade': 7, 'venda': 0.7}))
+    assert Decimal(str(corpo['total'])) == Decimal('35.2')
+
+    corpo = _confere(db, c.patch(f"/carrinho/items/{_item(corpo, outro.id)['id']}", json={'quantidade': 1}))
+    assert Decimal(str(corpo['total'])) == Decimal('31')
+
+
+def test_substituir_conteudo_recalcula_o_total(cliente_logado, db, produto):
+    c = cliente_logado
+    _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 4, 'venda': 10}))
+    corpo = _confere(db, c.put('/carrinho/', json={'itens': [
+        {'produto_id': produto.id, 'quantidade': 1, 'venda': 10},
+        {'produto_id': produto.id, 'quantidade': 1, 'venda': 10},
+    ]}))
+    # repetidos são somados
+    assert len(corpo['itens']) == 1 and Decimal(str(corpo['total'])) == Decimal('20')
+
+    corpo = _confere(db, c.put('/carrinho/', json={'itens': [{'produto_id': produto.id, 'quantidade': 0}]}))
+    assert corpo['itens'] == [] and Decimal(str(corpo['total'])) == Decimal('0')
+
+
+def test_limpar_zera_o_total(cliente_logado, db, produto):
+    c = cliente_logado
+    corpo = _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 2, 'venda': 10}))
+    assert c.post('/carrinho/clear', json={'cart_id': corpo['id']}).json() == {'ok': True}
+    db.rollback()
+    assert Decimal(str(db.get(models.Carrinho, corpo['id']).total)) == Decimal('0')
+    assert _total_pelos_itens(db, corpo['id']) == Decimal('0')
+
+
+def test_user_id_do_payload_nao_da_acesso_ao_carrinho_de_outro(cliente, cliente_logado, db, produto):
+    dono = _confere(db, cliente_logado.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 1}))
+    item_id = _item(dono, produto.id)['id']
+
+    # anônimo dizendo ser o dono: cai na própria sessão
+    corpo = _confere(db, cliente.post('/carrinho/items', json={'produto_id': produto.id, 'user_id': cliente_logado.usuario_id}))
+    assert corpo['id'] != dono['id']
+
+    assert cliente.patch(f'/carrinho/items/{item_id}', json={'quantidade': 9}).status_code == 404
+    assert cliente.delete(f'/carrinho/items/{item_id}').status_code == 404
+    assert cliente.post('/carrinho/clear', json={'cart_id': dono['id']}).status_code == 404
+    assert cliente_logado.get('/carrinho/').json()['itens'][0]['quantidade'] == 1
+
+
+def _cadastrar(c):
+    email = f'teste-{uuid.uuid4().hex[:10]}@exemplo.com'
+    r = c.post('/auth/register', json={'nome': 'Teste', 'email': email, 'password': 'segredo123'})
+    assert r.status_code == 200, r.text
+    return email
+
+
+def test_login_mescla_o_carrinho_anonimo(api, db, produto):
+    outro = db.query(models.Produto).filter(models.Produto.id != produto.id).first()
+    logado, anonimo = TestClient(api), TestClient(api)
+    email = _cadastrar(logado)
+    logado.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 3, 'venda': 10})
+
+    anonimo.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 2, 'venda': 10})
+    anonimo.post('/carrinho/items', json={'produto_id': outro.id, 'quantidade': 1, 'venda': 4})
+    sessao = anonimo.cookies.get(carrinho_sessao.CARRINHO_COOKIE)
+    assert sessao
+
+    assert anonimo.post('/auth/login', json={'email': email, 'password': 'segredo123'}).status_code == 200
+    assert anonimo.cookies.get(carrinho_sessao.CARRINHO_COOKIE) is None
+    corpo = _confere(db, anonimo.get('/carrinho/'))
+    assert _item(corpo, produto.id)['quantidade'] == 5 and _item(corpo, outro.id)['quantidade'] == 1
+    assert Decimal(str(corpo['total'])) == Decimal('54')
+    db.rollback()
+    assert db.query(models.Carrinho).filter_by(session_id=sessao).count() == 0
+
+
+def test_cadastro_assume_o_carrinho_anonimo(api, db, produto):
+    c = TestClient(api)
+    anonimo = _confere(db, c.post('/carrinho/items', json={'produto_id': produto.id, 'quantidade': 2, 'venda': 10}))
+    _cadastrar(c)
+    assert c.cookies.get(carrinho_sessao.CARRINHO_COOKIE) is None
+    corpo = _confere(db, c.get('/carrinho/'))
+    # sem carrinho próprio, o da sessão só troca de dono
+    assert corpo['id'] == anonimo['id'] and _item(corpo, produto.id)['quantidade'] == 2
+    db.rollback()
+    cart = db.get(models.Carrinho, corpo['id'])
+    assert cart.user_id is not None and cart.session_id is None
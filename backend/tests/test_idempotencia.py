@@ -0,0 +1,102 @@
+"""Idempotency-Key: replay da resposta, 422 com outro corpo, 409 em andamento."""
+import json
+import uuid
+
+from backend import idempotencia, models
+
+
+def _mesa(db):
+    return db.query(models.Mesa).order_by(models.Mesa.id).first()
+
+
+def _corpo(produto, quantidade=1):
+    return json.dumps({'produto_id': produto.id, 'quantidade': quantidade, 'usuario_id': 1}).encode()
+
+
+def _post(cliente, caminho, corpo, chave):
+    return cliente.post(caminho, content=corpo, headers={'Content-Type': 'application/json', idempotencia.CABECALHO: chave})
+
+
+def _itens(db, produto):
+    db.rollback()
+    return db.query(models.PedidoItem).filter_by(produto_id=produto.id).count()
+
+
+def test_reenvio_devolve_a_resposta_gravada_sem_reexecutar(cliente, db, produto):
+    caminho, chave = f'/mesas/{_mesa(db).id}/itens', uuid.uuid4().hex
+    r1 = _post(cliente, caminho, _corpo(produto), chave)
+    r2 = _post(cliente, caminho, _corpo(produto), chave)
+
+    assert r1.status_code == 200, r1.text
+    assert 'idempotent-replayed' not in r1.headers
+    assert r2.status_code == 200 and r2.headers['idempotent-replayed'] == 'true'
+    assert r2.content == r1.content
+    assert _itens(db, produto) == 1
+
+
+def test_reenvio_depois_de_esvaziar_o_cache_le_do_banco(cliente, db, produto, monkeypatch):
+    caminho, chave = f'/mesas/{_mesa(db).id}/itens', uuid.uuid4().hex
+    r1 = _post(cliente, caminho, _corpo(produto), chave)
+    monkeypatch.setattr(idempotencia, 'cache', idempotencia.CacheRespostas())
+    r2 = _post(cliente, caminho, _corpo(produto), chave)
+
+    assert r2.headers['idempotent-replayed'] == 'true' and r2.content == r1.content
+    assert _itens(db, produto) == 1
+
+
+def test_mesma_chave_com_outro_corpo_responde_422(cliente, db, produto):
+    caminho, chave = f'/mesas/{_mesa(db).id}/itens', uuid.uuid4().hex
+    assert _post(cliente, caminho, _corpo(produto, 1), chave).status_code == 200
+    r = _post(cliente, caminho, _corpo(produto, 2), chave)
+
+    assert r.status_code == 422
+    assert _itens(db, produto) == 1
+
+
+def test_chave_em_andamento_responde_409(cliente, db, produto):
+    caminho, chave = f'/mesas/{_mesa(db).id}/itens', uuid.uuid4().hex
+    corpo = _corpo(produto)
+    # outra requisição com a mesma chave ainda executando
+    assert idempotencia.reivindicar(f'POST {caminho}', chave, idempotencia.hash_requisicao(corpo))[0] == 'nova'
+    r = _post(cliente, caminho, corpo, chave)
+
+    assert r.status_code == 409 and r.headers['retry-after'] == '1'
+    assert _itens(db, produto) == 0
+
+
+def test_resposta_de_erro_libera_a_chave(cliente, db, produto):
+    caminho, chave = '/mesas/999999999/itens', uuid.uuid4().hex
+    r1 = _post(cliente, caminho, _corpo(produto), chave)
+    assert r1.status_code >= 400
+
+    registro = db.query(models.ChaveIdempotencia).filter_by(chave=chave).one_or_none()
+    assert registro is None
+    r2 = _post(cliente, caminho, _corpo(produto), chave)
+    assert 'idempotent-replayed' not in r2.headers
+
+
+def test_sem_chave_e_fora_das_rotas_nada_e_gravado(cliente, db, produto):
+    caminho = f'/mesas/{_mesa(db).id}/itens'
+    antes = db.query(models.ChaveIdempotencia).count()
+    cliente.post(caminho, content=_corpo(produto), headers={'Content-Type': 'application/json'})
+    cliente.get('/produtos/', headers={idempotencia.CABECALHO: uuid.uuid4().hex})
+
+    assert db.query(models.ChaveIdempotencia).count() == antes
+    assert _itens(db, produto) == 1
+
+
+def test_falha_ao_registrar_a_resposta_vira_500_e_segura_a_chave(cliente, db, produto, monkeypatch):
+    caminho, chave = f'/mesas/{_mesa(db).id}/itens', uuid.uuid4().hex
+    chamadas = []
+
+    def concluir(*args, **kwargs):
+        chamadas.append(args)
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(idempotencia, 'concluir', concluir)
+    r1 = _post(cliente, caminho, _corpo(produto), chave)
+    assert r1.status_code == 500 and len(chamadas) == 1
+    # a escrita aconteceu; o reenvio não executa de novo enquanto a chave está em andamento
+    r2 = _post(cliente, caminho, _corpo(produto), chave)
+    assert r2.status_code == 409
+    assert _itens(db, produto) == 1
@@ -0,0 +1,40 @@
+"""Instrumentação SQL: configuração restrita a administradores e Server-Timing."""
+import pytest
+
+from backend import instrumentacao
+
+
+@pytest.fixture
+def administrador(administrador):
+    yield administrador
+    instrumentacao.instrumentacao.desligar()
+
+
+def test_configurar_exige_administrador(cliente, cliente_logado):
+    assert cliente.put('/instrumentacao/sql', json={'ativo': True}).status_code == 401
+    assert cliente_logado.put('/instrumentacao/sql', json={'ativo': True}).status_code == 403
+    assert cliente_logado.delete('/instrumentacao/sql/lentas').status_code == 403
+    assert instrumentacao.instrumentacao.ativo is False
+
+
+def test_consultas_lentas_exigem_administrador(cliente, cliente_logado):
+    assert cliente.get('/instrumentacao/sql/lentas').status_code == 401
+    assert cliente.get('/instrumentacao/sql/lentas?planos=true').status_code == 401
+    assert cliente_logado.get('/instrumentacao/sql/lentas?planos=true').status_code == 403
+
+
+def test_consultas_lentas_para_administrador(administrador):
+    r = administrador.get('/instrumentacao/sql/lentas?planos=true')
+    assert r.status_code == 200, r.text
+
+
+def test_server_timing_so_com_a_instrumentacao_ligada(administrador):
+    assert 'server-timing' not in administrador.get('/produtos/?limit=1').headers
+
+    r = administrador.put('/instrumentacao/sql', json={'ativo': True})
+    assert r.status_code == 200 and r.json()['ativo'] is True
+    valor = administrador.get('/produtos/?limit=1').headers['server-timing']
+    assert valor.startswith('db;dur=') and 'consultas' in valor and 'app;dur=' in valor
+
+    administrador.put('/instrumentacao/sql', json={'ativo': False})
+    assert 'server-timing' not in administrador.get('/produtos/?limit=1').headers
@@ -0,0 +1,12 @@
+"""Reconciliação de totais de pedidos: restrita a administradores."""
+
+
+def test_reconciliar_totais_exige_administrador(cliente, cliente_logado):
+    assert cliente.post('/pedidos/reconciliar-totais?corrigir=true').status_code == 401
+    assert cliente_logado.post('/pedidos/reconciliar-totais?corrigir=true').status_code == 403
+
+
+def test_reconciliar_totais_para_administrador(administrador):
+    r = administrador.post('/pedidos/reconciliar-totais')
+    assert r.status_code == 200, r.text
+    assert r.json()['corrigidos'] is False
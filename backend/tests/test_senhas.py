@@ -0,0 +1,49 @@
+"""Login: bcrypt sem conexão do banco presa e rehash de custo antigo."""
+import uuid
+
+import bcrypt
+
+from backend import models, senhas
+from backend.database import Session as SessionLocal, engine
+
+
+def _cadastrar(cliente, senha='segredo123'):
+    email = f'login-{uuid.uuid4().hex[:10]}@exemplo.com'
+    assert cliente.post('/auth/register', json={'nome': 'Login', 'email': email, 'password': senha}).status_code == 200
+    return email
+
+
+def test_login_nao_segura_conexao_durante_o_bcrypt(cliente, monkeypatch):
+    email = _cadastrar(cliente)
+    em_uso = []
+    original = senhas.verificar
+
+    def verificar(senha, hash_armazenado):
+        em_uso.append(engine.pool.checkedout())
+        return original(senha, hash_armazenado)
+
+    monkeypatch.setattr(senhas, 'verificar', verificar)
+    assert cliente.post('/auth/login', json={'email': email, 'password': 'segredo123'}).status_code == 200
+    assert cliente.post('/auth/login', json={'email': email, 'password': 'errada'}).status_code == 401
+    assert em_uso == [0, 0]
+
+
+def test_login_refaz_hash_com_custo_antigo(cliente, db):
+    email = _cadastrar(cliente)
+    with SessionLocal() as escrita:
+        user = escrita.query(models.User).filter_by(email=email).one()
+        user.password = bcrypt.hashpw(b'segredo123', bcrypt.gensalt(rounds=5)).decode()
+        escrita.commit()
+        user_id = user.id
+
+    assert cliente.post('/auth/login', json={'email': email, 'password': 'segredo123'}).status_code == 200
+    db.rollback()
+    assert senhas.custo_do_hash(db.get(models.User, user_id).password) == senhas.BCRYPT_ROUNDS
+
+
+def test_encerrar_desabilita_o_pool():
+    pool = senhas.PoolSenhas(processos=1)
+    pool.iniciar()
+    assert pool.ativo
+    pool.encerrar()
+    assert not pool.ativo
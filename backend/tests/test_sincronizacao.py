@@ -0,0 +1,149 @@
+"""`POST /sync/batch`: reenvio, falha parcial, operação malformada e dono da fila."""
+import uuid
+
+from sqlalchemy.exc import OperationalError
+
+from backend import carrinho_sessao, models, sincronizacao
+
+
+def _entrada(produto_id, quantidade=5):
+    return {
+        'id': uuid.uuid4().hex, 'tipo': 'estoque.movimentacao',
+        'dados': {'produto_id': produto_id, 'quantidade': quantidade, 'tipo': 'entrada', 'origem': 'ajuste'},
+    }
+
+
+def _estoque(db, produto_id):
+    db.rollback()
+    return db.get(models.Produto, produto_id).estoque
+
+
+def test_reenvio_da_mesma_operacao_devolve_duplicada(cliente, db, produto):
+    op = _entrada(produto.id)
+    r1 = cliente.post('/sync/batch', json={'operacoes': [op]}).json()
+    r2 = cliente.post('/sync/batch', json={'operacoes': [op]}).json()
+
+    assert r1['ok'] and r1['aplicadas'] == 1
+    assert r2['ok'] and r2['duplicadas'] == 1 and r2['aplicadas'] == 0
+    assert r2['resultados'][0]['resultado'] == r1['resultados'][0]['resultado']
+    assert _estoque(db, produto.id) == 105
+
+
+def test_mesma_operacao_repetida_no_lote_aplica_uma_vez(cliente, db, produto):
+    op = _entrada(produto.id)
+    r = cliente.post('/sync/batch', json={'operacoes': [op, op]}).json()
+
+    assert [x['status'] for x in r['resultados']] == ['aplicada', 'duplicada']
+    assert _estoque(db, produto.id) == 105
+
+
+def test_falha_parcial_desfaz_so_a_operacao(cliente, db, produto):
+    ops = [_entrada(produto.id, 5), _entrada(999999999, 5), _entrada(produto.id, 7)]
+    r = cliente.post('/sync/batch', json={'operacoes': ops}).json()
+
+    assert [x['status'] for x in r['resultados']] == ['aplicada', 'erro', 'aplicada']
+    assert not r['ok'] and r['falhas'] == 1
+    assert _estoque(db, produto.id) == 112
+    # a operação que falhou não fica registrada: o reenvio tenta de novo
+    assert db.get(models.SyncOperacao, ops[1]['id']) is None
+
+
+def test_parar_no_erro_ignora_as_seguintes(cliente, db, produto):
+    ops = [_entrada(999999999), _entrada(produto.id)]
+    r = cliente.post('/sync/batch', json={'operacoes': ops, 'parar_no_erro': True}).json()
+
+    assert [x['status'] for x in r['resultados']] == ['erro', 'ignorada']
+    assert _estoque(db, produto.id) == 100
+
+
+def test_operacao_malformada_vira_erro_sem_perder_o_bloco(cliente, db, produto):
+    ops = [
+        _entrada(produto.id),
+        {'id': uuid.uuid4().hex, 'tipo': ['x'], 'dados': {}},
+        {'id': uuid.uuid4().hex, 'tipo': {'a': 1}},
+        {'tipo': 'estoque.movimentacao'},
+        'não é objeto',
+        _entrada(produto.id),
+    ]
+    r = cliente.post('/sync/batch', json={'operacoes': ops}).json()
+
+    assert [x['status'] for x in r['resultados']] == ['aplicada', 'erro', 'erro', 'erro', 'erro', 'aplicada']
+    assert not r['ok']
+    assert _estoque(db, produto.id) == 110
+
+
+def test_falha_do_bloco_devolve_erro_para_todas(cliente, db, produto, monkeypatch):
+    def travado(*args, **kwargs):
+        raise OperationalError('SELECT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(sincronizacao, '_ja_aplicadas', travado)
+    ops = [_entrada(produto.id) for _ in range(5)]
+    r = cliente.post('/sync/batch', json={'operacoes': ops}).json()
+
+    assert not r['ok']
+    assert len(r['resultados']) == 5
+    assert all(x['status'] == 'erro' for x in r['resultados'])
+    assert _estoque(db, produto.id) == 100
+
+
+def test_blocos_seguintes_sao_ignorados_apos_falha_de_bloco(db, produto, monkeypatch):
+    original = sincronizacao._ja_aplicadas
+
+    def falha_no_primeiro(db_, ids):
+        monkeypatch.setattr(sincronizacao, '_ja_aplicadas', original)
+        raise OperationalError('SELECT', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(sincronizacao, '_ja_aplicadas', falha_no_primeiro)
+    ops = [_entrada(produto.id) for _ in range(4)]
+    resultados = sincronizacao.aplicar(ops, sincronizacao.Dono(), lote=2)
+
+    assert [x['status'] for x in resultados] == ['erro', 'erro', 'ignorada', 'ignorada']
+    assert _estoque(db, produto.id) == 100
+
+
+def test_anonimo_nao_escreve_favorito_nem_avaliacao(cliente, db, produto):
+    ops = [
+        {'id': uuid.uuid4().hex, 'tipo': 'favorito.adicionar', 'dados': {'produto_id': produto.id}},
+        {'id': uuid.uuid4().hex, 'tipo': 'avaliacao.salvar', 'dados': {'produto_id': produto.id, 'rating': 5}},
+    ]
+    r = cliente.post('/sync/batch', json={'operacoes': ops}).json()
+
+    assert [x['status'] for x in r['resultados']] == ['erro', 'erro']
+    assert db.query(models.Favorito).filter_by(produto_id=produto.id).count() == 0
+    assert db.query(models.Avaliacao).filter_by(produto_id=produto.id).count() == 0
+
+
+def test_carrinho_anonimo_sem_sessao_nao_cai_no_usuario_1(cliente, db, produto):
+    op = {'id': uuid.uuid4().hex, 'tipo': 'carrinho.definir',
+          'dados': {'itens': [{'produto_id': produto.id, 'quantidade': 2}]}}
+    r = cliente.post('/sync/batch', json={'operacoes': [op]}).json()
+
+    assert r['resultados'][0]['status'] == 'erro'
+    itens = db.query(models.CarrinhoItem).filter_by(produto_id=produto.id).count()
+    assert itens == 0
+
+
+def test_carrinho_anonimo_usa_a_sessao_do_cookie(cliente, db, produto):
+    sessao = carrinho_sessao.novo_id()
+    cliente.cookies.set(carrinho_sessao.CARRINHO_COOKIE, sessao)
+    op = {'id': uuid.uuid4().hex, 'tipo': 'carrinho.definir',
+          'dados': {'itens': [{'produto_id': produto.id, 'quantidade': 2}]}}
+    r = cliente.post('/sync/batch', json={'operacoes': [op]}).json()
+
+    assert r['resultados'][0]['status'] == 'aplicada'
+    cart = db.get(models.Carrinho, r['resultados'][0]['resultado']['carrinho_id'])
+    assert cart.session_id == sessao and cart.user_id is None
+
+
+def test_usuario_logado_escreve_no_proprio_carrinho_e_favoritos(cliente_logado, db, produto):
+    ops = [
+        {'id': uuid.uuid4().hex, 'tipo': 'favorito.adicionar', 'dados': {'produto_id': produto.id}},
+        {'id': uuid.uuid4().hex, 'tipo': 'carrinho.definir',
+         'dados': {'itens': [{'produto_id': produto.id, 'quantidade': 1}]}},
+    ]
+    r = cliente_logado.post('/sync/batch', json={'operacoes': ops}).json()
+
+    assert r['ok'], r
+    assert db.query(models.Favorito).filter_by(produto_id=produto.id).one().user_id == cliente_logado.usuario_id
+    cart = db.get(models.Carrinho, r['resultados'][1]['resultado']['carrinho_id'])
+    assert cart.user_id == cliente_logado.usuario_id
@@ -2,7 +2,6 @@
 //src\api\mesas\itemService.ts
 
 import { ItemMesa } from '@/types/mesa';
-import { decrementarEstoque } from './produtoService';
 import apiServices from '@/services/apiServices';
 import { getNextPedidoNumber } from '@/services/mesaService';
 
@@ -10,8 +9,8 @@ import { getNextPedidoNumber } from '@/services/mesaService';
 export const adicionarItemMesa = async (mesa_id: number, item: ItemMesa, usuario_id?: number): Promise<Record<string, unknown>> => {
   console.log('[itemService] adicionando item à mesa via API', { mesa_id, item, usuario_id });
   try {
-    // Primeiro decrementar o estoque. Se falhar, não adicionamos o item à mesa
-    await decrementarEstoque(item.produto_id, item.quantidade);
+    // O backend reserva o estoque ao incluir o item (409 se não houver saldo) e só o
+    // baixa no pagamento; não decrementar aqui para não contar a venda duas vezes.
 
     // Chamar endpoint /mesas/{mesa_id}/itens para adicionar o item na mesa
     // Quando estamos online, delegar a geração do número ao backend (servidor retorna número sequencial).
@@ -44,18 +43,13 @@ export const adicionarItemMesa = async (mesa_id: number, item: ItemMesa, usuario
     });
 
   if (!res.ok) {
-      // tentar restaurar o estoque se a API de adicionar item falhar
-      try {
-        await fetch(`${import.meta.env.VITE_BACKEND_URL ?? 'http://localhost:8000'}/estoque/movimentacoes`, {
-          method: 'POST',
-          credentials: 'include',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ produto_id: item.produto_id, produtoNome: item.nome || '', quantidade: item.quantidade, tipo: 'entrada', origem: 'cancelamento_venda_fisica', data: new Date().toISOString().split('T')[0], observacoes: 'Rollback: falha ao adicionar item à mesa' })
-        });
-      } catch (rbErr) {
-        console.error('[itemService] rollback falhou ao restaurar estoque:', rbErr);
+      if (res.status === 409) {
+        // sem estoque disponível: não cair no fallback offline
+        const corpo = await res.json().catch(() => ({}));
+        const erro = new Error(corpo?.detail?.erro ?? 'Estoque insuficiente');
+        erro.name = 'EstoqueInsuficiente';
+        throw erro;
       }
-
       throw new Error('Erro ao adicionar item na mesa (servidor)');
     }
 
@@ -92,6 +86,9 @@ export const adicionarItemMesa = async (mesa_id: number, item: ItemMesa, usuario
       return {};
     }
   } catch (error) {
+    if (error instanceof Error && error.name === 'EstoqueInsuficiente') {
+      throw error;
+    }
     console.warn('[itemService] Backend indisponível, usando fallback local:', error);
     
     // FALLBACK: Usar localStorage quando backend está offline